@@ -1,96 +1,389 @@
 import json
 import math
 import time
+from collections import deque
 from concurrent.futures import ProcessPoolExecutor
 
-from celery import group
+from crawler import celery_config
+from crawler.fetch_comments_from_airbnb.tasks import fetch_comments, fetch_comments_batch
+from crawler.utils.engine import get_engine
+from crawler.utils.fetch_data import get_page_reviews, get_page_reviews_count
+from crawler.utils.metrics import Histogram, get_metrics, job_summary
+from crawler.utils.retry import refreshed
+from crawler.utils.routing import route_for
+from crawler.utils.scheduler import FairShareScheduler, Job
+from crawler.utils.shard_store import get_shard_store
+from crawler.utils.streaming import SlidingWindowExecutor, run_task
+from utils.checkpoint import CheckpointStore
+from utils.data_processing import airbnb_csv, airbnb_records_csv
+from utils.dedup import PaginationTracker, ReviewIdSet, load_seen_ids
+from utils.review_sink import ReviewSink
+from utils.shard_merge import merge_listing_shards
 
-from crawler.fetch_comments_from_airbnb.tasks import fetch_comments
-from crawler.fetch_total_comments_from_airbnb.tasks import fetch_total_comments
-from utils.data_processing import airbnb_csv
+# Number of times the offsets where reviews were missed are fetched again before giving up
+MAX_GAP_FILL_ROUNDS = 2
 
+# Where airbnb_run(..., topics=n) saves the topics of the crawled reviews
+TOPICS_OUTPUT_PATH = 'shared_data/airbnb/topics.json'
 
-def airbnb_comments(str_id, batch_size, timeout):
+
+def airbnb_comments(str_id, batch_size, timeout, mode='batch', first_page=None, extract=False, keep_raw=False,
+                    output='json', checkpoint=None, incremental=False, engine=None):
     """
     Fetch comments for a specific Airbnb listing and save them to CSV and JSON files.
 
     Args:
         str_id (str): The Airbnb listing ID.
         batch_size (int): The number of tasks to execute concurrently in a single batch.
-        timeout (int): The maximum time (in seconds) to wait for each batch of tasks to complete.
+            In 'stream' mode this is the number of page tasks kept in flight.
+        timeout (int): The maximum time (in seconds) a single page task may take before it is sent again
+            (up to crawler_page_attempts attempts).
+        mode (str): 'batch' sends the tasks in fixed groups and waits for each group to finish,
+            'stream' keeps `batch_size` tasks in flight and collects results as they arrive.
+        first_page (dict): The already fetched page at offset 0, see probe_first_pages.
+            It is fetched here when not given.
+        extract (bool): Let the workers extract compact review records instead of returning raw responses.
+            The records are saved to airbnb_<id>_reviews.json instead of the raw responses.
+        keep_raw (bool): With `extract`, also fetch the raw responses and save them to airbnb_<id>.json.
+        output (str): 'json' collects all pages and writes the JSON and CSV files at the end,
+            'ndjson' appends every page to airbnb_<id>.ndjson (records), airbnb_<id>.raw.ndjson (raw responses,
+            if available) and the CSV as it arrives, and renames the files into place once the listing completes.
+            Reviews are de-duplicated by ID, and the offsets where reviews were missed because they shifted between
+            pages during the crawl are fetched again.
+        checkpoint (str): Path of a CheckpointStore database (requires output='ndjson'). Written pages are recorded
+            there, and a crawl interrupted earlier resumes with only the missing pages.
+        incremental (bool): With `checkpoint`, only fetch the reviews newer than the newest one of the last
+            completed crawl and append them to the existing output files.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run.
 
     Returns:
         None
     """
+    if checkpoint is not None and output != 'ndjson':
+        raise ValueError("checkpoint requires output='ndjson'")
+
     start_time = time.time()  # Record the start time for performance tracking
     csv_output_path = f'shared_data/airbnb/airbnb_{str_id}.csv'  # Path to save the CSV file
     json_output_path = f'shared_data/airbnb/airbnb_{str_id}.json'  # Path to save the JSON file
+    reviews_output_path = f'shared_data/airbnb/airbnb_{str_id}_reviews.json'  # Path to save the review records
+    ndjson_output_path = f'shared_data/airbnb/airbnb_{str_id}.ndjson'  # Path to stream the review records to
+    ndjson_raw_output_path = f'shared_data/airbnb/airbnb_{str_id}.raw.ndjson'  # Path to stream the raw pages to
 
-    # Fetch the total number of comments for the given listing ID
-    print(f"Fetching number of comments for {str_id}...")
-    total_comments = fetch_total_comments(str_id, offset=0)
+    # Fetch the first page once, it is used both for the total number of comments and as data
+    if first_page is None:
+        print(f"Fetching first page of comments for {str_id}...")
+        # An incremental crawl looks for new reviews, a cached first page would not show them
+        first_page = run_task(fetch_comments.s(str_id=str_id, offset=0, extract=extract, keep_raw=keep_raw,
+                                               refresh=incremental).set(**route_for(None)),
+                              timeout, get_engine(engine), resend=refreshed)
+    total_comments = get_page_reviews_count(first_page)
     print(f"Total comments for {str_id}: {total_comments}")
 
+    store = CheckpointStore(checkpoint) if checkpoint is not None else None
+    done_offsets = set()
+    if store is not None:
+        done_offsets = store.completed_offsets(str_id)
+        newest_review = store.newest_review(str_id)
+        if incremental and newest_review is not None and not done_offsets:
+            # The listing has been crawled completely before, only fetch what is newer
+            airbnb_incremental_comments(str_id, first_page, newest_review, timeout, store,
+                                        ndjson_output_path, csv_output_path, engine)
+            store.close()
+            print(f"Crawler Time Usage: {time.time() - start_time} seconds")
+            return
+        if done_offsets:
+            print(f"Resuming {str_id}: {len(done_offsets)} pages were already written")
+        store.start_listing(str_id, total_comments)
+
     # Calculate the total number of tasks needed to fetch all comments
     comments_per_task = 50  # Each task will fetch 50 comments
     total_tasks = math.ceil(total_comments / comments_per_task)  # Round up to ensure all comments are fetched
     print(f"Total tasks to be created for {str_id}: {total_tasks}")
 
     print(f"Creating tasks for {str_id}...")
-    # Create a list of tasks to be executed by Celery
+    # Create a list of tasks to be executed by Celery, the first page is already there.
+    # The size of the listing decides their queue and priority, small listings overtake large ones.
+    route = route_for(total_tasks - 1)
     tasks = []
-    for i in range(total_tasks):
+    offsets = []  # The offset of every task, to record finished pages in the checkpoint store
+    for i in range(1, total_tasks):
         offset = i * comments_per_task  # Calculate the offset for each task
-        tasks.append(fetch_comments.s(str_id=str_id, offset=offset))  # Add the task to the list
+        if offset in done_offsets:
+            continue  # Already written by an interrupted run
+        # Add the task to the list
+        tasks.append(fetch_comments.s(str_id=str_id, offset=offset, extract=extract, keep_raw=keep_raw).set(**route))
+        offsets.append(offset)
     print(f"All tasks have been created for {str_id}.")
 
-    all_comments = []  # Initialize a list to store all fetched comments
+    fetch_start_time = time.time()  # Only the page fetching is measured for the throughput report
+    latency = Histogram()  # Round trip time of every page fetched from here on, gap re-fetches included
+    if mode == 'stream':
+        print(f"Executing tasks in streaming mode for {str_id}...")
+        page_results = stream_comments(tasks, batch_size, timeout, engine, latency)
+    elif mode == 'batch':
+        print(f"Executing tasks in batches for {str_id}...")
+        page_results = batch_comments(tasks, batch_size, timeout, engine, latency)
+    else:
+        raise ValueError(f"Unknown mode: {mode!r}, expected 'batch' or 'stream'")
+
+    if output == 'ndjson':
+        # Raw responses are only available when the workers return them
+        raw_output_path = ndjson_raw_output_path if not extract or keep_raw else None
+        with ReviewSink(ndjson_output_path, csv_output_path, raw_output_path, resume=bool(done_offsets)) as sink:
+            # Reviews are de-duplicated by ID, a resumed crawl starts with the IDs it has already written.
+            # They are read once the sink has cut off a page the interrupted run left half written.
+            seen = load_seen_ids(ndjson_output_path + '.part') if done_offsets else None
+            tracker = PaginationTracker(comments_per_task, seen)
+
+            # Every page is written as soon as it arrives, nothing accumulates in memory.
+            # A page is only recorded as done once it has been written.
+            # The first page is fetched again for its review count, its raw response is already there.
+            sink.write_page(tracker.add_page(0, first_page), write_raw=0 not in done_offsets)
+            if store is not None:
+                store.mark_page(str_id, 0)
+            for index, page in page_results:
+                sink.write_page(tracker.add_page(offsets[index], page))
+                if store is not None:
+                    store.mark_page(str_id, offsets[index])
+
+            # Offsets drift while reviews are posted during the crawl, fetch again only where reviews were missed
+            for _ in range(MAX_GAP_FILL_ROUNDS):
+                missing = tracker.missing()
+                gap_offsets = tracker.gap_offsets() if missing else []
+                if not gap_offsets:
+                    break
+                print(f"{missing} reviews of {str_id} are missing, re-fetching offsets {gap_offsets}...")
+                gap_route = route_for(len(gap_offsets))
+                # Re-fetched from Airbnb, the cached pages are the ones that missed the reviews
+                gap_tasks = [fetch_comments.s(str_id=str_id, offset=offset, extract=extract, keep_raw=keep_raw,
+                                              refresh=True).set(**gap_route) for offset in gap_offsets]
+                for index, page in stream_comments(gap_tasks, batch_size, timeout, engine, latency):
+                    sink.write_page(tracker.add_page(gap_offsets[index], page, refetch=True))
+        if tracker.duplicates or tracker.missing():
+            print(f"{str_id}: {tracker.duplicates} duplicate reviews dropped, {tracker.missing()} reviews missing")
+        if store is not None:
+            first_records, _ = get_page_reviews(first_page)
+            store.complete_listing(str_id, first_records[0] if first_records else None)
+            store.close()
+        print(f"{sink.records_written} review records have saved to {ndjson_output_path}")
+        print(f"{sink.sentences_written} English reviews have saved to {csv_output_path}")
+    elif output == 'json':
+        all_comments = [first_page] + [None] * len(tasks)  # Initialize a list to store all fetched comments
+        for index, page in page_results:
+            all_comments[index + 1] = page  # Keep the pages ordered by offset
+    else:
+        raise ValueError(f"Unknown output: {output!r}, expected 'json' or 'ndjson'")
+
+    # Report the throughput so the execution modes can be compared
+    fetch_elapsed_time = time.time() - fetch_start_time
+    pages_per_second = len(tasks) / fetch_elapsed_time if fetch_elapsed_time > 0 else 0.0
+    print(f"Throughput for {str_id} ({mode}): {len(tasks)} pages in {fetch_elapsed_time:.2f} seconds, "
+          f"{pages_per_second:.2f} pages/s")
+    print(job_summary(str_id, latency, fetch_elapsed_time))
+
+    if output == 'json' and extract:
+        # The workers already extracted the reviews, save the compact records and write the CSV from them
+        seen = ReviewIdSet()
+        records = [record for page in all_comments for record in page['reviews']
+                   if record['id'] is None or seen.add(record['id'])]
+        with open(reviews_output_path, 'w', encoding='utf-8') as file:
+            json.dump(records, file, ensure_ascii=False)
+        print(f"Review records have saved to {reviews_output_path}")
+        if keep_raw:
+            with open(json_output_path, 'w', encoding='utf-8') as file:
+                json.dump([page['raw'] for page in all_comments], file, ensure_ascii=False, indent=4)
+            print(f"Comments have saved to {json_output_path}")
+        airbnb_records_csv(records, csv_output_path)
+    elif output == 'json':
+        # Save the results to a JSON file
+        with open(json_output_path, 'w', encoding='utf-8') as file:
+            json.dump(all_comments, file, ensure_ascii=False, indent=4)
+        print(f"Comments have saved to {json_output_path}")
+
+        # Convert the JSON file to CSV format
+        airbnb_csv(json_output_path, csv_output_path)
+
+    # Record the end time and calculate the elapsed time
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    print(f"Crawler Time Usage: {elapsed_time} seconds")
+
+
+def airbnb_incremental_comments(str_id, first_page, newest_review, timeout, store, ndjson_output_path,
+                                csv_output_path, engine=None):
+    """
+    Fetch only the reviews posted since the last completed crawl of a listing and append them to its output.
+
+    Reviews are requested MOST_RECENT first, so pages are fetched one after another from offset 0 and paging stops
+    at the first review that was already known. A daily refresh therefore costs a handful of requests.
+
+    Args:
+        str_id (str): The Airbnb listing ID.
+        first_page (dict): The page at offset 0.
+        newest_review (dict): The newest review of the last completed crawl ('id' and 'created_at').
+        timeout (int): The maximum time (in seconds) to wait for each page.
+        store (CheckpointStore): The checkpoint store, updated with the new newest review.
+        ndjson_output_path (str): The review records file to append to.
+        csv_output_path (str): The CSV file to append to.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run.
+
+    Returns:
+        None
+    """
+    comments_per_task = 50  # Each task fetches 50 comments
+    total_comments = get_page_reviews_count(first_page)
+    page, offset, requests_sent = first_page, 0, 1
+    first_records, _ = get_page_reviews(first_page)
+
+    # Raw responses also hold already known reviews, only the new records are appended
+    with ReviewSink(ndjson_output_path, csv_output_path, append=True) as sink:
+        while True:
+            new_records, reached_known = new_reviews(page, newest_review)
+            sink.write_page({'str_id': str_id, 'offset': offset, 'reviews_count': total_comments,
+                             'reviews': new_records})
+
+            offset += comments_per_task
+            if reached_known or offset >= total_comments:
+                break
+            page = run_task(fetch_comments.s(str_id=str_id, offset=offset, extract=True, refresh=True), timeout,
+                            get_engine(engine), resend=refreshed)
+            requests_sent += 1
+
+    store.complete_listing(str_id, first_records[0] if first_records else None)
+    print(f"Incremental crawl of {str_id}: {sink.records_written} new reviews in {requests_sent} requests")
 
-    print(f"Executing tasks in batches for {str_id}...")
+
+def new_reviews(page, newest_review):
+    """
+    Return the reviews of a page that are newer than the newest review of the last completed crawl.
+
+    Args:
+        page (dict): The fetch_comments result, reviews ordered MOST_RECENT first.
+        newest_review (dict): The newest known review ('id' and 'created_at').
+
+    Returns:
+        tuple: (list of new review records, True if the page reached an already known review).
+    """
+    records, _ = get_page_reviews(page)
+    for index, record in enumerate(records):
+        if record['id'] == newest_review['id'] or (
+                record['created_at'] and newest_review['created_at']
+                and record['created_at'] < newest_review['created_at']):
+            return records[:index], True
+    return records, False
+
+
+def batch_comments(tasks, batch_size, timeout, engine=None, latency=None):
+    """
+    Execute page tasks in fixed batches, waiting for every batch to complete.
+
+    Args:
+        tasks (list): The `fetch_comments` signatures to execute, ordered by offset.
+        batch_size (int): The number of tasks to execute concurrently in a single batch.
+        timeout (int): The maximum time (in seconds) a single page task may take before it is sent again.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run.
+        latency (Histogram): Records the round trip time of every page, across all batches.
+
+    Yields:
+        tuple: (index in `tasks`, task result), batch by batch.
+    """
     # Execute tasks in batches to control the load and manage execution
     for i in range(0, len(tasks), batch_size):
         batch_tasks = tasks[i:i + batch_size]  # Slice the tasks list to get the current batch
-        task_group = group(batch_tasks)  # Create a Celery group for the current batch
-        result = task_group.apply_async()  # Execute the batch asynchronously
 
-        # Wait for the current batch of tasks to complete with a specified timeout
-        batch_results = result.get(timeout=timeout)
-        all_comments.extend(batch_results)  # Append the results to the list of all comments
+        # The whole batch is sent at once, but every page has its own deadline and retries,
+        # so one stuck page is sent again instead of failing the batch
+        executor = SlidingWindowExecutor(len(batch_tasks), timeout, engine=get_engine(engine), latency=latency,
+                                         resend=refreshed)
+        for index, task in enumerate(batch_tasks, start=i):
+            executor.submit(index, task)
+        yield from executor.as_completed()
 
         # Pause for 3 seconds between batches to avoid overloading the server
         time.sleep(3)
 
-    # Save the results to a JSON file
-    with open(json_output_path, 'w', encoding='utf-8') as file:
-        json.dump(all_comments, file, ensure_ascii=False, indent=4)
-    print(f"Comments have saved to {json_output_path}")
 
-    # Convert the JSON file to CSV format
-    airbnb_csv(json_output_path, csv_output_path)
+def stream_comments(tasks, window_size, timeout, engine=None, latency=None):
+    """
+    Execute page tasks with a sliding window and hand their results over as they arrive.
 
-    # Record the end time and calculate the elapsed time
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f"Crawler Time Usage: {elapsed_time} seconds")
+    Args:
+        tasks (list): The `fetch_comments` signatures to execute, ordered by offset.
+        window_size (int): The number of tasks to keep in flight at the same time.
+        timeout (int): The maximum time (in seconds) a single task may take before it is sent again.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run.
+        latency (Histogram): Records the round trip time of every page.
+
+    Yields:
+        tuple: (index in `tasks`, task result), in completion order.
+    """
+    executor = SlidingWindowExecutor(window_size, timeout, engine=get_engine(engine), latency=latency,
+                                     resend=refreshed)
+    for index, task in enumerate(tasks):
+        executor.submit(index, task)
+    yield from executor.as_completed()
+
+
+def probe_first_pages(ids, timeout, extract=False, keep_raw=False, engine=None, refresh=False):
+    """
+    Fetch the first page (offset 0) of several listings concurrently.
+
+    The first page carries the total number of comments, so probing all listings at once lets every listing
+    start fanning out its remaining pages right away instead of waiting for a serial count request.
 
+    Args:
+        ids (list): A list of Airbnb listing IDs.
+        timeout (int): The maximum time (in seconds) a single first page task may take before it is sent again.
+        extract (bool): Let the workers extract compact review records, see airbnb_comments.
+        keep_raw (bool): With `extract`, also return the raw responses.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run.
+        refresh (bool): Bypass the response cache, for incremental crawls.
 
-def parallel_airbnb_comments(ids, batch_size, timeout):
+    Returns:
+        dict: Listing ID -> first page response.
+    """
+    # The ID tags the task, a duplicate would replace the entry of its twin while it is in flight
+    ids = list(dict.fromkeys(ids))
+    print(f"Probing first pages of {len(ids)} listings...")
+    executor = SlidingWindowExecutor(len(ids), timeout, engine=get_engine(engine), resend=refreshed)
+    for str_id in ids:
+        executor.submit(str_id, fetch_comments.s(str_id=str_id, offset=0, extract=extract, keep_raw=keep_raw,
+                                                 refresh=refresh).set(**route_for(None)))
+    return dict(executor.as_completed())
+
+
+def parallel_airbnb_comments(ids, batch_size, timeout, mode='batch', extract=False, keep_raw=False, output='json',
+                             checkpoint=None, incremental=False, engine=None):
     """
     Run the airbnb_comments function in parallel for multiple listing IDs.
 
     Args:
         ids (list): A list of Airbnb listing IDs.
         batch_size (int): The number of tasks to execute concurrently in a single batch.
-        timeout (int): The maximum time (in seconds) to wait for each batch of tasks to complete.
+        timeout (int): The maximum time (in seconds) a single page task may take before it is sent again.
+        mode (str): The execution mode passed to airbnb_comments, 'batch' or 'stream'.
+        extract (bool): Let the workers extract compact review records, see airbnb_comments.
+        keep_raw (bool): With `extract`, also keep the raw responses.
+        output (str): The output format passed to airbnb_comments, 'json' or 'ndjson'.
+        checkpoint (str): Path of the CheckpointStore database used to resume interrupted crawls.
+        incremental (bool): With `checkpoint`, only fetch reviews newer than the last completed crawl.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run. With 'local' every listing
+            process runs its pages on threads of its own.
 
     Returns:
         None
     """
+    # A listing given twice would be crawled by two processes writing the same files
+    ids = list(dict.fromkeys(ids))
+    # Probe the first pages of all listings concurrently, they also provide the comment totals
+    first_pages = probe_first_pages(ids, timeout, extract, keep_raw, engine, refresh=incremental)
+
     # Use ProcessPoolExecutor to execute airbnb_comments in parallel for each ID
     with ProcessPoolExecutor(max_workers=len(ids)) as executor:
         # Submit tasks to the executor for each listing ID
         futures = [
-            executor.submit(airbnb_comments, str_id, batch_size, timeout)
+            executor.submit(airbnb_comments, str_id, batch_size, timeout, mode, first_pages[str_id],
+                            extract, keep_raw, output, checkpoint, incremental, engine)
             for i, str_id in enumerate(ids)
         ]
 
@@ -99,18 +392,367 @@ def parallel_airbnb_comments(ids, batch_size, timeout):
             future.result()  # This blocks until the individual task is completed
 
 
-def airbnb_run(str_ids, batch_size, timeout):
+class AirbnbListingJob(Job):
+    """
+    The crawl of one Airbnb listing as a job of the FairShareScheduler, writing NDJSON output like airbnb_comments.
+
+    The job starts with the page at offset 0. Its review count decides which pages follow, and once those have
+    arrived the offsets where reviews were missed are fetched again (up to MAX_GAP_FILL_ROUNDS rounds). With a
+    checkpoint store, written pages are recorded so an interrupted crawl resumes with only the missing pages, and an
+    incremental crawl pages from offset 0 until it reaches a known review. With a shard store, the workers write the
+    pages there and only return manifest entries, and the output files are merged from the shards at the end.
+
+    Args:
+        str_id (str): The Airbnb listing ID.
+        extract (bool): Let the workers extract compact review records, see airbnb_comments.
+        keep_raw (bool): With `extract`, also keep the raw responses.
+        store (CheckpointStore): The checkpoint store shared by all jobs, None to disable checkpointing.
+        incremental (bool): With `store`, only fetch reviews newer than the last completed crawl.
+        shard_store (str): URL of the shard store the workers write the pages to (see crawler.utils.shard_store),
+            None to have the pages returned through the result backend. Cannot be combined with `store`.
+    """
+
+    comments_per_task = 50  # Each task fetches 50 comments
+    batchable = True  # Pages are combined into fetch_comments_batch tasks
+
+    def __init__(self, str_id, extract=False, keep_raw=False, store=None, incremental=False, shard_store=None):
+        if store is not None and shard_store is not None:
+            raise ValueError("A checkpoint store cannot be combined with a shard store")
+        self.name = str_id
+        self.str_id = str_id
+        self.extract = extract
+        self.keep_raw = keep_raw
+        self.store = store
+        self.incremental = incremental
+        self.shard_store = shard_store
+        # A duplicate would write a second shard that nobody merges if it finished after the crawl
+        self.hedgeable = shard_store is None
+        self.state = 'probe'  # 'probe', 'pages', 'incremental', 'done' or 'failed'
+        self.error = None
+        self.pages_received = 0
+        self.start_time = time.time()
+        self._pending = deque([('first', 0)])  # (kind, offset) of the tasks still to send
+        self._in_flight = 0
+        self._gap_rounds = 0
+        self._first_page = None
+        self._total_comments = 0
+        self._newest_review = None
+        self._sink = None
+        self._tracker = None
+        self._manifest = []  # Manifest entries of the shards written by the workers
+        self.csv_output_path = f'shared_data/airbnb/airbnb_{str_id}.csv'
+        self.ndjson_output_path = f'shared_data/airbnb/airbnb_{str_id}.ndjson'
+        # Raw responses are only available when the workers return them
+        self.raw_output_path = f'shared_data/airbnb/airbnb_{str_id}.raw.ndjson' if not extract or keep_raw else None
+
+    def has_task(self):
+        return bool(self._pending)
+
+    def next_task(self):
+        kind, offset = self._pending.popleft()
+        self._in_flight += 1
+        # Gap re-fetches and the pages of an incremental crawl must see the listing as it is now, not as cached
+        refresh = kind in ('gap', 'new') or (kind == 'first' and self.incremental)
+        return (kind, offset), fetch_comments.s(str_id=self.str_id, offset=offset, extract=self.extract,
+                                                keep_raw=self.keep_raw, shard_store=self.shard_store, refresh=refresh)
+
+    def is_done(self):
+        return self.state in ('done', 'failed')
+
+    def remaining_tasks(self):
+        return None if self.state == 'probe' else len(self._pending) + self._in_flight
+
+    def on_result(self, tag, result):
+        if self.state == 'failed':
+            self._in_flight -= 1
+            return  # The output is left for a resumed run, late pages are dropped
+        kind, offset = tag
+        self.pages_received += 1
+        if kind == 'first':
+            self._start(result)
+        elif kind == 'new':
+            self._add_new_page(offset, result)
+        else:
+            self._add_page(offset, result, refetch=kind == 'gap')
+            if kind == 'page' and self.store is not None:
+                self.store.mark_page(self.str_id, offset)
+        # Only once the page is handled: if it raises, the task is handed to on_error instead
+        self._in_flight -= 1
+
+        if self.state == 'pages' and not self._pending and not self._in_flight:
+            self._plan_gap_round()
+
+    def on_error(self, tag, exc):
+        self._in_flight -= 1
+        if self.state == 'failed':
+            return
+        print(f"Crawl of {self.str_id} failed at offset {tag[1]}: {exc!r}")
+        self.state = 'failed'
+        self.error = exc
+        self._pending.clear()
+
+    def _add_page(self, offset, page, refetch=False, write_raw=True):
+        if self.shard_store is not None:
+            # The worker has written the page, only the review count is needed to find gaps
+            self._manifest.append(dict(page, refetch=refetch))
+            self._tracker.add_count(offset, page['reviews_count'], refetch)
+        else:
+            self._sink.write_page(self._tracker.add_page(offset, page, refetch), write_raw)
+
+    def _start(self, first_page):
+        self._first_page = first_page
+        if self.shard_store is not None:
+            self._total_comments = first_page['reviews_count']
+        else:
+            self._total_comments = get_page_reviews_count(first_page)
+        done_offsets = set()
+        if self.store is not None:
+            done_offsets = self.store.completed_offsets(self.str_id)
+            self._newest_review = self.store.newest_review(self.str_id)
+            if self.incremental and self._newest_review is not None and not done_offsets:
+                # The listing has been crawled completely before, only fetch what is newer
+                self.state = 'incremental'
+                self._sink = ReviewSink(self.ndjson_output_path, self.csv_output_path, append=True)
+                self._add_new_page(0, first_page)
+                return
+            if done_offsets:
+                print(f"Resuming {self.str_id}: {len(done_offsets)} pages were already written")
+            self.store.start_listing(self.str_id, self._total_comments)
+
+        if self.shard_store is None:
+            self._sink = ReviewSink(self.ndjson_output_path, self.csv_output_path, self.raw_output_path,
+                                    resume=bool(done_offsets))
+        # Reviews are de-duplicated by ID, a resumed crawl starts with the IDs it has already written.
+        # They are read once the sink has cut off a page the interrupted run left half written.
+        seen = load_seen_ids(self.ndjson_output_path + '.part') if done_offsets else None
+        self._tracker = PaginationTracker(self.comments_per_task, seen)
+        self.state = 'pages'
+        # The first page is fetched again for its review count, its raw response is already there
+        self._add_page(0, first_page, write_raw=0 not in done_offsets)
+        if self.store is not None:
+            self.store.mark_page(self.str_id, 0)
+
+        total_tasks = math.ceil(self._total_comments / self.comments_per_task)
+        self._pending.extend(('page', i * self.comments_per_task) for i in range(1, total_tasks)
+                             if i * self.comments_per_task not in done_offsets)
+
+    def _add_new_page(self, offset, page):
+        # Raw responses also hold already known reviews, only the new records are appended
+        new_records, reached_known = new_reviews(page, self._newest_review)
+        self._sink.write_page({'str_id': self.str_id, 'offset': offset, 'reviews_count': self._total_comments,
+                               'reviews': new_records})
+        offset += self.comments_per_task
+        if reached_known or offset >= self._total_comments:
+            self.state = 'done'
+        else:
+            self._pending.append(('new', offset))
+
+    def _plan_gap_round(self):
+        # Offsets drift while reviews are posted during the crawl, fetch again only where reviews were missed.
+        # With shards the review IDs are not known before the merge, the review counts alone locate the gaps.
+        missing = self._tracker.missing() if self.shard_store is None else None
+        gap_offsets = []
+        if missing != 0 and self._gap_rounds < MAX_GAP_FILL_ROUNDS:
+            gap_offsets = self._tracker.gap_offsets()
+        if not gap_offsets:
+            self.state = 'done'
+            return
+        self._gap_rounds += 1
+        if missing is None:
+            print(f"Reviews of {self.str_id} were missed, re-fetching offsets {gap_offsets}...")
+        else:
+            print(f"{missing} reviews of {self.str_id} are missing, re-fetching offsets {gap_offsets}...")
+        self._pending.extend(('gap', offset) for offset in gap_offsets)
+
+    def discard(self, tag, result):
+        if self.shard_store is not None:
+            # A page given up after its deadline and sent again, the shard of the late copy is not merged
+            get_shard_store(self.shard_store).delete(result['path'])
+
+    def finish(self):
+        elapsed_time = time.time() - self.start_time
+        if self.state == 'failed':
+            # Keep the '.part' files, a run with the checkpoint store resumes from them
+            if self._sink is not None:
+                self._sink.close()
+            if self.shard_store is not None:
+                shard_store = get_shard_store(self.shard_store)
+                for entry in self._manifest:
+                    shard_store.delete(entry['path'])
+            print(f"{self.str_id}: gave up after {self.pages_received} pages in {elapsed_time:.2f} seconds")
+            return
+
+        if self.shard_store is not None:
+            self._sink, tracker = merge_listing_shards(self.shard_store, self._manifest, self.ndjson_output_path,
+                                                       self.csv_output_path, self.raw_output_path)
+        else:
+            self._sink.finalize()
+            tracker = self._tracker
+        if tracker is not None and (tracker.duplicates or tracker.missing()):
+            print(f"{self.str_id}: {tracker.duplicates} duplicate reviews dropped, {tracker.missing()} reviews missing")
+        if self.store is not None:
+            first_records, _ = get_page_reviews(self._first_page)
+            self.store.complete_listing(self.str_id, first_records[0] if first_records else None)
+        print(f"{self.str_id}: {self._sink.records_written} review records and {self._sink.sentences_written} "
+              f"English reviews saved from {self.pages_received} pages in {elapsed_time:.2f} seconds")
+
+
+def batch_fetch_signature(signatures):
+    """
+    Combine fetch_comments signatures with the same extract/keep_raw/shard_store options into one
+    fetch_comments_batch task.
+
+    Args:
+        signatures (list): The fetch_comments signatures, possibly of different listings.
+
+    Returns:
+        Signature: The fetch_comments_batch signature fetching all their pages.
+    """
+    options = signatures[0].kwargs
+    items = [[signature.kwargs['str_id'], signature.kwargs['offset'], signature.kwargs.get('refresh', False)]
+             for signature in signatures]
+    return fetch_comments_batch.s(items=items, extract=options['extract'], keep_raw=options['keep_raw'],
+                                  shard_store=options.get('shard_store'))
+
+
+def scheduled_airbnb_comments(ids, max_in_flight, timeout, per_listing_limit=None, max_active_listings=None,
+                              extract=False, keep_raw=False, checkpoint=None, incremental=False,
+                              max_pages_per_task=None, shards=False, engine=None):
+    """
+    Fetch the comments of any number of Airbnb listings through one fair-share scheduler in this process.
+
+    Instead of one process per listing, the page tasks of all listings share a single queue: at most
+    `max_in_flight` messages are in flight overall and `per_listing_limit` per listing, and listings are taken from
+    `ids` only when there is room, so the client uses the same resources for ten listings or a million, and the
+    first pages of new listings are probed while the pages of others are still being fetched.
+    The output of every listing is written like airbnb_comments with output='ndjson'.
+
+    Args:
+        ids (iterable): The Airbnb listing IDs, a list or any iterable such as a generator reading a file. An ID that
+            comes again is crawled once.
+        max_in_flight (int): The maximum number of task messages in flight over all listings.
+        timeout (int): The maximum time (in seconds) a single page task may take before it is sent again. A listing
+            whose page fails crawler_page_attempts times is given up, its partial output stays in place for a
+            resumed run.
+        per_listing_limit (int): The maximum number of page tasks in flight for one listing.
+            Defaults to a quarter of `max_in_flight`.
+        max_active_listings (int): The maximum number of listings crawled at the same time.
+            Defaults to `max_in_flight`.
+        extract (bool): Let the workers extract compact review records, see airbnb_comments.
+        keep_raw (bool): With `extract`, also keep the raw responses.
+        checkpoint (str): Path of a CheckpointStore database to resume interrupted crawls.
+        incremental (bool): With `checkpoint`, only fetch reviews newer than the last completed crawl.
+        max_pages_per_task (int): The maximum number of pages fetched by one fetch_comments_batch message when more
+            pages are ready than messages may be in flight. Defaults to crawler_max_pages_per_task in
+            crawler/celery_config.py, 1 sends every page as its own task.
+        shards (bool): Let the workers write the pages to the shard store crawler_shard_store (crawler/celery_config.py)
+            and return only manifest entries (path, record count, bytes, checksum), so page data never passes
+            through this process. The output files of a listing are merged from its shards once it completes.
+            Cannot be combined with `checkpoint`.
+        engine (str): 'celery' or 'local', where the page tasks run, see airbnb_run.
+
+    Returns:
+        dict: The number of 'listings', 'pages' and 'messages' and the 'elapsed' time (in seconds).
+    """
+    start_time = time.time()
+    if per_listing_limit is None:
+        per_listing_limit = max(1, max_in_flight // 4)
+    if max_active_listings is None:
+        max_active_listings = max_in_flight
+    if max_pages_per_task is None:
+        max_pages_per_task = celery_config.crawler_max_pages_per_task
+
+    if shards and checkpoint is not None:
+        raise ValueError("shards cannot be combined with checkpoint")
+    shard_store = celery_config.crawler_shard_store if shards else None
+
+    store = CheckpointStore(checkpoint) if checkpoint is not None else None
+    scheduler = FairShareScheduler(max_in_flight, per_listing_limit, max_active_listings, timeout,
+                                   max_chunk_size=max_pages_per_task, batcher=batch_fetch_signature,
+                                   engine=get_engine(engine), resend=refreshed)
+    # Every listing once: two jobs of the same listing would write the same files at the same time.
+    # The IDs may be a stream of any length, they are kept as compact 64-bit keys like the review IDs.
+    admitted = ReviewIdSet()
+    jobs = (AirbnbListingJob(str_id, extract, keep_raw, store, incremental, shard_store) for str_id in ids
+            if admitted.add(str_id))
+    try:
+        scheduler.run(jobs)
+    finally:
+        if store is not None:
+            store.close()
+
+    elapsed_time = time.time() - start_time
+    pages_per_second = scheduler.tasks_completed / elapsed_time if elapsed_time > 0 else 0.0
+    print(f"Throughput (scheduled): {scheduler.jobs_completed} listings, {scheduler.tasks_completed} pages in "
+          f"{scheduler.messages_sent} messages in {elapsed_time:.2f} seconds, {pages_per_second:.2f} pages/s")
+    print(f"Retries: {scheduler.retries} pages, hedged requests: {scheduler.hedge.sent} sent, "
+          f"{scheduler.hedge.won} won")
+    print(f"Crawler Time Usage: {elapsed_time} seconds")
+    # The round trip times seen by the orchestrator, next to the snapshots of the workers
+    get_metrics().write_snapshot(force=True)
+    return {'listings': scheduler.jobs_completed, 'pages': scheduler.tasks_completed,
+            'messages': scheduler.messages_sent, 'elapsed': elapsed_time}
+
+
+def airbnb_run(str_ids, batch_size, timeout, mode='batch', extract=False, keep_raw=False, output='json',
+               checkpoint=None, incremental=False, per_listing_limit=None, max_active_listings=None,
+               max_pages_per_task=None, shards=False, topics=None, engine=None):
     """
     Orchestrate the process of fetching comments and running LDA (Latent Dirichlet Allocation)
     analysis for multiple Airbnb listings.
 
     Args:
-        str_ids (list): A list of Airbnb listing IDs.
+        str_ids (iterable): The Airbnb listing IDs. In 'scheduled' mode any iterable, e.g. a stream of IDs.
         batch_size (int): The number of tasks to execute concurrently in a single batch.
-        timeout (int): The maximum time (in seconds) to wait for each batch of tasks to complete.
+            In 'scheduled' mode this is the number of page tasks in flight over all listings.
+        timeout (int): The maximum time (in seconds) a single page task may take before it is sent again.
+        mode (str): 'batch' for fixed batches, 'stream' for a sliding window of in-flight tasks (both with one
+            process per listing), 'scheduled' for one fair-share scheduler over all listings (requires
+            output='ndjson'), see scheduled_airbnb_comments.
+        extract (bool): Let the workers extract compact review records instead of returning raw responses.
+        keep_raw (bool): With `extract`, also keep the raw responses.
+        output (str): 'json' to write the files at the end, 'ndjson' to append every page as it arrives.
+        checkpoint (str): Path of a CheckpointStore database (requires output='ndjson') to resume interrupted crawls.
+        incremental (bool): With `checkpoint`, only fetch reviews newer than the last completed crawl.
+        per_listing_limit (int): In 'scheduled' mode, the maximum number of page tasks in flight for one listing.
+        max_active_listings (int): In 'scheduled' mode, the maximum number of listings crawled at the same time.
+        max_pages_per_task (int): In 'scheduled' mode, the maximum number of pages per batched task message.
+        shards (bool): In 'scheduled' mode, let the workers write the pages to the shared shard store and return
+            only manifest entries, see scheduled_airbnb_comments.
+        topics (int): Fit an online LDA model with this many topics on the crawled reviews (requires
+            output='ndjson') and save the topics to shared_data/airbnb/topics.json, see utils/topic_model.py.
+            In 'scheduled' mode the model is updated while the crawl runs, otherwise once the listings are done.
+        engine (str): Where the page tasks run (crawler/utils/engine.py): 'celery' sends them through the broker to
+            the workers, 'local' runs the same tasks on a thread pool in this process, without broker or workers,
+            for single-node runs, local development and CI. Defaults to crawler_engine (CRAWLER_ENGINE).
 
     Returns:
         None
     """
-    # Run the parallel fetching of comments
-    parallel_airbnb_comments(str_ids, batch_size, timeout)
+    if topics is not None and output != 'ndjson':
+        raise ValueError("topics requires output='ndjson'")
+    if mode == 'scheduled':
+        if output != 'ndjson':
+            raise ValueError("mode='scheduled' requires output='ndjson'")
+        if topics is None:
+            scheduled_airbnb_comments(str_ids, batch_size, timeout, per_listing_limit, max_active_listings,
+                                      extract, keep_raw, checkpoint, incremental, max_pages_per_task, shards, engine)
+            return
+        # Imported here, the crawl alone does not need scikit-learn
+        from utils.topic_model import topic_model_alongside
+        with topic_model_alongside(topics, TOPICS_OUTPUT_PATH):
+            scheduled_airbnb_comments(str_ids, batch_size, timeout, per_listing_limit, max_active_listings,
+                                      extract, keep_raw, checkpoint, incremental, max_pages_per_task, shards, engine)
+        return
+
+    # Run the parallel fetching of comments, every listing once
+    str_ids = list(dict.fromkeys(str_ids))
+    parallel_airbnb_comments(str_ids, batch_size, timeout, mode, extract, keep_raw, output, checkpoint, incremental,
+                             engine)
+    if topics is not None:
+        # The listings run in processes of their own here, the model reads their files afterwards
+        from utils.topic_model import TopicModelStage, iter_review_texts
+        stage = TopicModelStage(topics).run(iter_review_texts(f'shared_data/airbnb/airbnb_{str_id}.ndjson'
+                                                              for str_id in str_ids))
+        stage.save(TOPICS_OUTPUT_PATH)
+        print(f"Topics of {stage.documents} reviews have saved to {TOPICS_OUTPUT_PATH}")
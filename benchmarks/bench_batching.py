@@ -0,0 +1,77 @@
+"""
+Compare one page per task with batched fetch_comments_batch messages for the scheduled orchestrator.
+
+A Celery worker (thread pool) runs in this process on the in-memory broker and result backend, and the fetch tasks
+are pointed at the local mock endpoint. Both variants crawl the same listings with the same number of messages in
+flight, so the difference is the per-message cost: publishing, acking and returning a result. The in-memory broker
+has no network round trip, so a real broker widens the gap.
+
+Usage: python -m benchmarks.bench_batching --listings 20 --reviews 500 --in-flight 8 --latency 0.005
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, default=20)
+    parser.add_argument('--reviews', type=int, default=500, help='reviews per listing (50 per page)')
+    parser.add_argument('--in-flight', type=int, default=8, help='messages in flight, also the worker concurrency')
+    parser.add_argument('--latency', type=float, default=0.005, help='mock endpoint latency per request (seconds)')
+    parser.add_argument('--max-pages-per-task', type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ['CRAWLER_RATE_LIMIT_STORE'] = 'memory://'
+    from celery.contrib.testing.worker import start_worker
+
+    import crawler.fetch_comments_from_airbnb.tasks as tasks
+    from airbnb import scheduled_airbnb_comments
+    from benchmarks.mock_airbnb import start_server
+    from crawler import app, celery_config
+
+    server = start_server(reviews_count=args.reviews, latency=args.latency)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/api'
+    celery_config.crawler_rate_limits[urlparse(base_url).netloc] = {'rate': 1e9, 'burst': 1e9}
+
+    # Point the fetch tasks at the mock endpoint
+    comment_request = tasks.comment_request_from_airbnb
+
+    def mock_request(str_id, offset):
+        request_config = comment_request(str_id, offset)
+        request_config[0] = base_url
+        return request_config
+
+    tasks.comment_request_from_airbnb = mock_request
+
+    app.conf.update(broker_url='memory://', result_backend='cache+memory://', task_acks_late=True,
+                    broker_transport_options={'polling_interval': 0.001})
+
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    os.makedirs('shared_data/airbnb')
+    try:
+        with start_worker(app, pool='threads', concurrency=args.in_flight, perform_ping_check=False):
+            print(f"{'variant':<18}{'pages':>7}{'messages':>10}{'seconds':>9}{'pages/s':>9}{'messages/s':>12}")
+            for name, max_pages in [('page per task', 1), (f'batched (<= {args.max_pages_per_task})',
+                                                            args.max_pages_per_task)]:
+                ids = [f'{name[0]}{i}' for i in range(args.listings)]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = scheduled_airbnb_comments(ids, args.in_flight, 60, per_listing_limit=args.in_flight * 8,
+                                                      extract=True, max_pages_per_task=max_pages)
+                pages, messages, elapsed = stats['pages'], stats['messages'], stats['elapsed']
+                print(f"{name:<18}{pages:>7}{messages:>10}{elapsed:>9.2f}{pages / elapsed:>9.1f}"
+                      f"{messages / elapsed:>12.1f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
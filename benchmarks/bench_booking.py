@@ -0,0 +1,68 @@
+"""
+Measure bytes per review and requests per hotel of the Booking.com crawl with the full and the trimmed query.
+
+The tasks run eagerly in this process against the local mock endpoint (benchmarks/mock_booking.py), which answers
+with exactly the fields the query selects and caps the page size at --max-page-size.
+
+Usage: python -m benchmarks.bench_booking --hotels 10 --reviews 300 --max-page-size 25
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hotels', type=int, default=10)
+    parser.add_argument('--reviews', type=int, default=300, help='reviews per hotel')
+    parser.add_argument('--max-page-size', type=int, default=25, help='page size cap of the mock endpoint')
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ['CRAWLER_RATE_LIMIT_STORE'] = 'memory://'
+    import crawler.fetch_comments_from_booking.tasks as tasks
+    from benchmarks.mock_booking import start_server
+    from booking import booking_run
+    from crawler import app, celery_config
+
+    server = start_server(reviews_count=args.reviews, latency=args.latency, max_page_size=args.max_page_size)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/dml/graphql'
+    celery_config.crawler_rate_limits[urlparse(base_url).netloc] = {'rate': 1e9, 'burst': 1e9}
+    app.conf.task_always_eager = True
+
+    # Point the fetch task at the mock endpoint
+    comments_request = tasks.comments_request_form_booking
+
+    def mock_request(*request_args, **request_kwargs):
+        request_config = comments_request(*request_args, **request_kwargs)
+        request_config[0] = base_url
+        return request_config
+
+    tasks.comments_request_form_booking = mock_request
+
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        print(f"{'query':<10}{'requests/hotel':>16}{'bytes/review':>14}{'MB total':>10}")
+        for name, projection in [('full', False), ('trimmed', True)]:
+            before = dict(server.stats)
+            hotels = [(1000 + i, -2601889, 'gb') for i in range(args.hotels)]
+            with contextlib.redirect_stdout(io.StringIO()):
+                booking_run(hotels, 8, 30, projection=projection)
+            requests_sent = server.stats['requests'] - before['requests']
+            bytes_received = server.stats['bytes'] - before['bytes']
+            print(f"{name:<10}{requests_sent / args.hotels:>16.1f}"
+                  f"{bytes_received / (args.hotels * args.reviews):>14.0f}{bytes_received / 1e6:>10.2f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
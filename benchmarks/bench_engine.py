@@ -0,0 +1,170 @@
+"""
+Compare the wall time of a crawl on the Celery engine (broker, worker process, result backend) and on the standalone
+engine (the same tasks on threads of the orchestrator, crawler/utils/engine.py), for small and medium crawls.
+
+Both run airbnb_run(mode='scheduled', extract=True, output='ndjson') in a fresh orchestrator process against the mock
+Airbnb endpoint (benchmarks/mock_airbnb.py). The Celery engine talks to an already running "celery worker" through
+Kombu's filesystem transport and the file result backend (benchmarks/local_broker.py), the stand-in for RabbitMQ and
+rpc:// used by the other pipeline benchmarks, so the broker overhead measured here is of the same order but not
+identical to a RabbitMQ deployment. The time is measured around airbnb_run, interpreter and worker start-up excluded.
+
+Reported per crawl size: the median time of --repeat runs on each engine, the time saved and the speed-up.
+
+Usage: python -m benchmarks.bench_engine --crawls 1x1,1x5,4x10,16x20 --concurrency 8 --latency 0.02 --repeat 3
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_pipeline import PAGE_SIZE, ROOT, stop_process, wait_for
+
+
+def run_crawl(args):
+    """
+    Run airbnb_run for the crawl's listings in this interpreter and write its outcome to `args.result_file`.
+    """
+    import contextlib
+    from urllib.parse import urlparse
+
+    from airbnb import airbnb_run
+    from crawler import app, celery_config
+
+    if args.engine == 'celery':
+        from benchmarks.local_broker import configure_app
+        configure_app(app, args.broker_dir)
+    else:
+        # The requests are sent from this process, measure the engine and not the politeness budget of the host
+        celery_config.crawler_rate_limits[urlparse(os.environ['CRAWLER_AIRBNB_URL']).netloc] = {'rate': 1e9,
+                                                                                             'burst': 1e9}
+    os.makedirs('shared_data/airbnb', exist_ok=True)
+    ids = [f'L{i}' for i in range(args.listings)]
+    status = 'ok'
+    start_time = time.perf_counter()
+    with open('crawl.log', 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            airbnb_run(ids, args.batch_size, args.timeout, mode='scheduled', extract=True, output='ndjson',
+                       engine=args.engine)
+        except Exception as exc:
+            status = f'{type(exc).__name__}: {exc}'[:60]
+    elapsed_time = time.perf_counter() - start_time
+    reviews = 0
+    for path in glob.glob('shared_data/airbnb/*.ndjson'):
+        with open(path, 'rb') as file:
+            reviews += sum(1 for _ in file)
+    with open(args.result_file, 'w', encoding='utf-8') as file:
+        json.dump({'elapsed': elapsed_time, 'status': status, 'reviews': reviews}, file)
+
+
+def time_crawl(engine, listings, env, args, broker_dir=None):
+    """
+    Run one crawl in a fresh orchestrator process and directory.
+
+    Returns:
+        dict: 'elapsed' (in seconds), 'status' and 'reviews' of the crawl.
+    """
+    crawl_dir = tempfile.mkdtemp(prefix='bench_engine_')
+    result_file = os.path.join(crawl_dir, 'crawl.json')
+    try:
+        command = [sys.executable, '-m', 'benchmarks.bench_engine', '--run', 'crawl', '--engine', engine,
+                   '--listings', str(listings), '--concurrency', str(args.concurrency),
+                   '--timeout', str(args.timeout), '--result-file', result_file]
+        if broker_dir is not None:
+            command += ['--broker-dir', broker_dir]
+        subprocess.run(command, cwd=crawl_dir, env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(result_file, encoding='utf-8') as file:
+            return json.load(file)
+    finally:
+        shutil.rmtree(crawl_dir, ignore_errors=True)
+
+
+def run_size(listings, pages, args):
+    """
+    Time the crawls of `listings` listings with `pages` pages each on both engines.
+
+    Returns:
+        dict: Engine -> list of crawl outcomes, see time_crawl.
+    """
+    cell_dir = tempfile.mkdtemp(prefix='bench_engine_')
+    base_url = f'http://127.0.0.1:{args.port}'
+    mock = subprocess.Popen([sys.executable, '-m', 'benchmarks.mock_airbnb', '--port', str(args.port),
+                             '--reviews', str(pages * PAGE_SIZE), '--latency', str(args.latency),
+                             '--latency-dist', args.latency_dist, '--seed', '1'],
+                            cwd=ROOT, stdout=subprocess.DEVNULL)
+    env = dict(os.environ, PYTHONPATH=ROOT, CRAWLER_AIRBNB_URL=f'{base_url}/api', CRAWLER_RATE_LIMIT_STORE='memory://',
+               CRAWLER_METRICS_DIR='', CRAWLER_WORKER_POOL=args.pool,
+               CRAWLER_WORKER_CONCURRENCY=str(args.concurrency))
+    broker_dir = os.path.join(cell_dir, 'broker')
+    ready_file = os.path.join(cell_dir, 'worker.ready')
+    worker = None
+    results = {'celery': [], 'local': []}
+    try:
+        wait_for(f'{base_url}/stats', 10)
+        worker = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_pipeline', '--run', 'worker',
+                                   '--broker-dir', broker_dir, '--ready-file', ready_file, '--pool', args.pool,
+                                   '--concurrency', str(args.concurrency), '--prefetch', str(args.prefetch),
+                                   '--autoscale', ''],
+                                  cwd=cell_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for(ready_file, 60)
+        # Alternate the engines, so a slower phase of the host does not favour one of them
+        for _ in range(args.repeat):
+            results['celery'].append(time_crawl('celery', listings, env, args, broker_dir))
+            results['local'].append(time_crawl('local', listings, env, args))
+    finally:
+        for process in (worker, mock):
+            if process is not None:
+                stop_process(process)
+        shutil.rmtree(cell_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--crawls', default='1x1,1x5,4x10,16x20',
+                        help='comma-separated <listings>x<pages per listing> crawl sizes')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='worker concurrency, and the batch_size (tasks in flight) of both engines')
+    parser.add_argument('--pool', default='prefork', help='pool of the Celery worker: prefork, threads, gevent')
+    parser.add_argument('--prefetch', type=int, default=4, help='worker_prefetch_multiplier of the Celery worker')
+    parser.add_argument('--latency', type=float, default=0.02, help='mean mock latency (seconds)')
+    parser.add_argument('--latency-dist', default='lognormal', choices=['constant', 'uniform', 'exponential',
+                                                                         'lognormal'])
+    parser.add_argument('--repeat', type=int, default=3, help='crawls per engine and size, the median is reported')
+    parser.add_argument('--timeout', type=int, default=60, help='airbnb_run timeout (seconds)')
+    parser.add_argument('--port', type=int, default=8768)
+    # Options of the crawl processes
+    parser.add_argument('--run', choices=['crawl'], help=argparse.SUPPRESS)
+    parser.add_argument('--engine', help=argparse.SUPPRESS)
+    parser.add_argument('--listings', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--broker-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run == 'crawl':
+        args.batch_size = args.concurrency
+        run_crawl(args)
+        return
+
+    print(f"{'listings':>9}{'pages':>7}{'celery s':>10}{'local s':>9}{'saved ms':>10}{'speed-up':>10}  status")
+    for crawl in args.crawls.split(','):
+        listings, pages = (int(value) for value in crawl.split('x'))
+        results = run_size(listings, pages, args)
+        celery_time = statistics.median(result['elapsed'] for result in results['celery'])
+        local_time = statistics.median(result['elapsed'] for result in results['local'])
+        expected = listings * pages * PAGE_SIZE
+        problems = [f"{engine}: {result['status']}, {result['reviews']}/{expected} reviews"
+                    for engine, outcomes in results.items() for result in outcomes
+                    if result['status'] != 'ok' or result['reviews'] != expected]
+        print(f"{listings:>9}{pages:>7}{celery_time:>10.3f}{local_time:>9.3f}{(celery_time - local_time) * 1000:>10.0f}"
+              f"{celery_time / local_time if local_time > 0 else 0.0:>9.1f}x  {problems[0] if problems else 'ok'}",
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Micro-benchmark of the review extraction in utils.data_processing against the original implementation
+(full recursive walk, regex compiled on every call, pandas to write the CSV).
+
+Inputs: the checked-in shared_data/airbnb/*.json sample and a synthetic listing built from its review nodes.
+
+Usage: python -m benchmarks.bench_extraction --reviews 100000 --repeat 3
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import re
+import tempfile
+import time
+
+from utils.data_processing import clean_reviews, extract_reviews, write_sentences_csv
+
+
+def legacy_extract_and_clean(data):
+    # The extraction of airbnb_csv before the fast path, kept as the baseline
+    def recursive_extract(data, reviews):
+        if isinstance(data, dict):
+            if "__typename" in data:
+                typename = data["__typename"]
+                if typename == "PdpReviewForP3":
+                    if "comments" in data and "language" in data and data["language"] == "en":
+                        reviews.append(data["comments"])
+                elif typename == "LocalizedReview":
+                    if "comments" in data:
+                        reviews.append(data["comments"])
+            for key, value in data.items():
+                recursive_extract(value, reviews)
+        elif isinstance(data, list):
+            for item in data:
+                recursive_extract(item, reviews)
+
+    def remove_html_tags(text):
+        clean = re.compile('<.*?>')
+        return re.sub(clean, '', text)
+
+    reviews = []
+    recursive_extract(data, reviews)
+    return [remove_html_tags(review) for review in reviews]
+
+
+def legacy_write(sentences, output_path):
+    import pandas as pd
+    pd.DataFrame({"sentence": sentences}).to_csv(output_path, index=False, quoting=1)
+
+
+def fast_extract_and_clean(data):
+    return clean_reviews(extract_reviews(data))
+
+
+def synthetic_pages(sample_pages, review_count, page_size=50):
+    """
+    Build `review_count` reviews shaped like the sample, spread over pages of `page_size`.
+    """
+    nodes = [node for page in sample_pages
+             for node in page['data']['presentation']['stayProductDetailPage']['reviews']['reviews']]
+    template = sample_pages[0]
+    pages = []
+    for start in range(0, review_count, page_size):
+        page = copy.deepcopy(template)
+        reviews = []
+        for i in range(start, min(start + page_size, review_count)):
+            node = copy.deepcopy(nodes[i % len(nodes)])
+            node['id'] = str(10 ** 18 + i)
+            if i % 7 == 0 and node.get('comments'):
+                node['comments'] = f"<b>{node['comments']}</b><br/>"
+            reviews.append(node)
+        page['data']['presentation']['stayProductDetailPage']['reviews']['reviews'] = reviews
+        pages.append(page)
+    return pages
+
+
+def best_of(repeat, function, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reviews', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sample_path = sorted(glob.glob('shared_data/airbnb/*.json'))[0]
+    with open(sample_path, 'r', encoding='utf-8') as f:
+        sample = json.load(f)
+    inputs = [(os.path.basename(sample_path), sample),
+              (f'synthetic {args.reviews} reviews', synthetic_pages(sample, args.reviews))]
+
+    output_dir = tempfile.mkdtemp()
+    legacy_csv = os.path.join(output_dir, 'legacy.csv')
+    fast_csv = os.path.join(output_dir, 'fast.csv')
+
+    print(f"{'input':<58}{'stage':<20}{'legacy s':>10}{'fast s':>10}{'speedup':>9}")
+    for name, data in inputs:
+        legacy_time, legacy_sentences = best_of(args.repeat, legacy_extract_and_clean, data)
+        fast_time, fast_sentences = best_of(args.repeat, fast_extract_and_clean, data)
+        assert legacy_sentences == fast_sentences, "fast extraction differs from the original implementation"
+        print(f"{name:<58}{'extract + clean':<20}{legacy_time:>10.4f}{fast_time:>10.4f}"
+              f"{legacy_time / fast_time:>8.1f}x")
+
+        legacy_time, _ = best_of(args.repeat, legacy_write, legacy_sentences, legacy_csv)
+        fast_time, _ = best_of(args.repeat, write_sentences_csv, fast_sentences, fast_csv)
+        with open(legacy_csv, 'rb') as legacy_file, open(fast_csv, 'rb') as fast_file:
+            assert legacy_file.read() == fast_file.read(), "CSV output differs from the pandas output"
+        print(f"{'':<58}{'write CSV':<20}{legacy_time:>10.4f}{fast_time:>10.4f}{legacy_time / fast_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Run the full crawl pipeline (airbnb.airbnb_run, Celery workers, fetch tasks, output files) offline against the mock
+Airbnb endpoint, over a matrix of listings x pages x concurrency x mode x pool x prefetch settings.
+
+Every cell gets a fresh mock server (benchmarks/mock_airbnb.py, with the configured latency distribution and error /
+429 rates), a real "celery worker" process with the requested pool, concurrency (or --autoscale) and prefetch
+multiplier, and an orchestrator process running airbnb_run. They talk through Kombu's filesystem transport and the
+file result backend, so no broker has to be installed and the separate processes of the 'batch' and 'stream' modes
+work too. The workers reach the mock through CRAWLER_AIRBNB_URL and record their metrics (crawler/utils/metrics.py)
+into the cell's directory.
+
+Reported per cell: pages/s (pages answered with HTTP 200 over the crawl time), HTTP latency and queue wait
+percentiles from the worker metrics, the peak RSS of the worker and of the orchestrator (all their processes), the
+500 and 429 responses, the reviews saved and the outcome of the crawl.
+
+Usage: python -m benchmarks.bench_pipeline --listings 4,16 --pages 10 --concurrency 8,32 --mode scheduled,stream
+           --latency 0.05 --latency-dist lognormal --throttle-rate 0.01 --json results.json
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE_SIZE = 50  # Reviews per page requested by the fetch tasks
+
+
+def run_worker(args):
+    """
+    Run a Celery worker in this interpreter until it receives SIGTERM.
+    """
+    if args.pool == 'gevent':
+        # Before requests is imported, like "celery worker -P gevent" does
+        from gevent import monkey
+        monkey.patch_all()
+
+    from urllib.parse import urlparse
+
+    from celery.signals import worker_ready
+
+    from benchmarks.local_broker import configure_app
+    from crawler import app, celery_config
+
+    # Measure the pipeline, not the politeness budget of the real host
+    celery_config.crawler_rate_limits[urlparse(os.environ['CRAWLER_AIRBNB_URL']).netloc] = {'rate': 1e9, 'burst': 1e9}
+    configure_app(app, args.broker_dir)
+
+    @worker_ready.connect
+    def _ready(**kwargs):
+        open(args.ready_file, 'w').close()
+
+    argv = ['worker', '-P', args.pool, '--loglevel=warning', '--without-gossip', '--without-mingle',
+            '--without-heartbeat', f'--prefetch-multiplier={args.prefetch}']
+    argv.append(f'--autoscale={args.autoscale}' if args.autoscale else f'--concurrency={args.concurrency}')
+    app.worker_main(argv)
+
+
+def run_crawl(args):
+    """
+    Run airbnb_run for the cell's listings in this interpreter and write its outcome to `args.result_file`.
+    """
+    import contextlib
+
+    from airbnb import airbnb_run
+    from benchmarks.local_broker import configure_app
+    from crawler import app
+
+    configure_app(app, args.broker_dir)
+    os.makedirs('shared_data/airbnb', exist_ok=True)
+    ids = [f'L{i}' for i in range(args.listings)]
+    status = 'ok'
+    start_time = time.perf_counter()
+    with open('crawl.log', 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            airbnb_run(ids, args.batch_size, args.timeout, mode=args.mode, extract=True, output='ndjson')
+        except Exception as exc:
+            status = f'{type(exc).__name__}: {exc}'[:60]
+    # Listings that failed in 'scheduled' mode keep their .part files
+    failed = len(glob.glob('shared_data/airbnb/*.ndjson.part'))
+    if failed and status == 'ok':
+        status = f'{failed} listings failed'
+    elapsed_time = time.perf_counter() - start_time
+    with open(args.result_file, 'w', encoding='utf-8') as file:
+        json.dump({'elapsed': elapsed_time, 'status': status}, file)
+
+
+def _children():
+    """Map every process ID to the IDs of its children, from /proc."""
+    children = {}
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat_path) as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue  # Exited meanwhile
+        children.setdefault(int(fields[1]), []).append(int(stat_path.split('/')[2]))
+    return children
+
+
+def tree_rss(pid, children):
+    """Return the resident memory (in bytes) of a process and all its descendants."""
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/statm') as file:
+                total += int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            continue
+        stack.extend(children.get(current, []))
+    return total
+
+
+class PeakMemory:
+    """
+    Sample the resident memory of process trees on a background thread and keep the peak of each.
+
+    Args:
+        pids (dict): Name -> process ID of the root of the tree.
+        interval (float): The time (in seconds) between samples.
+    """
+
+    def __init__(self, pids, interval=0.1):
+        self.pids = pids
+        self.interval = interval
+        self.peaks = {name: 0 for name in pids}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            children = _children()
+            for name, pid in self.pids.items():
+                self.peaks[name] = max(self.peaks[name], tree_rss(pid, children))
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peaks
+
+
+def wait_for(path_or_url, timeout):
+    """Wait until a file exists or a URL answers."""
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if path_or_url.startswith('http'):
+            try:
+                requests.get(path_or_url, timeout=1)
+                return
+            except requests.ConnectionError:
+                pass
+        elif os.path.exists(path_or_url):
+            return
+        time.sleep(0.05)
+    raise TimeoutError(f"{path_or_url} not ready after {timeout} seconds")
+
+
+def stop_process(process, timeout=30):
+    """Ask a process for a warm shutdown, kill it if it does not stop in time."""
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_cell(cell, args):
+    """
+    Run one cell of the matrix in a fresh directory.
+
+    Args:
+        cell (dict): The 'listings', 'pages', 'concurrency', 'batch_size', 'mode', 'pool' and 'prefetch' of the cell.
+        args (argparse.Namespace): The options of the mock server and the run.
+
+    Returns:
+        dict: The cell with its measurements added.
+    """
+    import requests
+
+    from crawler.utils.metrics import Histogram, load_snapshots, merge_snapshots
+
+    cell_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    base_url = f'http://127.0.0.1:{args.port}'
+    mock = subprocess.Popen([sys.executable, '-m', 'benchmarks.mock_airbnb', '--port', str(args.port),
+                             '--reviews', str(cell['pages'] * PAGE_SIZE), '--latency', str(args.latency),
+                             '--latency-dist', args.latency_dist, '--latency-sigma', str(args.latency_sigma),
+                             '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+                             '--retry-after', str(args.retry_after), '--seed', str(args.seed)],
+                            cwd=ROOT, stdout=subprocess.DEVNULL)
+    env = dict(os.environ, PYTHONPATH=ROOT, CRAWLER_AIRBNB_URL=f'{base_url}/api', CRAWLER_RATE_LIMIT_STORE='memory://',
+               CRAWLER_METRICS_DIR=os.path.join(cell_dir, 'metrics'), CRAWLER_METRICS_INTERVAL='1',
+               CRAWLER_WORKER_POOL=cell['pool'], CRAWLER_WORKER_CONCURRENCY=str(cell['concurrency']))
+    broker_dir = os.path.join(cell_dir, 'broker')
+    ready_file = os.path.join(cell_dir, 'worker.ready')
+    result_file = os.path.join(cell_dir, 'crawl.json')
+    worker = crawl = None
+    try:
+        wait_for(f'{base_url}/stats', 10)
+        worker = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_pipeline', '--run', 'worker',
+                                   '--broker-dir', broker_dir, '--ready-file', ready_file, '--pool', cell['pool'],
+                                   '--concurrency', str(cell['concurrency']), '--prefetch', str(cell['prefetch']),
+                                   '--autoscale', args.autoscale or ''],
+                                  cwd=cell_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for(ready_file, 60)
+        before = requests.get(f'{base_url}/stats').json()
+        crawl = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_pipeline', '--run', 'crawl',
+                                  '--broker-dir', broker_dir, '--result-file', result_file,
+                                  '--listings', str(cell['listings']), '--batch-size', str(cell['batch_size']),
+                                  '--mode', cell['mode'], '--timeout', str(args.timeout)],
+                                 cwd=cell_dir, env=env, stdout=subprocess.DEVNULL)
+        memory = PeakMemory({'worker': worker.pid, 'crawl': crawl.pid})
+        crawl.wait()
+        peaks = memory.stop()
+        after = requests.get(f'{base_url}/stats').json()
+        stop_process(worker)
+
+        with open(result_file, encoding='utf-8') as file:
+            result = json.load(file)
+        histograms, _ = merge_snapshots(load_snapshots(os.path.join(cell_dir, 'metrics')))
+        latency = {}
+        for metric in ('crawler_http_seconds', 'crawler_queue_wait_seconds'):
+            # Merge the label sets (hosts, task names) of the metric
+            merged = Histogram()
+            for (name, _), histogram in histograms.items():
+                if name == metric:
+                    merged.merge(histogram.counts, histogram.count, histogram.sum)
+            latency[metric] = {q: merged.quantile(q) * 1000 for q in (0.5, 0.95, 0.99)}
+        requests_sent = after['requests'] - before['requests']
+        errors = after['errors'] - before['errors']
+        throttled = after['throttled'] - before['throttled']
+        reviews = 0
+        for path in glob.glob(os.path.join(cell_dir, 'shared_data', 'airbnb', '*.ndjson')):
+            if not path.endswith('.raw.ndjson'):
+                with open(path, 'rb') as file:
+                    reviews += sum(1 for _ in file)
+        pages = requests_sent - errors - throttled
+        return dict(cell, status=result['status'], elapsed=result['elapsed'], pages_ok=pages,
+                    pages_per_second=pages / result['elapsed'] if result['elapsed'] > 0 else 0.0,
+                    http_ms=latency['crawler_http_seconds'], queue_wait_ms=latency['crawler_queue_wait_seconds'],
+                    errors=errors, throttled=throttled, reviews=reviews,
+                    reviews_expected=cell['listings'] * cell['pages'] * PAGE_SIZE,
+                    worker_mb=peaks['worker'] / 2 ** 20, crawl_mb=peaks['crawl'] / 2 ** 20)
+    finally:
+        for process in (crawl, worker, mock):
+            if process is not None:
+                stop_process(process)
+        shutil.rmtree(cell_dir, ignore_errors=True)
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def _str_list(value):
+    return value.split(',')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=_int_list, default=[4], help='comma-separated values, e.g. 4,16')
+    parser.add_argument('--pages', type=_int_list, default=[10], help='pages per listing (50 reviews each)')
+    parser.add_argument('--concurrency', type=_int_list, default=[8], help='worker concurrency')
+    parser.add_argument('--batch-size', type=_int_list, help='airbnb_run batch_size, defaults to the concurrency')
+    parser.add_argument('--mode', type=_str_list, default=['scheduled'], help='airbnb_run modes: batch,stream,scheduled')
+    parser.add_argument('--pool', type=_str_list, default=['prefork'], help='worker pools: prefork,threads,gevent')
+    parser.add_argument('--prefetch', type=_int_list, default=[4], help='worker_prefetch_multiplier values')
+    parser.add_argument('--autoscale', help='"max,min" passed to the worker instead of the concurrency')
+    parser.add_argument('--latency', type=float, default=0.02, help='mean mock latency (seconds)')
+    parser.add_argument('--latency-dist', default='lognormal', choices=['constant', 'uniform', 'exponential',
+                                                                         'lognormal'])
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of HTTP 500 responses')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of HTTP 429 responses')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=int, default=60, help='airbnb_run timeout (seconds)')
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--json', help='also write the results to this file')
+    # Options of the worker and crawl processes started by the cells
+    parser.add_argument('--run', choices=['worker', 'crawl'], help=argparse.SUPPRESS)
+    parser.add_argument('--broker-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--ready-file', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run == 'worker':
+        args.concurrency, args.pool, args.prefetch = args.concurrency[0], args.pool[0], args.prefetch[0]
+        run_worker(args)
+        return
+    if args.run == 'crawl':
+        args.listings, args.batch_size, args.mode = args.listings[0], args.batch_size[0], args.mode[0]
+        run_crawl(args)
+        return
+
+    sys.path.insert(0, ROOT)
+    print(f"{'mode':<10}{'pool':<9}{'conc':>5}{'batch':>6}{'pf':>4}{'lst':>5}{'pages':>6}{'pages/s':>9}"
+          f"{'http p50/p95/p99 ms':>21}{'queue p95':>10}{'500':>5}{'429':>5}{'reviews':>13}"
+          f"{'worker MB':>10}{'crawl MB':>9}  status")
+    results = []
+    for mode, pool, concurrency, prefetch, listings, pages in itertools.product(
+            args.mode, args.pool, args.concurrency, args.prefetch, args.listings, args.pages):
+        for batch_size in args.batch_size or [concurrency]:
+            cell = {'mode': mode, 'pool': pool, 'concurrency': concurrency, 'batch_size': batch_size,
+                    'prefetch': prefetch, 'listings': listings, 'pages': pages}
+            result = run_cell(cell, args)
+            results.append(result)
+            http = '/'.join(f"{result['http_ms'][q]:.0f}" for q in (0.5, 0.95, 0.99))
+            print(f"{mode:<10}{pool:<9}{concurrency:>5}{batch_size:>6}{prefetch:>4}{listings:>5}{pages:>6}"
+                  f"{result['pages_per_second']:>9.1f}{http:>21}{result['queue_wait_ms'][0.95]:>10.0f}"
+                  f"{result['errors']:>5}{result['throttled']:>5}"
+                  f"{result['reviews']:>6}/{result['reviews_expected']:<6}{result['worker_mb']:>10.0f}"
+                  f"{result['crawl_mb']:>9.0f}  {result['status']}", flush=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'options': {name: value for name, value in vars(args).items() if not name.endswith('_file')},
+                       'results': results}, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
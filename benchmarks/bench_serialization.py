@@ -0,0 +1,109 @@
+"""
+Compare the message size and the encode/decode CPU time of the task serializers on real-shaped payloads.
+
+Payloads: the checked-in shared_data/airbnb/*.json GraphQL pages as a fetch_comments result (raw), the extracted
+records of a page (extract=True), a fetch_comments_batch result of --batch extracted pages, and the arguments of a
+fetch_comments_batch message. Every payload is wrapped in the result meta Celery sends back, and encoded through
+kombu exactly as a message body would be.
+
+Usage: python -m benchmarks.bench_serialization --repeat 50
+"""
+import argparse
+import glob
+import json
+import time
+
+from kombu.compression import compress, decompress
+from kombu.serialization import dumps, loads
+
+import crawler  # noqa: F401  (registers the msgpack-zlib serializer)
+from crawler import celery_config
+from crawler.utils.fetch_data import get_comments_count_from_airbnb, get_reviews_from_airbnb
+
+
+def load_payloads(batch):
+    pages = []
+    for path in sorted(glob.glob('shared_data/airbnb/*.json')):
+        with open(path, encoding='utf-8') as file:
+            pages.extend(json.load(file))
+    extracted = [{'str_id': 'U3RheUxpc3Rpbmc6MQ==', 'offset': str(index * 50),
+                  'reviews_count': get_comments_count_from_airbnb(page), 'reviews': get_reviews_from_airbnb(page)}
+                 for index, page in enumerate(pages)]
+    batch_result = [{'result': extracted[index % len(extracted)]} for index in range(batch)]
+    arguments = [[[f'U3RheUxpc3Rpbmc6{index}', str(index * 50)] for index in range(batch)], {'extract': True}, {}]
+    return {
+        'raw page': pages,
+        'extracted page': extracted,
+        f'batch of {batch}': [batch_result],
+        'task arguments': [arguments],
+    }
+
+
+def result_meta(value):
+    # What the result backend encodes for a successful task
+    return {'status': 'SUCCESS', 'result': value, 'traceback': None, 'children': [],
+            'date_done': '2024-11-03T12:00:00.000000+00:00', 'task_id': 'c8d2a1e4-5b0f-4f5e-9a53-0e1f2a3b4c5d'}
+
+
+def measure(values, encode, decode, repeat):
+    encoded = [encode(value) for value in values]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            encode(value)
+    encode_time = (time.perf_counter() - start) / (repeat * len(values))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for body in encoded:
+            decode(body)
+    decode_time = (time.perf_counter() - start) / (repeat * len(values))
+    size = sum(len(body) for body in encoded) / len(values)
+    return size, encode_time, decode_time
+
+
+def codecs(levels):
+    accept = {'application/json', 'application/x-msgpack-zlib'}
+
+    def serializer(name, content_type, threshold=None, level=None):
+        def encode(value):
+            if threshold is not None:
+                celery_config.crawler_compress_threshold, celery_config.crawler_compress_level = threshold, level
+            return dumps(value, serializer=name)[2]
+        return encode, lambda body: loads(body, content_type, 'binary' if name != 'json' else 'utf-8', accept=accept)
+
+    def json_zlib():
+        # Celery's own task_compression / result_compression = 'zlib' on top of json
+        return (lambda value: compress(dumps(value, serializer='json')[2], 'zlib')[0],
+                lambda body: loads(decompress(body, 'application/x-gzip'), 'application/json', 'utf-8',
+                                   accept=accept))
+
+    yield 'json', serializer('json', 'application/json')
+    yield 'json + zlib', json_zlib()
+    yield 'msgpack-zlib, no compression', serializer('msgpack-zlib', 'application/x-msgpack-zlib', 1 << 62, 1)
+    for level in levels:
+        yield f'msgpack-zlib, level {level}', serializer('msgpack-zlib', 'application/x-msgpack-zlib', 1024, level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=8, help='pages per fetch_comments_batch result')
+    parser.add_argument('--levels', default='1,6', help='comma-separated zlib levels')
+    args = parser.parse_args()
+
+    threshold, level = celery_config.crawler_compress_threshold, celery_config.crawler_compress_level
+    payloads = load_payloads(args.batch)
+    print(f"{'payload':<16}{'serializer':<30}{'bytes':>10}{'ratio':>8}{'encode ms':>11}{'decode ms':>11}")
+    for payload_name, values in payloads.items():
+        values = [result_meta(value) for value in values]
+        baseline = None
+        for codec_name, (encode, decode) in codecs([int(level) for level in args.levels.split(',')]):
+            size, encode_time, decode_time = measure(values, encode, decode, args.repeat)
+            baseline = baseline or size
+            print(f"{payload_name:<16}{codec_name:<30}{size:>10.0f}{baseline / size:>7.1f}x"
+                  f"{encode_time * 1000:>11.3f}{decode_time * 1000:>11.3f}")
+    celery_config.crawler_compress_threshold, celery_config.crawler_compress_level = threshold, level
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Throughput (documents per second) and peak memory of the streaming topic model stage (utils/topic_model.py).
+
+The corpus is generated on the fly from the English review texts of the checked-in shared_data/airbnb/*.json sample:
+every document is a real review with a random share of its words dropped, so --documents can go far beyond what
+would fit in memory. Every configuration runs in a fresh process, so the peak RSS of one does not hide another's.
+
+Usage: python -m benchmarks.bench_topic_model --documents 20000,200000 --workers 0,2,4
+"""
+import argparse
+import glob
+import json
+import random
+import resource
+import subprocess
+import sys
+
+
+def sample_texts():
+    from utils.data_processing import clean_reviews, extract_reviews
+
+    texts = []
+    for path in sorted(glob.glob('shared_data/airbnb/*.json')):
+        with open(path, encoding='utf-8') as file:
+            texts.extend(clean_reviews(extract_reviews(json.load(file))))
+    return texts
+
+
+def generate(texts, count, seed=0):
+    # Lazily, one document at a time
+    rng = random.Random(seed)
+    for _ in range(count):
+        words = rng.choice(texts).split()
+        yield ' '.join(word for word in words if rng.random() > 0.3)
+
+
+def run_one(documents, workers, topics, chunk_size):
+    from utils.topic_model import TopicModelStage
+
+    stage = TopicModelStage(topics, chunk_size=chunk_size, workers=workers)
+    stage.run(generate(sample_texts(), documents))
+    return {'documents': stage.documents, 'seconds': stage.seconds,
+            'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'children_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', default='20000', help='comma-separated corpus sizes')
+    parser.add_argument('--workers', default='0,2', help='comma-separated numbers of vectorizing processes')
+    parser.add_argument('--topics', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_one(int(args.documents), int(args.workers), args.topics, args.chunk_size)))
+        return
+
+    print(f"{'documents':>10}{'workers':>8}{'docs/s':>10}{'seconds':>9}{'main MB':>9}{'worker MB':>10}")
+    for documents in args.documents.split(','):
+        for workers in args.workers.split(','):
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_topic_model', '--run',
+                                     '--documents', documents, '--workers', workers, '--topics', str(args.topics),
+                                     '--chunk-size', str(args.chunk_size)],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            rate = result['documents'] / result['seconds'] if result['seconds'] > 0 else 0.0
+            print(f"{documents:>10}{workers:>8}{rate:>10.0f}{result['seconds']:>9.2f}{result['rss_mb']:>9.1f}"
+                  f"{result['children_rss_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare pages per second of one worker process for the fetch path in different worker modes.
+
+  prefork         one blocking requests.get per page, a new connection every time (the old task code)
+  prefork-pooled  one blocking request at a time over the process's keep-alive session
+  gevent          --concurrency greenlets sharing the keep-alive session (CRAWLER_WORKER_POOL=gevent)
+
+Every mode runs in its own interpreter, because gevent has to monkey-patch the socket module before
+requests is imported. The mock endpoint runs in a separate process so it does not share the GIL.
+
+Usage: python -m benchmarks.bench_worker_pool --pages 200 --latency 0.05 --concurrency 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+MODES = ['prefork', 'prefork-pooled', 'gevent']
+
+
+def run_mode(mode, base_url, pages, concurrency):
+    """
+    Fetch `pages` pages from the mock endpoint in the given mode, inside the current interpreter.
+
+    Returns:
+        dict: The number of pages and the elapsed time.
+    """
+    if mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    import requests
+
+    from crawler import celery_config
+    from crawler.utils.http_client import send_request
+    from crawler.utils.request_content import comment_request_from_airbnb
+
+    # Measure the raw fetch path, not the politeness budget of the real host
+    celery_config.crawler_rate_limits[urlparse(base_url).netloc] = {'rate': 1e9, 'burst': 1e9}
+
+    def fetch(offset):
+        request_config = comment_request_from_airbnb('bench', offset)
+        request_config[0] = base_url
+        if mode == 'prefork':
+            response = requests.get(url=request_config[0], headers=request_config[1], params=request_config[2])
+        else:
+            response = send_request(request_config)
+        return response.json()
+
+    offsets = [i * 50 for i in range(pages)]
+    start_time = time.perf_counter()
+    if mode == 'gevent':
+        from gevent.pool import Pool
+        list(Pool(concurrency).imap_unordered(fetch, offsets))
+    else:
+        for offset in offsets:
+            fetch(offset)
+    return {'pages': pages, 'elapsed': time.perf_counter() - start_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--run', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_mode(args.run, args.url, args.pages, args.concurrency)))
+        return
+
+    import requests
+
+    # Large enough that every requested offset returns a full page
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.mock_airbnb', '--port', str(args.port),
+                               '--reviews', str(args.pages * 50), '--latency', str(args.latency)],
+                              stdout=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        for _ in range(50):
+            try:
+                requests.get(f'{base_url}/stats', timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        print(f"{'mode':<16}{'pages':>8}{'seconds':>10}{'pages/s':>10}{'connections':>13}")
+        for mode in MODES:
+            # The worker mode is selected the same way as for a real worker, through the config switch
+            env = dict(os.environ, CRAWLER_WORKER_POOL='gevent' if mode == 'gevent' else 'prefork',
+                       CRAWLER_WORKER_CONCURRENCY=str(args.concurrency), CRAWLER_RATE_LIMIT_STORE='memory://')
+            before = requests.get(f'{base_url}/stats').json()
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_worker_pool', '--run', mode,
+                                     '--url', f'{base_url}/api', '--pages', str(args.pages),
+                                     '--concurrency', str(args.concurrency)],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            after = requests.get(f'{base_url}/stats').json()
+            connections = after['connections'] - before['connections'] - 1  # minus the /stats probe
+            print(f"{mode:<16}{result['pages']:>8}{result['elapsed']:>10.2f}"
+                  f"{result['pages'] / result['elapsed']:>10.1f}{connections:>13}")
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Check that worker and orchestrator startup stay light: import time, peak RSS and no analytics dependencies.
+
+Every entry point is imported in a fresh interpreter --repeat times. The check fails (exit status 1) if the median
+import time or the peak RSS of an entry point is over its budget, or if it loads one of the --forbidden modules
+(pandas, scikit-learn and friends belong to the analytics code and are imported on demand there).
+
+Usage: python -m benchmarks.check_startup --max-seconds 1.0 --max-rss-mb 80
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Entry point -> the code its process runs at startup
+ENTRY_POINTS = {
+    'worker': 'from crawler import app; app.loader.import_default_modules()',
+    'orchestrator (airbnb)': 'import airbnb',
+    'orchestrator (booking)': 'import booking',
+    'main': 'import main',
+}
+
+MEASURE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'modules': sorted({{name.partition('.')[0] for name in sys.modules}})}}))
+'''
+
+
+def measure(code, repeat):
+    """
+    Import an entry point in `repeat` fresh interpreters.
+
+    Returns:
+        dict: The median import time (seconds), the largest peak RSS (MB) and the top-level modules loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', MEASURE.format(code=code)], check=True, capture_output=True,
+                                text=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {'seconds': statistics.median(run['seconds'] for run in runs),
+            'rss_mb': max(run['rss_mb'] for run in runs),
+            'modules': set(runs[0]['modules'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='import time budget per entry point')
+    parser.add_argument('--max-rss-mb', type=float, default=80, help='peak RSS budget per entry point')
+    parser.add_argument('--forbidden', default='pandas,sklearn,scipy,numpy,matplotlib',
+                        help='comma-separated top-level modules that must not be loaded at startup')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    forbidden = set(args.forbidden.split(','))
+    failures = []
+    print(f"{'entry point':<26}{'import s':>10}{'peak MB':>9}  heavy modules")
+    for name, code in ENTRY_POINTS.items():
+        result = measure(code, args.repeat)
+        heavy = sorted(result['modules'] & forbidden)
+        print(f"{name:<26}{result['seconds']:>10.3f}{result['rss_mb']:>9.1f}  {', '.join(heavy) or '-'}")
+        if result['seconds'] > args.max_seconds:
+            failures.append(f"{name}: import takes {result['seconds']:.3f} s, budget {args.max_seconds} s")
+        if result['rss_mb'] > args.max_rss_mb:
+            failures.append(f"{name}: peak RSS {result['rss_mb']:.1f} MB, budget {args.max_rss_mb} MB")
+        if heavy:
+            failures.append(f"{name}: imports {', '.join(heavy)} at startup")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("Startup within budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+A broker and result backend on the local filesystem, for benchmarks that run the orchestrator and real Celery worker
+processes on one host without a RabbitMQ server.
+"""
+import json
+import os
+import time
+import uuid
+
+from celery.app.backends import BACKEND_ALIASES
+from celery.backends.filesystem import FilesystemBackend
+from kombu.transport import TRANSPORT_ALIASES, filesystem
+
+
+class AtomicFilesystemChannel(filesystem.Channel):
+    """
+    Kombu's filesystem channel, except that a message only appears in the queue folder once it is complete.
+
+    The stock channel writes the message file in place, and a consumer polling the folder at that moment moves away
+    and decodes a truncated message.
+    """
+
+    def _put(self, queue, payload, **kwargs):
+        filename = f'{time.time_ns()}_{uuid.uuid4()}.{queue}.msg'
+        temporary_path = os.path.join(self.data_folder_out, f'{uuid.uuid4()}.tmp')
+        with open(temporary_path, 'wb') as file:
+            file.write(json.dumps(payload).encode('utf-8'))
+        os.replace(temporary_path, os.path.join(self.data_folder_out, filename))
+
+
+class AtomicFilesystemTransport(filesystem.Transport):
+    Channel = AtomicFilesystemChannel
+
+
+class AtomicFilesystemBackend(FilesystemBackend):
+    """
+    Celery's file result backend with atomic writes, a result polled while it is written is not read half-written.
+    """
+
+    def _find_path(self, url):
+        return url.partition('://')[2]
+
+    def set(self, key, value):
+        temporary_path = self._filename(key) + b'.tmp'
+        with self.open(temporary_path, 'wb') as file:
+            file.write(value if isinstance(value, bytes) else value.encode('utf-8'))
+        os.replace(temporary_path, self._filename(key))
+
+
+def configure_app(app, broker_dir):
+    """
+    Point the Celery app at the filesystem broker and result backend in `broker_dir`.
+    """
+    queue_dir = os.path.join(broker_dir, 'queue')
+    results_dir = os.path.join(broker_dir, 'results')
+    os.makedirs(queue_dir, exist_ok=True)
+    os.makedirs(results_dir, exist_ok=True)
+    TRANSPORT_ALIASES['bench-filesystem'] = 'benchmarks.local_broker:AtomicFilesystemTransport'
+    BACKEND_ALIASES['bench-file'] = 'benchmarks.local_broker:AtomicFilesystemBackend'
+    app.conf.update(broker_url='bench-filesystem://', result_backend=f'bench-file://{results_dir}',
+                    broker_transport_options={'data_folder_in': queue_dir, 'data_folder_out': queue_dir,
+                                              'control_folder': os.path.join(broker_dir, 'control'),
+                                              'polling_interval': 0.005})
@@ -0,0 +1,238 @@
+"""
+Local stand-in for the Airbnb StaysPdpReviewsQuery endpoint, used by the benchmarks.
+
+The response latency follows a configurable distribution, and a share of the requests can be answered with HTTP 500
+or with HTTP 429 and a Retry-After header.
+
+Run it on its own with "python -m benchmarks.mock_airbnb --port 8765 --reviews 500 --latency 0.05", then point the
+workers at it with CRAWLER_AIRBNB_URL=http://127.0.0.1:8765/api (crawler/celery_config.py).
+"""
+import argparse
+import datetime
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Date of the oldest review, every later review is posted one hour after the previous one
+FIRST_REVIEW_DATE = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_review(listing_id, index, reviews_count):
+    """
+    Build one review node shaped like the ones returned by the real endpoint.
+
+    Reviews are numbered from the oldest one, so raising the review count adds new reviews in front
+    (MOST_RECENT order) while the already existing reviews keep their ids.
+
+    Args:
+        listing_id (str): The listing the review belongs to.
+        index (int): The position of the review in MOST_RECENT order.
+        reviews_count (int): The total number of reviews the listing has.
+
+    Returns:
+        dict: A PdpReviewForP3 node.
+    """
+    number = reviews_count - 1 - index
+    created_at = FIRST_REVIEW_DATE + datetime.timedelta(hours=number)
+    return {
+        "__typename": "PdpReviewForP3",
+        "collectionTag": None,
+        "comments": f"Review {number} of {listing_id}. The room was <b>clean</b> and the host was friendly.<br/>"
+                    f"Would stay again.",
+        "id": str(1_000_000_000 + number),
+        "language": "en",
+        "createdAt": created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "reviewer": {
+            "__typename": "ReviewUser",
+            "deleted": False,
+            "firstName": "Guest",
+            "id": str(500_000_000 + number),
+            "pictureUrl": "https://a0.muscache.com/im/pictures/user/placeholder.jpg",
+        },
+        "localizedDate": "August 2024",
+        "localizedReview": None,
+        "rating": 5,
+        "response": "Thank you for staying with us!",
+    }
+
+
+def make_page(listing_id, offset, limit, reviews_count):
+    """
+    Build one StaysPdpReviewsQuery response page.
+
+    Args:
+        listing_id (str): The listing ID from the request variables.
+        offset (int): The pagination offset from the request variables.
+        limit (int): The page size from the request variables.
+        reviews_count (int): The total number of reviews the listing has.
+
+    Returns:
+        dict: The response body.
+    """
+    reviews = [make_review(listing_id, i, reviews_count) for i in range(offset, min(offset + limit, reviews_count))]
+    return {
+        "data": {
+            "presentation": {
+                "__typename": "RootPresentationContainer",
+                "stayProductDetailPage": {
+                    "__typename": "StayPDPPresentationContainer",
+                    "reviews": {
+                        "__typename": "PdpReviews",
+                        "reviews": reviews,
+                        "metadata": {"__typename": "PdpReviewsMetadata", "reviewsCount": reviews_count},
+                    }
+                }
+            }
+        },
+        "extensions": {"traceId": "mock"}
+    }
+
+
+def latency_sampler(distribution, mean, sigma=0.5, seed=None):
+    """
+    Build a function drawing response latencies.
+
+    Args:
+        distribution (str): 'constant', 'uniform' (0 to 2 * mean), 'exponential' or 'lognormal' (with `sigma`, a long
+            tail like the one of a real endpoint).
+        mean (float): The mean latency (in seconds).
+        sigma (float): The standard deviation of the logarithm of the latency for 'lognormal'.
+        seed (int): Seed of the random generator, for repeatable runs.
+
+    Returns:
+        callable: A function without arguments returning a latency (in seconds).
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    if distribution == 'constant' or mean <= 0:
+        return lambda: mean
+    # Shift the location of the lognormal distribution so it keeps the requested mean
+    mu = math.log(mean) - sigma ** 2 / 2
+    draws = {
+        'uniform': lambda: rng.uniform(0, 2 * mean),
+        'exponential': lambda: rng.expovariate(1 / mean),
+        'lognormal': lambda: rng.lognormvariate(mu, sigma),
+    }
+    if distribution not in draws:
+        raise ValueError(f"Unknown latency distribution: {distribution!r}")
+    draw = draws[distribution]
+
+    def sample():
+        with lock:
+            return draw()
+
+    return sample
+
+
+class MockAirbnbHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this Nagle + delayed ACK adds ~40 ms per kept-alive request
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            with self.server.stats_lock:
+                stats = dict(self.server.stats)
+            self._send_json(stats)
+            return
+
+        query = parse_qs(url.query)
+        variables = json.loads(query['variables'][0])
+        request = variables['pdpReviewsRequest']
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+            outcome = self.server.random.random()
+            if outcome < self.server.error_rate:
+                self.server.stats['errors'] += 1
+            elif outcome < self.server.error_rate + self.server.throttle_rate:
+                self.server.stats['throttled'] += 1
+
+        time.sleep(self.server.latency_sampler())
+        if outcome < self.server.error_rate:
+            self._send_json({"errors": [{"message": "Internal server error"}]}, status=500)
+        elif outcome < self.server.error_rate + self.server.throttle_rate:
+            self._send_json({"errors": [{"message": "Too many requests"}]}, status=429,
+                            headers={'Retry-After': str(self.server.retry_after)})
+        else:
+            self._send_json(make_page(variables['id'], request['offset'], request['limit'], self.server.reviews_count))
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, reviews_count=500, latency=0.05, latency_distribution='constant', latency_sigma=0.5,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=None):
+    """
+    Start the mock server on a background thread.
+
+    Args:
+        port (int): The port to listen on, 0 picks a free one.
+        reviews_count (int): The number of reviews every listing has, can be changed on `server.reviews_count`.
+        latency (float): The mean time (in seconds) the server waits before answering.
+        latency_distribution (str): The distribution of the latency, see latency_sampler.
+        latency_sigma (float): The sigma of the 'lognormal' distribution.
+        error_rate (float): The share of requests answered with HTTP 500.
+        throttle_rate (float): The share of requests answered with HTTP 429 and a Retry-After header.
+        retry_after (int): The Retry-After value (in seconds) of the 429 responses.
+        seed (int): Seed of the random generators, for repeatable runs.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its address is in `server.server_address`
+        and its request/connection/error counters in `server.stats`.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockAirbnbHandler)
+    server.daemon_threads = True
+    server.reviews_count = reviews_count
+    server.latency_sampler = latency_sampler(latency_distribution, latency, latency_sigma, seed)
+    server.error_rate = error_rate
+    server.throttle_rate = throttle_rate
+    server.retry_after = retry_after
+    server.random = random.Random(seed)
+    server.stats = {'requests': 0, 'connections': 0, 'errors': 0, 'throttled': 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--reviews', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--latency-dist', default='constant', choices=['constant', 'uniform', 'exponential', 'lognormal'])
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    mock = start_server(args.port, args.reviews, args.latency, args.latency_dist, args.latency_sigma, args.error_rate,
+                        args.throttle_rate, args.retry_after, args.seed)
+    print(f"Mock Airbnb endpoint listening on http://127.0.0.1:{mock.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.shutdown()
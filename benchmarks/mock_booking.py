@@ -0,0 +1,211 @@
+"""
+Local stand-in for the Booking.com ReviewList GraphQL endpoint, used by the benchmarks.
+
+The response holds exactly the fields selected by the query, so a trimmed query gets a smaller response like it does
+from the real endpoint. Page sizes above --max-page-size are capped.
+
+Run it on its own with "python -m benchmarks.mock_booking --port 8766 --reviews 300 --latency 0.05".
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_PATTERN = re.compile(r'\.\.\.\s*on\s+\w+|\w+|[{}]')
+
+
+def parse_selection(query):
+    """
+    Turn the selection set of a GraphQL query into nested dicts of field names (None for a leaf field).
+
+    Fragments ('... on Type') are merged into the enclosing selection, arguments and the operation header are ignored.
+    """
+    body = query[query.index('{') + 1:query.rindex('}')]
+    body = re.sub(r'\([^)]*\)', '', body)
+    root = {}
+    stack = [root]
+    last_field = None
+    for token in TOKEN_PATTERN.findall(body):
+        if token == '{':
+            if last_field is None:  # The block of a fragment
+                stack.append(stack[-1])
+            else:
+                stack[-1][last_field] = {}
+                stack.append(stack[-1][last_field])
+            last_field = None
+        elif token == '}':
+            stack.pop()
+            last_field = None
+        elif token.startswith('...'):
+            last_field = None
+        else:
+            stack[-1][token] = None
+            last_field = token
+    return root
+
+
+def project(value, selection):
+    """Keep only the selected fields of a response value."""
+    if selection is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, selection) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], sub) for key, sub in selection.items() if key in value}
+    return value
+
+
+def make_review_card(hotel_id, index):
+    """
+    Build one review card with every field of the full ReviewList query.
+    """
+    return {
+        "reviewUrl": f"review-{hotel_id}-{index}",
+        "guestDetails": {
+            "username": "Guest", "avatarUrl": "https://cf.bstatic.com/static/img/review/avatars/ava-g.png",
+            "countryCode": "gb", "countryName": "United Kingdom", "avatarColor": "#0077cc",
+            "showCountryFlag": True, "anonymous": False, "guestTypeTranslation": "Couple",
+            "__typename": "GuestDetails",
+        },
+        "bookingDetails": {
+            "customerType": "COUPLES", "roomId": 1234501,
+            "roomType": {"id": "1234501", "name": "Deluxe Double Room", "__typename": "RoomTranslation"},
+            "checkoutDate": "2024-08-12", "checkinDate": "2024-08-10", "numNights": 2,
+            "__typename": "BookingDetails",
+        },
+        "reviewedDate": 1723420800,
+        "isReviewerChoice": False,
+        "isTranslatable": False,
+        "helpfulVotesCount": 0,
+        "reviewScore": 9,
+        "textDetails": {
+            "title": f"Review {index} of {hotel_id}",
+            "positiveText": "Great location and very friendly staff, the room was clean and quiet.",
+            "negativeText": "Breakfast could have had more choice.",
+            "textTrivialFlag": 0,
+            "lang": "en",
+            "__typename": "TextDetails",
+        },
+        "isApproved": True,
+        "partnerReply": {"reply": "Thank you for your review!", "__typename": "PartnerReply"},
+        "positiveHighlights": [{"start": 0, "end": 14, "__typename": "Highlight"}],
+        "negativeHighlights": [],
+        "uvcUrl": "",
+        "editUrl": "",
+        "photos": [{
+            "id": f"{hotel_id}{index}",
+            "urls": [{"size": size, "url": f"https://cf.bstatic.com/xdata/images/review/{size}/{hotel_id}{index}.jpg",
+                      "__typename": "PhotoUrl"} for size in ('max300', 'max500', 'max1280')],
+            "kind": "PHOTO",
+            "__typename": "ReviewPhoto",
+        }] if index % 5 == 0 else [],
+        "__typename": "ReviewCard",
+    }
+
+
+def make_filters():
+    """
+    Build the rating scores, filters and sorters the full query returns with every page.
+    """
+    def entry(name, value, count):
+        return {"name": name, "value": value, "count": count, "__typename": "ReviewFilter"}
+
+    return {
+        "ratingScores": [{"name": name, "translation": name.title(), "value": 8.7,
+                          "ufiScoresAverage": {"ufiScoreLowerBound": 7.9, "ufiScoreHigherBound": 8.9,
+                                               "__typename": "UfiScoresAverage"},
+                          "__typename": "RatingScore"}
+                         for name in ('hotel_staff', 'hotel_services', 'hotel_clean', 'hotel_comfort',
+                                      'hotel_value', 'hotel_location', 'hotel_free_wifi')],
+        "topicFilters": [{"id": i, "name": f"topic{i}", "isSelected": False,
+                          "translation": {"id": i, "name": f"Topic {i}", "__typename": "TopicTranslation"},
+                          "__typename": "TopicFilter"} for i in range(8)],
+        "reviewScoreFilter": [entry(f"score{i}", str(i), 10 * i) for i in range(5)],
+        "languageFilter": [dict(entry(f"lang{i}", f"l{i}", i), countryFlag=f"f{i}") for i in range(20)],
+        "timeOfYearFilter": [entry(season, season, 25) for season in ('spring', 'summer', 'autumn', 'winter')],
+        "customerTypeFilter": [entry(kind, kind, 20) for kind in ('FAMILIES', 'COUPLES', 'SOLO', 'GROUP', 'BUSINESS')],
+        "sorters": [{"name": name, "value": name, "__typename": "Sorter"}
+                    for name in ('MOST_RELEVANT', 'NEWEST_FIRST', 'OLDEST_FIRST', 'SCORE_DESC', 'SCORE_ASC')],
+    }
+
+
+class MockBookingHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            stats = dict(self.server.stats)
+        self._send_json(stats)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        request = payload['variables']['input']
+        skip = request['skip']
+        limit = min(request['limit'], self.server.max_page_size)
+        reviews_count = self.server.reviews_count
+        result = dict(make_filters(), reviewsCount=reviews_count, __typename='ReviewListFrontendResult',
+                      reviewCard=[make_review_card(request['hotelId'], i)
+                                  for i in range(skip, min(skip + limit, reviews_count))])
+        response = project({"data": {"reviewListFrontend": result}}, {"data": parse_selection(payload['query'])})
+
+        time.sleep(self.server.latency)
+        body = self._send_json(response)
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+            self.server.stats['bytes'] += body
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, reviews_count=300, latency=0.05, max_page_size=25):
+    """
+    Start the mock server on a background thread.
+
+    Args:
+        port (int): The port to listen on, 0 picks a free one.
+        reviews_count (int): The number of reviews every hotel has.
+        latency (float): The time (in seconds) the server waits before answering.
+        max_page_size (int): The largest number of reviews served per page.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its request and response byte counters are in `server.stats`.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockBookingHandler)
+    server.daemon_threads = True
+    server.reviews_count = reviews_count
+    server.latency = latency
+    server.max_page_size = max_page_size
+    server.stats = {'requests': 0, 'bytes': 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--reviews', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--max-page-size', type=int, default=25)
+    args = parser.parse_args()
+    mock = start_server(args.port, args.reviews, args.latency, args.max_page_size)
+    print(f"Mock Booking.com endpoint listening on http://127.0.0.1:{mock.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.shutdown()
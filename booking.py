@@ -0,0 +1,146 @@
+import math
+import os
+import time
+from collections import deque
+
+from crawler import celery_config
+from crawler.fetch_comments_from_booking.tasks import fetch_comments
+from crawler.utils.metrics import get_metrics
+from crawler.utils.scheduler import FairShareScheduler, Job
+from utils.review_sink import ReviewSink
+
+
+class BookingHotelJob(Job):
+    """
+    The crawl of the reviews of one Booking.com hotel as a job of the FairShareScheduler.
+
+    The job starts with the first page, whose review count decides which pages follow. Every page is appended to
+    shared_data/booking/booking_<hotel_id>.ndjson as it arrives, the file is renamed into place when the hotel
+    completes. Jobs of this kind can run in the same scheduler as AirbnbListingJob.
+
+    Args:
+        hotel_id (int): The Booking.com hotel ID.
+        ufi (int): The ID of the city the hotel is in.
+        hotel_country_code (str): The country code of the hotel, e.g. 'gb'.
+        projection (bool): Request only the fields the extractors use, with crawler_booking_page_size reviews per
+            page (crawler/celery_config.py), instead of the full review cards 10 at a time.
+    """
+
+    def __init__(self, hotel_id, ufi, hotel_country_code, projection=True):
+        self.name = f'booking:{hotel_id}'
+        self.hotel_id = hotel_id
+        self.ufi = ufi
+        self.hotel_country_code = hotel_country_code
+        self.projection = projection
+        self.page_size = celery_config.crawler_booking_page_size if projection else 10
+        self.state = 'probe'  # 'probe', 'pages', 'done' or 'failed'
+        self.error = None
+        self.pages_received = 0
+        self.start_time = time.time()
+        self._pending = deque([0])  # Skips of the pages still to request
+        self._in_flight = 0
+        self._sink = None
+        self.ndjson_output_path = f'shared_data/booking/booking_{hotel_id}.ndjson'
+
+    def has_task(self):
+        return bool(self._pending)
+
+    def next_task(self):
+        skip = self._pending.popleft()
+        self._in_flight += 1
+        return skip, fetch_comments.s(hotel_id=self.hotel_id, ufi=self.ufi, hotel_country_code=self.hotel_country_code,
+                                      skip=skip, limit=self.page_size, projection=self.projection, extract=True)
+
+    def is_done(self):
+        return self.state in ('done', 'failed')
+
+    def remaining_tasks(self):
+        return None if self.state == 'probe' else len(self._pending) + self._in_flight
+
+    def on_result(self, tag, result):
+        if self.state == 'failed':
+            self._in_flight -= 1
+            return
+        self.pages_received += 1
+        if self.state == 'probe':
+            self._start(result)
+        else:
+            self._sink.write_page(result)
+        # Only once the page is written: if it raises, the task is handed to on_error instead
+        self._in_flight -= 1
+        if not self._pending and not self._in_flight:
+            self.state = 'done'
+
+    def on_error(self, tag, exc):
+        self._in_flight -= 1
+        if self.state == 'failed':
+            return
+        print(f"Crawl of Booking.com hotel {self.hotel_id} failed at skip {tag}: {exc!r}")
+        self.state = 'failed'
+        self.error = exc
+        self._pending.clear()
+
+    def _start(self, first_page):
+        reviews_count = first_page['reviews_count']
+        served = len(first_page['reviews'])
+        if served < min(self.page_size, reviews_count):
+            # The endpoint caps the page size below what was asked for, paginate with what it serves
+            print(f"Booking.com served {served} reviews per page instead of {self.page_size}")
+            self.page_size = max(served, 1)
+        self._sink = ReviewSink(self.ndjson_output_path, None)
+        self._sink.write_page(first_page)
+        self.state = 'pages'
+        total_pages = math.ceil(reviews_count / self.page_size)
+        self._pending.extend(i * self.page_size for i in range(1, total_pages))
+        if self._pending:
+            print(f"Total reviews for Booking.com hotel {self.hotel_id}: {reviews_count}, {total_pages} pages")
+
+    def finish(self):
+        elapsed_time = time.time() - self.start_time
+        if self.state == 'failed':
+            if self._sink is not None:
+                self._sink.close()
+            print(f"Booking.com hotel {self.hotel_id}: gave up after {self.pages_received} pages")
+            return
+        self._sink.finalize()
+        print(f"Booking.com hotel {self.hotel_id}: {self._sink.records_written} reviews saved to "
+              f"{self.ndjson_output_path} from {self.pages_received} pages in {elapsed_time:.2f} seconds")
+
+
+def booking_run(hotels, max_in_flight, timeout, per_hotel_limit=None, max_active_hotels=None, projection=True):
+    """
+    Fetch the reviews of any number of Booking.com hotels through one fair-share scheduler, like
+    airbnb.scheduled_airbnb_comments does for Airbnb listings.
+
+    Args:
+        hotels (iterable): (hotel_id, ufi, hotel_country_code) of every hotel, a list or any iterable.
+        max_in_flight (int): The maximum number of page tasks in flight over all hotels.
+        timeout (int): The maximum time (in seconds) a single page task may take.
+        per_hotel_limit (int): The maximum number of page tasks in flight for one hotel.
+            Defaults to a quarter of `max_in_flight`.
+        max_active_hotels (int): The maximum number of hotels crawled at the same time. Defaults to `max_in_flight`.
+        projection (bool): Request only the fields the extractors use, with the larger page size.
+
+    Returns:
+        dict: The number of 'hotels' and 'pages' and the 'elapsed' time (in seconds).
+    """
+    start_time = time.time()
+    if per_hotel_limit is None:
+        per_hotel_limit = max(1, max_in_flight // 4)
+    if max_active_hotels is None:
+        max_active_hotels = max_in_flight
+    os.makedirs('shared_data/booking', exist_ok=True)
+
+    scheduler = FairShareScheduler(max_in_flight, per_hotel_limit, max_active_hotels, timeout)
+    scheduler.run(BookingHotelJob(hotel_id, ufi, hotel_country_code, projection)
+                  for hotel_id, ufi, hotel_country_code in hotels)
+
+    elapsed_time = time.time() - start_time
+    print(f"Throughput (Booking.com): {scheduler.jobs_completed} hotels, {scheduler.tasks_completed} pages in "
+          f"{elapsed_time:.2f} seconds")
+    print(f"Retries: {scheduler.retries} pages, hedged requests: {scheduler.hedge.sent} sent, "
+          f"{scheduler.hedge.won} won")
+    print(f"Crawler Time Usage: {elapsed_time} seconds")
+    # The round trip times seen by the orchestrator, next to the snapshots of the workers
+    get_metrics().write_snapshot(force=True)
+    return {'hotels': scheduler.jobs_completed, 'pages': scheduler.tasks_completed, 'elapsed': elapsed_time}
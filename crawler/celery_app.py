@@ -1,6 +1,15 @@
 # Import the Celery class from the celery module
 from celery import Celery
 
+# Import the registration of the compact msgpack-zlib serializer, see crawler/utils/serialization.py
+from crawler.utils.serialization import register_compact_serializer
+
+# Import the queue routing, it also sets the prefetch of a worker from the queues it consumes (crawler_queue_prefetch)
+import crawler.utils.routing  # noqa: F401
+
+# Register the serializer before the configuration is loaded, so accept_content can name it
+register_compact_serializer()
+
 # Create an instance of the Celery class with the name 'crawler'
 # This name is typically the name of your project or a specific part of your application
 app = Celery('crawler')
@@ -15,4 +24,6 @@ app.config_from_object('crawler.celery_config')
 # - 'crawler.fetch_comments_from_booking': This module likely contains tasks related to fetching comments from Booking.com.
 # - 'crawler.fetch_comments_from_airbnb': This module likely contains tasks related to fetching comments from Airbnb.
 # Celery will search these modules for any task definitions (functions decorated with @shared_task or @task) and register them with the Celery application.
-app.autodiscover_tasks(['crawler.fetch_comments_from_airbnb'])
+app.autodiscover_tasks(['crawler.fetch_total_comments_from_booking',
+                        'crawler.fetch_comments_from_booking',
+                        'crawler.fetch_comments_from_airbnb'])
@@ -1,23 +1,41 @@
 # Import the necessary modules
-import requests  # The requests module is used for making HTTP requests in Python
 from celery import shared_task  # Import shared_task from the Celery library to define asynchronous tasks
 
 # Import the function that constructs the request configuration for fetching comments from Airbnb
 from crawler.utils.request_content import comment_request_from_airbnb
+# Import the Celery configuration, it holds the retry settings
+from crawler import celery_config
+# Import the pooled HTTP client wrapper that retries the task on transient errors with backoff
+from crawler.utils.retry import send_request_with_retry
+# Import the per-process metrics registry, the decode and extraction stages are timed
+from crawler.utils.metrics import get_metrics
+# Import the functions that reduce a raw response to the fields the pipeline uses
+from crawler.utils.fetch_data import get_comments_count_from_airbnb, get_reviews_from_airbnb
+# Import the shard writer used when the workers store the pages themselves
+from crawler.utils.shard_store import put_page_shard
 
 
 # Define an asynchronous task using the shared_task decorator provided by Celery
-@shared_task()
-def fetch_comments(str_id, offset):
+@shared_task(bind=True, max_retries=celery_config.crawler_task_max_retries)
+def fetch_comments(self, str_id, offset, extract=False, keep_raw=False, shard_store=None, refresh=False):
     """
     Asynchronous task to fetch comments for a specific Airbnb listing.
 
     Args:
         str_id (str): The unique identifier (string ID) for the Airbnb listing.
         offset (int): The offset parameter used for pagination, indicating the starting point for comments.
+        extract (bool): Extract compact review records on the worker instead of returning the raw response.
+        keep_raw (bool): With `extract`, also return the raw response under 'raw'.
+        shard_store (str): URL of a shard store (see crawler.utils.shard_store). The extracted page (with the raw
+            response unless `extract` is set without `keep_raw`) is written there instead of being returned.
+        refresh (bool): Fetch the page from Airbnb even if the response cache holds it, e.g. to re-fetch an offset
+            where reviews were missed or to find the reviews posted since the last crawl.
 
     Returns:
         dict: The JSON response from the Airbnb API, containing the fetched comments data.
+            With `extract`, a dict with 'str_id', 'offset', 'reviews_count' and 'reviews' (see
+            crawler.utils.fetch_data.get_reviews_from_airbnb) instead.
+            With `shard_store`, only the manifest entry of the written shard (see put_page_shard).
     """
 
     # Generate the request configuration (URL, headers, and parameters) needed to make the API call.
@@ -26,8 +44,60 @@ def fetch_comments(str_id, offset):
 
     # Make an HTTP GET request to the Airbnb API using the generated configuration.
     # The request is sent to the URL specified in request_config[0], with headers request_config[1],
-    # and query parameters request_config[2].
-    response = requests.get(url=request_config[0], headers=request_config[1], params=request_config[2])
+    # and query parameters request_config[2], over a connection reused from the worker's pool.
+    # Connection errors, timeouts, 429 and 5xx retry the task with backoff (crawler/utils/retry.py).
+    response = send_request_with_retry(self, request_config, refresh=refresh)
 
     # Return the JSON content of the response. This typically contains the comments data in dictionary format.
-    return response.json()
+    metrics = get_metrics()
+    with metrics.timer('crawler_json_decode_seconds', source='airbnb'):
+        data = response.json()
+    if not extract and shard_store is None:
+        return data
+
+    # Only the compact records travel back through the broker
+    with metrics.timer('crawler_extract_seconds', source='airbnb'):
+        page = {
+            "str_id": str_id,
+            "offset": offset,
+            "reviews_count": get_comments_count_from_airbnb(data),
+            "reviews": get_reviews_from_airbnb(data)
+        }
+    if keep_raw or not extract:
+        page["raw"] = data
+    if shard_store is not None:
+        # The page goes to the shared store, only its manifest entry travels back through the broker
+        return put_page_shard(shard_store, page)
+    return page
+
+
+# Define the batched variant, one message fetches several pages
+@shared_task()
+def fetch_comments_batch(items, extract=False, keep_raw=False, shard_store=None):
+    """
+    Asynchronous task to fetch several pages, possibly of different Airbnb listings, in one message.
+
+    Every page of its own task costs a broker message, an ack and a result message. Fetching a chunk of pages in one
+    task pays those once per chunk. The pages are fetched one after another and fail independently.
+
+    Args:
+        items (list): [str_id, offset] or [str_id, offset, refresh] of the pages to fetch, see fetch_comments.
+        extract (bool): Extract compact review records on the worker, see fetch_comments.
+        keep_raw (bool): With `extract`, also return the raw responses.
+        shard_store (str): URL of a shard store, the pages are written there, see fetch_comments.
+
+    Returns:
+        list: One dict per item, in the order of `items`: {'result': <fetch_comments result>} on success,
+            {'error': '<exception type>: <message>'} if the page could not be fetched.
+    """
+    results = []
+    for item in items:
+        str_id, offset = item[:2]
+        refresh = len(item) > 2 and item[2]
+        try:
+            # Calling the task runs it right here in the worker, without another message
+            page = fetch_comments(str_id, offset, extract, keep_raw, shard_store, refresh)
+            results.append({"result": page})
+        except Exception as exc:
+            results.append({"error": f"{type(exc).__name__}: {exc}"})
+    return results
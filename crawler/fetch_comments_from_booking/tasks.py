@@ -0,0 +1,57 @@
+# Import the necessary modules
+from celery import shared_task  # Import shared_task from the Celery library to define asynchronous tasks
+
+# Import the function that constructs the request configuration for fetching reviews from Booking.com
+from crawler.utils.request_content import comments_request_form_booking
+# Import the Celery configuration, it holds the retry settings
+from crawler import celery_config
+# Import the pooled HTTP client wrapper that retries the task on transient errors with backoff
+from crawler.utils.retry import send_request_with_retry
+# Import the per-process metrics registry, the decode and extraction stages are timed
+from crawler.utils.metrics import get_metrics
+# Import the functions that reduce a raw response to the fields the pipeline uses
+from crawler.utils.fetch_data import get_comment_count_from_booking, get_comments_from_booking
+
+
+# Define an asynchronous task using the shared_task decorator provided by Celery
+@shared_task(bind=True, max_retries=celery_config.crawler_task_max_retries)
+def fetch_comments(self, hotel_id, ufi, hotel_country_code, skip, limit=10, projection=False, extract=False):
+    """
+    Asynchronous task to fetch one page of reviews for a specific Booking.com hotel.
+
+    Args:
+        hotel_id (int): The Booking.com hotel ID.
+        ufi (int): The ID of the city the hotel is in.
+        hotel_country_code (str): The country code of the hotel, e.g. 'gb'.
+        skip (int): The number of reviews to skip, the pagination offset.
+        limit (int): The number of reviews per page.
+        projection (bool): Request only the fields the extractors use instead of the full review cards.
+        extract (bool): Extract compact review records on the worker instead of returning the raw response.
+
+    Returns:
+        dict: The JSON response from the Booking.com API.
+            With `extract`, a dict with 'hotel_id', 'skip', 'reviews_count' and 'reviews' (see
+            crawler.utils.fetch_data.get_comments_from_booking) instead.
+    """
+
+    # Generate the request configuration (URL, headers, and JSON payload) needed to make the API call.
+    request_config = comments_request_form_booking(hotel_id, ufi, hotel_country_code, skip, limit, projection)
+
+    # The Booking.com GraphQL endpoint takes the query as a JSON body, so the request is a POST
+    # over a connection reused from the worker's pool. Transient errors retry the task with backoff.
+    response = send_request_with_retry(self, request_config, method='POST')
+
+    metrics = get_metrics()
+    with metrics.timer('crawler_json_decode_seconds', source='booking'):
+        data = response.json()
+    if not extract:
+        return data
+
+    # Only the compact records travel back through the broker
+    with metrics.timer('crawler_extract_seconds', source='booking'):
+        return {
+            "hotel_id": hotel_id,
+            "skip": skip,
+            "reviews_count": get_comment_count_from_booking(data),
+            "reviews": get_comments_from_booking(data)
+        }
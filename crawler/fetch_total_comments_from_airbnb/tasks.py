@@ -1,5 +1,4 @@
 # Import the necessary modules
-import requests  # The requests module is used for making HTTP requests in Python
 from celery import shared_task  # Import shared_task from the Celery library to define asynchronous tasks
 
 # Import utility functions for constructing the request and processing the response
@@ -7,11 +6,14 @@ from crawler.utils.request_content import \
     comment_request_from_airbnb  # Function to generate the request configuration for fetching comments from Airbnb
 from crawler.utils.fetch_data import \
     get_comments_count_from_airbnb  # Function to extract the total number of comments from the Airbnb API response
+from crawler.utils.retry import \
+    send_request_with_retry  # Pooled HTTP client that retries the task on transient errors with backoff
+from crawler import celery_config  # The Celery configuration, it holds the retry settings
 
 
 # Define an asynchronous task using the shared_task decorator provided by Celery
-@shared_task()
-def fetch_total_comments(str_id, offset):
+@shared_task(bind=True, max_retries=celery_config.crawler_task_max_retries)
+def fetch_total_comments(self, str_id, offset):
     """
     Asynchronous task to fetch the total number of comments for a specific Airbnb listing.
 
@@ -29,8 +31,9 @@ def fetch_total_comments(str_id, offset):
 
     # Make an HTTP GET request to the Airbnb API using the generated configuration.
     # The request is sent to the URL specified in request_config[0], with headers request_config[1],
-    # and query parameters request_config[2].
-    response = requests.get(url=request_config[0], headers=request_config[1], params=request_config[2])
+    # and query parameters request_config[2], over a connection reused from the worker's pool.
+    # Connection errors, timeouts, 429 and 5xx retry the task with backoff.
+    response = send_request_with_retry(self, request_config)
 
     # Extract the total number of comments from the JSON response using the get_comments_count_from_airbnb function.
     total_number = get_comments_count_from_airbnb(response.json())
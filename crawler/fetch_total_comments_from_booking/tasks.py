@@ -0,0 +1,41 @@
+# Import the necessary modules
+from celery import shared_task  # Import shared_task from the Celery library to define asynchronous tasks
+
+# Import utility functions for constructing the request and processing the response
+from crawler.utils.request_content import \
+    comments_request_form_booking  # Function to generate the request configuration for fetching Booking.com reviews
+from crawler.utils.fetch_data import \
+    get_comment_count_from_booking  # Function to extract the total number of reviews from the Booking.com response
+from crawler.utils.retry import \
+    send_request_with_retry  # Pooled HTTP client that retries the task on transient errors with backoff
+from crawler import celery_config  # The Celery configuration, it holds the retry settings
+
+
+# Define an asynchronous task using the shared_task decorator provided by Celery
+@shared_task(bind=True, max_retries=celery_config.crawler_task_max_retries)
+def fetch_total_comments(self, hotel_id, ufi, hotel_country_code):
+    """
+    Asynchronous task to fetch the total number of reviews for a specific Booking.com hotel.
+
+    Args:
+        hotel_id (int): The Booking.com hotel ID.
+        ufi (int): The ID of the city the hotel is in.
+        hotel_country_code (str): The country code of the hotel, e.g. 'gb'.
+
+    Returns:
+        int: The total number of reviews for the hotel as extracted from the API response.
+    """
+
+    # Generate the request configuration (URL, headers, and JSON payload) needed to make the API call.
+    # Only the review count is needed, so the trimmed query is used and a single review is requested.
+    request_config = comments_request_form_booking(hotel_id, ufi, hotel_country_code, 0, limit=1, projection=True)
+
+    # The Booking.com GraphQL endpoint takes the query as a JSON body, so the request is a POST.
+    # Transient errors retry the task with backoff.
+    response = send_request_with_retry(self, request_config, method='POST')
+
+    # Extract the total number of reviews from the JSON response using the get_comment_count_from_booking function.
+    total_number = get_comment_count_from_booking(response.json())
+
+    # Return the total number of reviews.
+    return total_number
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from crawler import celery_config
+from crawler.utils.http_client import reserve_connections
+
+
+class CeleryEngine:
+    """
+    Run tasks on the Celery workers: every task is a message through the broker, its result comes back through the
+    result backend.
+    """
+
+    name = 'celery'
+
+    def apply_async(self, signature, **options):
+        """
+        Send a task.
+
+        Args:
+            signature (celery.canvas.Signature): The task signature to execute.
+            **options: apply_async options such as the queue and priority (see crawler/utils/routing.py).
+
+        Returns:
+            celery.result.AsyncResult: The handle of the result.
+        """
+        return signature.apply_async(**options)
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds for a task to finish. Results are polled, so this simply sleeps."""
+        time.sleep(timeout)
+
+
+class LocalResult:
+    """
+    The handle of a task run by the LocalEngine, with the part of the AsyncResult interface the orchestrators use.
+
+    Args:
+        future (concurrent.futures.Future): The future of the running task.
+    """
+
+    def __init__(self, future):
+        self.id = uuid.uuid4().hex
+        self.future = future
+
+    def ready(self):
+        """Return True once the task has finished, successfully or not."""
+        return self.future.done()
+
+    def successful(self):
+        """Return True if the task has finished without raising."""
+        return self.future.done() and self.future.exception() is None
+
+    def get(self, timeout=None):
+        """Return the result of the task, re-raise its exception if it failed."""
+        return self.future.result(timeout)
+
+
+class LocalEngine:
+    """
+    Run tasks in this process on a pool of threads, without broker, result backend or worker.
+
+    The task is executed with Signature.apply(), i.e. by the same task functions the workers run (fetch_comments,
+    fetch_comments_batch, ...), so the requests go through the same pooled HTTP client, response cache and shared
+    rate limiter, and the results are the same. Only the messaging is gone: no broker round trip per task, no result
+    polling delay. The tasks are I/O bound, so threads are enough to keep `workers` requests in flight.
+
+    Differences to the Celery path: the queue and priority options are ignored (tasks start in the order they are
+    sent, at most `workers` at a time), and a task that retries itself (crawler_task_max_retries) runs again right away
+    instead of after its backoff. The rate limiter still pauses the host after a 429/5xx, and the orchestrator retries
+    a failed page with backoff.
+
+    Args:
+        workers (int): The number of tasks that may run at the same time, crawler_local_workers by default.
+    """
+
+    name = 'local'
+
+    def __init__(self, workers=None):
+        self.workers = workers if workers is not None else celery_config.crawler_local_workers
+        # Every thread may hold a connection, the pool of the HTTP session must not make them queue
+        reserve_connections(self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawler-local')
+        self._finished = threading.Event()
+
+    @staticmethod
+    def _run(signature):
+        return signature.apply().get()
+
+    def apply_async(self, signature, **options):
+        """
+        Start a task on the thread pool.
+
+        Args:
+            signature (celery.canvas.Signature): The task signature to execute.
+            **options: apply_async options, ignored.
+
+        Returns:
+            LocalResult: The handle of the result.
+        """
+        future = self._executor.submit(self._run, signature)
+        future.add_done_callback(lambda _: self._finished.set())
+        return LocalResult(future)
+
+    def wait(self, timeout):
+        """Wait until any task finishes, at most `timeout` seconds, so results are picked up without polling delay."""
+        self._finished.wait(timeout)
+        self._finished.clear()
+
+    def shutdown(self):
+        """Wait for the running tasks and stop the threads."""
+        self._executor.shutdown(wait=True)
+
+
+ENGINES = ('celery', 'local')
+
+_celery_engine = CeleryEngine()
+_local_engine = None
+_local_engine_pid = None
+_local_engine_lock = threading.Lock()
+
+
+def get_engine(name=None):
+    """
+    Return the execution engine of the current process.
+
+    Args:
+        name (str): 'celery' to run the tasks on the Celery workers, 'local' to run them on the thread pool of this
+            process (LocalEngine, created on first use). Defaults to crawler_engine (CRAWLER_ENGINE).
+
+    Returns:
+        CeleryEngine or LocalEngine: The engine.
+    """
+    global _local_engine, _local_engine_pid
+    name = name if name is not None else celery_config.crawler_engine
+    if name == 'celery':
+        return _celery_engine
+    if name != 'local':
+        raise ValueError(f"Unknown engine: {name!r}, expected one of {ENGINES}")
+    # Like the HTTP session, a child process gets a pool of its own instead of the threads it did not inherit
+    pid = os.getpid()
+    if _local_engine is None or _local_engine_pid != pid:
+        with _local_engine_lock:
+            if _local_engine is None or _local_engine_pid != pid:
+                _local_engine = LocalEngine()
+                _local_engine_pid = pid
+    return _local_engine
@@ -1,6 +1,4 @@
-import csv
-
-import pandas as pd
+import re
 
 
 def get_comment_count_from_booking(json_string):
@@ -20,7 +18,124 @@ def get_comments_from_booking(json_string):
     return comments
 
 
+def get_review_nodes_from_airbnb(json_string):
+    """
+    Return the review nodes of an Airbnb StaysPdpReviewsQuery response by following the known path.
+
+    Args:
+        json_string (dict): The decoded response of one review page.
+
+    Returns:
+        list or None: The 'PdpReviewForP3' nodes of the page, None if the response does not have the known shape.
+    """
+    try:
+        reviews = json_string['data']['presentation']['stayProductDetailPage']['reviews']['reviews']
+    except (KeyError, TypeError):
+        return None
+    if not isinstance(reviews, list):
+        return None
+    for review in reviews:
+        if not isinstance(review, dict) or review.get("__typename") != "PdpReviewForP3":
+            return None
+    return reviews
+
+
 def get_comments_count_from_airbnb(json_string):
     comments_count = json_string['data']['presentation']['stayProductDetailPage']['reviews']['metadata'][
         'reviewsCount']
-    return comments_count
\ No newline at end of file
+    return comments_count
+
+
+# Pattern matching HTML tags in review texts, compiled once
+HTML_TAG_PATTERN = re.compile('<.*?>')
+
+
+def remove_html_tags(text):
+    return HTML_TAG_PATTERN.sub('', text)
+
+
+def get_reviews_from_airbnb(json_string):
+    """
+    Extract compact review records from an Airbnb StaysPdpReviewsQuery response.
+
+    Every 'PdpReviewForP3' node becomes one record, the English translation from its nested
+    'LocalizedReview' node is kept as 'localized_text'. Texts are stripped of HTML tags.
+
+    Args:
+        json_string (dict): The decoded response of one review page.
+
+    Returns:
+        list: Records with the keys 'id', 'language', 'text', 'created_at' and 'localized_text'.
+    """
+    def to_record(data):
+        localized = data.get("localizedReview")
+        localized_text = None
+        if isinstance(localized, dict) and localized.get("__typename") == "LocalizedReview" \
+                and localized.get("comments") is not None:
+            localized_text = remove_html_tags(localized["comments"])
+        return {
+            "id": data.get("id"),
+            "language": data.get("language"),
+            "text": remove_html_tags(data["comments"]) if data.get("comments") is not None else None,
+            "created_at": data.get("createdAt"),
+            "localized_text": localized_text
+        }
+
+    # Go straight down the known path, only walk the whole tree for unknown shapes
+    nodes = get_review_nodes_from_airbnb(json_string)
+    if nodes is not None:
+        return [to_record(node) for node in nodes]
+
+    reviews = []
+
+    def recursive_extract(data):
+        if isinstance(data, dict):
+            if data.get("__typename") == "PdpReviewForP3":
+                reviews.append(to_record(data))
+                return
+            for value in data.values():
+                recursive_extract(value)
+        elif isinstance(data, list):
+            for item in data:
+                recursive_extract(item)
+
+    recursive_extract(json_string)
+    return reviews
+
+
+def is_extracted_page(page):
+    """
+    Tell whether a fetch_comments result is a page of extracted records (task ran with `extract`) or a raw response.
+    """
+    return 'reviews' in page and 'reviews_count' in page
+
+
+def get_page_reviews_count(page):
+    """
+    Read the total number of comments from a fetch_comments result.
+
+    Args:
+        page (dict): A raw response, or a page of extracted records when the task ran with `extract`.
+
+    Returns:
+        int: The total number of comments of the listing.
+    """
+    if is_extracted_page(page):
+        return page['reviews_count']
+    return get_comments_count_from_airbnb(page)
+
+
+def get_page_reviews(page):
+    """
+    Read the review records and the raw response from a fetch_comments result.
+
+    Args:
+        page (dict): A raw response, or a page of extracted records when the task ran with `extract`.
+            The records of raw responses are extracted here.
+
+    Returns:
+        tuple: (records, raw response or None if the worker did not return it).
+    """
+    if is_extracted_page(page):
+        return page['reviews'], page.get('raw')
+    return get_reviews_from_airbnb(page), page
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawler import celery_config
+from crawler.utils.metrics import SIZE_BUCKETS, get_metrics
+from crawler.utils.rate_limit import get_rate_limiter
+from crawler.utils.response_cache import get_response_cache
+
+# One session per worker process. The pid is stored with the session so a prefork child never reuses
+# the sockets it inherited from its parent.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+# Connections per host reserved by callers running more fetches at once than crawler_http_pool_maxsize
+_reserved_connections = 0
+
+
+def get_session():
+    """
+    Return the HTTP session of the current process, creating it on first use.
+
+    The session keeps a keep-alive connection pool per host, so consecutive page fetches reuse the same
+    TCP+TLS connection instead of opening a new one for every request. The pool is large enough for every
+    greenlet/thread of a gevent or threads worker to hold its own connection.
+
+    Returns:
+        requests.Session: The shared session of this process.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=celery_config.crawler_http_pool_connections,
+                                      pool_maxsize=max(celery_config.crawler_http_pool_maxsize,
+                                                       _reserved_connections),
+                                      pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+def reserve_connections(count):
+    """
+    Make the session of this process keep at least `count` connections per host.
+
+    For callers running that many fetches at once outside a worker, e.g. the threads of the standalone engine
+    (crawler/utils/engine.py). A session created with a smaller pool is replaced on its next use.
+
+    Args:
+        count (int): The number of concurrent fetches.
+    """
+    global _session, _reserved_connections
+    with _session_lock:
+        if count > _reserved_connections:
+            _reserved_connections = count
+            _session = None
+
+
+def send_request(request_config, method='GET', use_cache=True):
+    """
+    Send the request described by a request configuration through the pooled session.
+
+    If the response cache is enabled, identical requests are answered from it without touching the network or
+    the request budget, unless `use_cache` is False: a request that has to see the current state of the listing (a
+    re-fetch after drift, an incremental crawl, a retry) goes to the network and refreshes the cached body.
+    Otherwise the request first takes a token from the shared rate limiter of its host, and the response status is
+    reported back so the limiter can slow down on 429/5xx. Every request is bounded by crawler_http_timeout, a
+    stalled connection raises requests.Timeout instead of blocking the worker.
+
+    Args:
+        request_config (list): [url, headers, params] as built by crawler.utils.request_content.
+        method (str): 'GET' sends params as the query string, 'POST' sends them as a JSON body (Booking.com GraphQL).
+        use_cache (bool): Whether a cached response may be returned. A successful response is cached either way.
+
+    Returns:
+        requests.Response: The HTTP response. Responses served from the cache carry an 'X-Crawler-Cache: hit' header.
+    """
+    metrics = get_metrics()
+    host = urlparse(request_config[0]).netloc
+    cache = get_response_cache()
+    if cache is not None:
+        cache_key = cache.key(request_config, method)
+        body = cache.get(cache_key) if use_cache else None
+        if body is not None:
+            metrics.inc('crawler_cache_hits_total', host=host)
+            return cached_response(request_config, body)
+
+    rate_limiter = get_rate_limiter()
+    with metrics.timer('crawler_rate_limit_wait_seconds', host=host):
+        rate_limiter.acquire(host)
+    start_time = time.perf_counter()
+    if method == 'POST':
+        response = get_session().post(url=request_config[0], headers=request_config[1], json=request_config[2],
+                                      timeout=celery_config.crawler_http_timeout)
+    else:
+        response = get_session().get(url=request_config[0], headers=request_config[1], params=request_config[2],
+                                     timeout=celery_config.crawler_http_timeout)
+    metrics.observe('crawler_http_seconds', time.perf_counter() - start_time, host=host)
+    metrics.observe('crawler_response_bytes', len(response.content), buckets=SIZE_BUCKETS, host=host)
+    metrics.inc('crawler_http_responses_total', host=host, status=response.status_code)
+    rate_limiter.report(host, response.status_code, response.headers.get('Retry-After'))
+
+    # Only successful responses are worth replaying
+    if cache is not None and response.status_code == 200:
+        cache.put(cache_key, response.content)
+    return response
+
+
+def cached_response(request_config, body):
+    """
+    Build a response object for a body served from the response cache.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.url = request_config[0]
+    response._content = body
+    response.encoding = 'utf-8'
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['X-Crawler-Cache'] = 'hit'
+    return response
@@ -0,0 +1,364 @@
+"""
+Histograms and counters for the hot path of the crawler, in the workers and in the orchestrator.
+
+Every process records into its own registry. Workers write a JSON snapshot of it to crawler_metrics_dir
+(crawler/celery_config.py) at most every crawler_metrics_interval seconds, so prefork children, gevent workers and
+pods on a shared volume all end up in one directory.
+
+  python -m crawler.utils.metrics summary          p50/p95/p99 of every stage over all snapshots
+  python -m crawler.utils.metrics serve --port 9100 Prometheus text format on /metrics, merged JSON on /metrics.json
+"""
+import argparse
+import bisect
+import glob
+import json
+import math
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from celery.signals import (before_task_publish, task_postrun, task_prerun, task_retry, worker_process_shutdown,
+                            worker_shutdown)
+
+from crawler import celery_config
+
+# Bucket upper bounds: 1 ms to ~5 min in steps of 2^(1/4) (~19%) for durations, 64 B to 64 MiB in powers of 2 for sizes
+LATENCY_BUCKETS = tuple(0.001 * 2 ** (i / 4) for i in range(73))
+SIZE_BUCKETS = tuple(float(2 ** i) for i in range(6, 27))
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, cheap enough to record every request.
+
+    Args:
+        buckets (tuple): The sorted upper bounds of the buckets, values above the last one go to an overflow bucket.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, counts, count, total):
+        for i, bucket_count in enumerate(counts):
+            self.counts[i] += bucket_count
+        self.count += count
+        self.sum += total
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation inside the bucket that holds it.
+
+        Args:
+            q (float): The quantile, e.g. 0.95.
+
+        Returns:
+            float: The estimate, NaN without observations.
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def job_summary(name, latency, elapsed_time):
+    """
+    Format the end-of-run summary line of one listing: its pages, pages/s and p50/p95/p99 page latency.
+
+    Args:
+        name (str): The listing ID or job name.
+        latency (Histogram): The round trip time of every page of the listing.
+        elapsed_time (float): The time (in seconds) the pages took altogether.
+
+    Returns:
+        str: The summary line.
+    """
+    pages_per_second = latency.count / elapsed_time if elapsed_time > 0 else 0.0
+    quantiles = ' '.join(f'p{int(q * 100)} {latency.quantile(q) * 1000:.0f} ms' for q in (0.5, 0.95, 0.99))
+    return f"Summary for {name}: {latency.count} pages, {pages_per_second:.2f} pages/s, latency {quantiles}"
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    The histograms and counters of one process, keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, sorted label items) -> Histogram
+        self._counters = {}  # (name, sorted label items) -> value
+        self._last_snapshot = 0.0
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Record `value` in the histogram `name` with the given labels."""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to the counter `name` with the given labels."""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timer(self, name, **labels):
+        """Return a context manager recording the time spent in its block in the histogram `name`."""
+        return _Timer(self, name, labels)
+
+    def snapshot(self):
+        """
+        Return all metrics as a JSON-serializable dict, see merge_snapshots.
+        """
+        with self._lock:
+            return {
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'time': time.time(),
+                'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(histogram.buckets),
+                                'counts': list(histogram.counts), 'count': histogram.count, 'sum': histogram.sum}
+                               for (name, labels), histogram in self._histograms.items()],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self._counters.items()],
+            }
+
+    def write_snapshot(self, directory=None, force=False):
+        """
+        Write the snapshot to `directory` (crawler_metrics_dir by default), at most every crawler_metrics_interval
+        seconds unless `force` is set. Nothing is written if no directory is configured.
+        """
+        directory = directory if directory is not None else celery_config.crawler_metrics_dir
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_snapshot < celery_config.crawler_metrics_interval:
+            return
+        self._last_snapshot = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{socket.gethostname()}-{os.getpid()}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(path + '.tmp', path)
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+_metrics = None
+_metrics_pid = None
+
+
+def get_metrics():
+    """
+    Return the metrics registry of the current process.
+    """
+    global _metrics, _metrics_pid
+    # A prefork child starts with empty metrics instead of a copy of its parent's
+    if _metrics is None or _metrics_pid != os.getpid():
+        _metrics = MetricsRegistry()
+        _metrics_pid = os.getpid()
+    return _metrics
+
+
+def merge_snapshots(snapshots):
+    """
+    Merge the snapshots of several processes.
+
+    Args:
+        snapshots (list): Dicts returned by MetricsRegistry.snapshot.
+
+    Returns:
+        tuple: ({(name, labels): Histogram}, {(name, labels): value}).
+    """
+    histograms, counters = {}, {}
+    for snapshot in snapshots:
+        for entry in snapshot['histograms']:
+            key = (entry['name'], tuple(sorted(entry['labels'].items())))
+            if key not in histograms:
+                histograms[key] = Histogram(tuple(entry['buckets']))
+            histograms[key].merge(entry['counts'], entry['count'], entry['sum'])
+        for entry in snapshot['counters']:
+            key = (entry['name'], tuple(sorted(entry['labels'].items())))
+            counters[key] = counters.get(key, 0) + entry['value']
+    return histograms, counters
+
+
+def load_snapshots(directory):
+    """
+    Read every snapshot written to `directory`.
+    """
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(path, encoding='utf-8') as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue  # Replaced while reading
+    return snapshots
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+def render_prometheus(histograms, counters):
+    """
+    Render merged metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, ("le", f"{bound:.6g}"))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {histogram.count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_summary(histograms, counters):
+    """
+    Format one line per histogram with its count and p50/p95/p99, and one line per counter.
+    """
+    lines = []
+    for (name, labels), histogram in sorted(histograms.items()):
+        scale, unit = (1000, 'ms') if name.endswith('_seconds') else (1, '')
+        quantiles = ' '.join(f'p{int(q * 100)}={histogram.quantile(q) * scale:.1f}{unit}' for q in (0.5, 0.95, 0.99))
+        lines.append(f'{name}{_format_labels(labels)}: n={histogram.count} {quantiles}')
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f'{name}{_format_labels(labels)}: {value}')
+    return '\n'.join(lines)
+
+
+# Celery signal handlers, connected when this module is imported (by the HTTP client, so in workers and orchestrator)
+
+@before_task_publish.connect
+def _stamp_sent_at(headers=None, **kwargs):
+    # Custom message headers reach the worker as attributes of task.request
+    if headers is not None:
+        headers['crawler_sent_at'] = time.time()
+
+
+@task_prerun.connect
+def _record_queue_wait(task=None, **kwargs):
+    task.request.crawler_started_at = time.perf_counter()
+    sent_at = getattr(task.request, 'crawler_sent_at', None)
+    if sent_at is not None:
+        get_metrics().observe('crawler_queue_wait_seconds', max(0.0, time.time() - sent_at), task=task.name)
+
+
+@task_postrun.connect
+def _record_task_time(task=None, state=None, **kwargs):
+    started_at = getattr(task.request, 'crawler_started_at', None)
+    metrics = get_metrics()
+    if started_at is not None:
+        metrics.observe('crawler_task_seconds', time.perf_counter() - started_at, task=task.name)
+    metrics.inc('crawler_tasks_total', task=task.name, state=state)
+    metrics.write_snapshot()
+
+
+@task_retry.connect
+def _record_retry(sender=None, **kwargs):
+    get_metrics().inc('crawler_task_retries_total', task=getattr(sender, 'name', None))
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _write_final_snapshot(**kwargs):
+    # Prefork children stop with worker_process_shutdown, the solo, thread and gevent pools run in the main process
+    get_metrics().write_snapshot(force=True)
+
+
+def _histogram_json(name, labels, histogram):
+    entry = {'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum}
+    for q in (0.5, 0.95, 0.99):
+        entry[f'p{int(q * 100)}'] = histogram.quantile(q) if histogram.count else None
+    return entry
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        histograms, counters = merge_snapshots(load_snapshots(self.server.directory))
+        if self.path == '/metrics.json':
+            body = json.dumps({'histograms': [_histogram_json(name, labels, histogram)
+                                              for (name, labels), histogram in sorted(histograms.items())],
+                               'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                                            for (name, labels), value in sorted(counters.items())]})
+            content_type = 'application/json'
+        elif self.path == '/metrics':
+            body = render_prometheus(histograms, counters)
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['summary', 'serve'])
+    parser.add_argument('--dir', default=celery_config.crawler_metrics_dir)
+    parser.add_argument('--port', type=int, default=9100)
+    args = parser.parse_args()
+    if args.command == 'summary':
+        print(format_summary(*merge_snapshots(load_snapshots(args.dir))))
+    else:
+        server = ThreadingHTTPServer(('', args.port), _MetricsHandler)
+        server.directory = args.dir
+        print(f"Serving metrics from {args.dir} on http://0.0.0.0:{args.port}/metrics")
+        server.serve_forever()
@@ -0,0 +1,249 @@
+import email.utils
+import fcntl
+import json
+import os
+import threading
+import time
+
+from crawler import celery_config
+
+# Effective rate multiplier bounds for the adaptive slow-down.
+# A 429/5xx halves the multiplier, every successful response gives a little back.
+MIN_RATE_FACTOR = 1 / 16
+RATE_FACTOR_RECOVERY = 0.05
+
+# Pause (in seconds) after a 429/5xx that came without a Retry-After header, doubled for every consecutive failure
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+class MemoryStore:
+    """
+    Rate limiter state kept in the memory of the current process.
+
+    Only coordinates the threads/greenlets of one process, meant for tests and single-process runs.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def update(self, key, function):
+        """
+        Atomically replace the state stored under `key` with `function(state)`.
+
+        Args:
+            key (str): The state key, one per host.
+            function (callable): Receives the current state (None if there is none yet) and returns
+                (new_state, result).
+
+        Returns:
+            The `result` returned by `function`.
+        """
+        with self._lock:
+            state, result = function(self._data.get(key))
+            self._data[key] = state
+            return result
+
+
+class FileStore:
+    """
+    Rate limiter state kept in one JSON file per key, guarded by an exclusive file lock.
+
+    All processes that point to the same directory share one budget: every worker process on a host, and every pod
+    when the directory is on a volume shared by the pods (like shared_data/).
+
+    Args:
+        directory (str): The directory holding the state files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def update(self, key, function):
+        """
+        Atomically replace the state stored under `key` with `function(state)`, see MemoryStore.update.
+        """
+        path = os.path.join(self.directory, f'{key}.json')
+        with open(path, 'a+', encoding='utf-8') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                content = file.read()
+                state, result = function(json.loads(content) if content else None)
+                file.seek(0)
+                file.truncate()
+                json.dump(state, file)
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return result
+
+
+def store_from_url(url):
+    """
+    Create a rate limiter store from its URL.
+
+    Args:
+        url (str): 'memory://' for a process-local store or 'file://<directory>' for a shared file store.
+
+    Returns:
+        MemoryStore or FileStore: The store.
+    """
+    if url == 'memory://':
+        return MemoryStore()
+    if url.startswith('file://'):
+        return FileStore(url[len('file://'):])
+    raise ValueError(f"Unsupported rate limit store: {url!r}")
+
+
+def parse_retry_after(value, now=None):
+    """
+    Convert a Retry-After header value into a number of seconds.
+
+    Args:
+        value (str): Either a number of seconds or an HTTP date.
+        now (float): The current UNIX time, defaults to time.time().
+
+    Returns:
+        float or None: The number of seconds to wait, None if the value cannot be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter with per-host budgets, shared through a store.
+
+    Every host has a bucket that holds at most `burst` tokens and is refilled with `rate` tokens per second.
+    Each request takes one token. When the upstream answers with 429 or 5xx, the bucket is emptied, requests are
+    paused until the Retry-After time (or an exponential backoff) and the refill rate is halved. Successful
+    responses slowly restore the rate.
+
+    Args:
+        store (MemoryStore or FileStore): Where the bucket state is kept.
+        limits (dict): Host -> {'rate': tokens per second, 'burst': bucket size}.
+        default_limit (dict): The limit for hosts missing from `limits`.
+        clock (callable): Returns the current UNIX time, replaceable for tests.
+        sleep (callable): Waits for a number of seconds, replaceable for tests.
+    """
+
+    def __init__(self, store, limits, default_limit, clock=time.time, sleep=time.sleep):
+        self.store = store
+        self.limits = limits
+        self.default_limit = default_limit
+        self.clock = clock
+        self.sleep = sleep
+
+    def _limit(self, host):
+        return self.limits.get(host, self.default_limit)
+
+    def _refill(self, host, state, now):
+        limit = self._limit(host)
+        if state is None:
+            return {'tokens': float(limit['burst']), 'updated': now, 'blocked_until': 0.0,
+                    'rate_factor': 1.0, 'failures': 0}
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(float(limit['burst']), state['tokens'] + elapsed * limit['rate'] * state['rate_factor'])
+        state['updated'] = now
+        return state
+
+    def try_acquire(self, host):
+        """
+        Take one token for `host` if one is available.
+
+        Args:
+            host (str): The host the request goes to.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the time (in seconds) to wait before trying again.
+        """
+        def take(state):
+            now = self.clock()
+            state = self._refill(host, state, now)
+            if now < state['blocked_until']:
+                return state, state['blocked_until'] - now
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return state, 0.0
+            rate = self._limit(host)['rate'] * state['rate_factor']
+            return state, (1 - state['tokens']) / rate
+
+        return self.store.update(host, take)
+
+    def acquire(self, host):
+        """
+        Block until a token for `host` is available and take it.
+
+        Args:
+            host (str): The host the request goes to.
+
+        Returns:
+            float: The total time (in seconds) spent waiting.
+        """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(host)
+            if wait <= 0:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+    def report(self, host, status_code, retry_after=None):
+        """
+        Feed the outcome of a request back into the limiter of `host`.
+
+        Args:
+            host (str): The host the request went to.
+            status_code (int): The HTTP status code of the response.
+            retry_after (str): The Retry-After header of the response, if any.
+        """
+        throttled = status_code == 429 or status_code >= 500
+        delay = parse_retry_after(retry_after, self.clock())
+
+        def update(state):
+            now = self.clock()
+            state = self._refill(host, state, now)
+            if throttled:
+                state['failures'] += 1
+                state['rate_factor'] = max(MIN_RATE_FACTOR, state['rate_factor'] / 2)
+                pause = delay if delay is not None else min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (state['failures'] - 1))
+                state['blocked_until'] = max(state['blocked_until'], now + pause)
+                state['tokens'] = 0.0
+            else:
+                state['failures'] = 0
+                state['rate_factor'] = min(1.0, state['rate_factor'] + RATE_FACTOR_RECOVERY)
+                if delay is not None:
+                    state['blocked_until'] = max(state['blocked_until'], now + delay)
+            return state, None
+
+        self.store.update(host, update)
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    """
+    Return the rate limiter configured in crawler.celery_config, creating it on first use.
+
+    Returns:
+        RateLimiter: The rate limiter of this process.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(store_from_url(celery_config.crawler_rate_limit_store),
+                                    celery_config.crawler_rate_limits,
+                                    celery_config.crawler_rate_limit_default)
+    return _rate_limiter
@@ -1,8 +1,40 @@
 import json
 
+from crawler import celery_config
 
-def comments_request_form_booking(hotel_id, ufi, hotel_country_code, skip):
+# Query selecting only the fields read by crawler.utils.fetch_data.get_comments_from_booking and
+# get_comment_count_from_booking, without the photos, filters, highlights and guest details of the full query
+BOOKING_PROJECTED_QUERY = """
+                query ReviewList($input: ReviewListFrontendInput!) {
+                    reviewListFrontend(input: $input) {
+                        ... on ReviewListFrontendResult {
+                            reviewCard {
+                                textDetails {
+                                    title
+                                    positiveText
+                                    negativeText
+                                    textTrivialFlag
+                                    lang
+                                }
+                                partnerReply {
+                                    reply
+                                }
+                            }
+                            reviewsCount
+                        }
+                        ... on ReviewsFrontendError {
+                            statusCode
+                            message
+                        }
+                    }
+                }
+                """
+
+
+def comments_request_form_booking(hotel_id, ufi, hotel_country_code, skip, limit=10, projection=False):
     url = "https://www.booking.com/dml/graphql"
+    # CRAWLER_BOOKING_URL points the crawl at another endpoint, e.g. the benchmark mock server
+    url = celery_config.crawler_booking_url or url
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                       "Chrome/126.0.0.0 Safari/537.36",
@@ -21,7 +53,7 @@ def comments_request_form_booking(hotel_id, ufi, hotel_country_code, skip):
                     "languages": ["en"]
                 },
                 "skip": skip,
-                "limit": 10,
+                "limit": limit,
                 "upsortReviewUrl": "",
                 "searchFeatures": {
                     "destId": ufi,
@@ -167,12 +199,17 @@ def comments_request_form_booking(hotel_id, ufi, hotel_country_code, skip):
                 }
                 """
     }
+    if projection:
+        # Only request what the extractors use, the rest is a large share of every response
+        payload["query"] = BOOKING_PROJECTED_QUERY
     config = [url, headers, payload]
     return config
 
 
 def comment_request_from_airbnb(str_id, offset):
     url = "https://www.airbnb.co.uk/api/v3/StaysPdpReviewsQuery/dec1c8061483e78373602047450322fd474e79ba9afa8d3dbbc27f504030f91d"
+    # CRAWLER_AIRBNB_URL points the crawl at another endpoint, e.g. the benchmark mock server
+    url = celery_config.crawler_airbnb_url or url
     headers = {
         "X-Airbnb-Api-Key": "d306zoyjsyarp7ifhu67rjxn52tv0t20",
     }
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from crawler import celery_config
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of HTTP response bodies, kept in a SQLite database.
+
+    Entries are keyed by a hash of the request (URL and query parameters, which include the listing ID, offset,
+    locale and sorting preference), expire after `ttl` seconds and are evicted least recently used first once the
+    cache holds more than `max_bytes`. All worker processes of a host that point to the same file share the cache.
+    Hit and miss counters are kept in the database too, so they cover every process.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        ttl (float): The time (in seconds) an entry stays valid.
+        max_bytes (int): The maximum total size of the cached bodies.
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            self._connection.executemany("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)",
+                                         [('hits',), ('misses',), ('bytes',)])
+
+    @staticmethod
+    def key(request_config, method='GET'):
+        """
+        Compute the cache key of a request configuration.
+
+        Args:
+            request_config (list): [url, headers, params] as built by crawler.utils.request_content.
+            method (str): The HTTP method, see crawler.utils.http_client.send_request.
+
+        Returns:
+            str: The hex SHA-256 of the URL and the parameters (and the method, unless it is GET).
+                Headers are not part of the key.
+        """
+        parts = [request_config[0], request_config[2]]
+        if method != 'GET':
+            parts.insert(0, method)
+        canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _add(self, name, value):
+        self._connection.execute("UPDATE counters SET value = value + ? WHERE name = ?", (value, name))
+
+    def get(self, key):
+        """
+        Return the cached body for `key`, None on a miss or if the entry has expired.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT body, size, created_at FROM entries WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._add('bytes', -row[1])
+                row = None
+            if row is None:
+                self._add('misses', 1)
+                return None
+            self._connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._add('hits', 1)
+            return bytes(row[0])
+
+    def put(self, key, body):
+        """
+        Store `body` under `key`, then evict the least recently used entries while the cache is over its size cap.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            old = self._connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._add('bytes', -old[0])
+            self._connection.execute("""
+                INSERT OR REPLACE INTO entries (key, body, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)""",
+                                     (key, body, len(body), now, now))
+            self._add('bytes', len(body))
+
+            total = self._connection.execute("SELECT value FROM counters WHERE name = 'bytes'").fetchone()[0]
+            while total > self.max_bytes:
+                victim = self._connection.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed_at LIMIT 1").fetchone()
+                if victim is None:
+                    break
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (victim[0],))
+                self._add('bytes', -victim[1])
+                total -= victim[1]
+
+    def stats(self):
+        """
+        Return the shared counters of the cache.
+
+        Returns:
+            dict: 'hits', 'misses', 'bytes' and the number of 'entries'.
+        """
+        with self._lock:
+            stats = dict(self._connection.execute("SELECT name, value FROM counters").fetchall())
+            stats['entries'] = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return stats
+
+
+_response_cache = None
+_response_cache_pid = None
+
+
+def get_response_cache():
+    """
+    Return the response cache configured in crawler.celery_config, None if caching is disabled.
+
+    Returns:
+        ResponseCache or None: The cache of this process.
+    """
+    global _response_cache, _response_cache_pid
+    if celery_config.crawler_response_cache_path is None:
+        return None
+    # SQLite connections must not cross a fork, every prefork child opens its own
+    if _response_cache is None or _response_cache_pid != os.getpid():
+        _response_cache = ResponseCache(celery_config.crawler_response_cache_path,
+                                        celery_config.crawler_response_cache_ttl,
+                                        celery_config.crawler_response_cache_max_bytes)
+        _response_cache_pid = os.getpid()
+    return _response_cache
+
+
+if __name__ == '__main__':
+    cache = get_response_cache()
+    print(cache.stats() if cache is not None else "The response cache is disabled (CRAWLER_RESPONSE_CACHE is not set)")
@@ -0,0 +1,139 @@
+import random
+
+import requests
+
+from crawler import celery_config
+from crawler.utils.http_client import send_request
+from crawler.utils.metrics import Histogram
+from crawler.utils.rate_limit import parse_retry_after
+
+# HTTP statuses worth another attempt: throttling and transient server errors
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# At most this share of the in-flight slots may be used by hedged duplicates
+MAX_HEDGE_SHARE = 0.1
+
+
+class RetryableHTTPError(requests.HTTPError):
+    """
+    A response with a status in RETRYABLE_STATUSES.
+
+    Args:
+        response (requests.Response): The response.
+    """
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code} from {response.url}", response=response)
+        self.retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+
+# Errors after which the same request may succeed: connection problems, timeouts and retryable statuses
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, RetryableHTTPError)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Return the time to wait before the next attempt: capped exponential backoff with full jitter.
+
+    The delay is drawn uniformly between 0 and min(crawler_retry_backoff_max, crawler_retry_backoff * 2^attempt), so
+    the retries of many pages that failed together (a 503 burst) spread out instead of arriving in waves.
+
+    Args:
+        attempt (int): The number of attempts that have failed so far, minus one (0 after the first failure).
+        retry_after (float): A Retry-After value (in seconds) sent by the server, the delay is never shorter.
+
+    Returns:
+        float: The delay (in seconds).
+    """
+    cap = min(celery_config.crawler_retry_backoff_max, celery_config.crawler_retry_backoff * 2 ** attempt)
+    delay = random.uniform(0, cap)
+    return max(delay, retry_after) if retry_after is not None else delay
+
+
+def check_response(response):
+    """
+    Raise if a response is not usable.
+
+    Raises:
+        RetryableHTTPError: For throttling and transient server errors.
+        requests.HTTPError: For any other 4xx/5xx status.
+    """
+    if response.status_code in RETRYABLE_STATUSES:
+        raise RetryableHTTPError(response)
+    response.raise_for_status()
+
+
+def send_request_with_retry(task, request_config, method='GET', refresh=False):
+    """
+    Send a request from a bound task, and retry the task with backoff if the request fails transiently.
+
+    The task is retried at most `task.max_retries` times (crawler_task_max_retries). When the task is called directly
+    (a page of fetch_comments_batch) Celery raises the error instead, and the orchestrator retries the page.
+    A retried task does not take its response from the response cache.
+
+    Args:
+        task (celery.Task): The running task, created with bind=True.
+        request_config (list): [url, headers, params or JSON payload], see send_request.
+        method (str): 'GET' or 'POST'.
+        refresh (bool): Bypass the response cache, see send_request.
+
+    Returns:
+        requests.Response: A successful response.
+    """
+    try:
+        response = send_request(request_config, method, use_cache=not refresh and not task.request.retries)
+        check_response(response)
+        return response
+    except RETRYABLE_ERRORS as exc:
+        raise task.retry(exc=exc, countdown=backoff_delay(task.request.retries, getattr(exc, 'retry_after', None)))
+
+
+def refreshed(signature):
+    """
+    Return a copy of a fetch task signature that bypasses the response cache (refresh=True).
+
+    Used by the executors for the retries and hedged duplicates of a page, so a page sent again is fetched anew
+    instead of being answered with the body another copy may have cached, e.g. one that could not be parsed.
+
+    Args:
+        signature (celery.canvas.Signature): A signature of a task with a `refresh` argument.
+
+    Returns:
+        celery.canvas.Signature: The copy.
+    """
+    return signature.clone(kwargs={'refresh': True})
+
+
+class HedgePolicy:
+    """
+    Decide when a task has been running long enough that a duplicate (a hedged request) is worth sending.
+
+    The latency of every completed task is recorded. Once `min_samples` are known, a task running longer than the
+    `quantile` of the latencies gets one duplicate, and whichever finishes first is used. Hedging at the 95th
+    percentile costs about 5% more requests and takes the slow tail out of the completion time.
+
+    Args:
+        quantile (float): The latency quantile after which a duplicate is sent, e.g. 0.95. 0 or None disables hedging.
+        min_samples (int): The number of latencies needed before the first duplicate.
+    """
+
+    def __init__(self, quantile=None, min_samples=None):
+        self.quantile = quantile if quantile is not None else celery_config.crawler_hedge_quantile
+        self.min_samples = min_samples if min_samples is not None else celery_config.crawler_hedge_min_samples
+        self.latency = Histogram()
+        self.sent = 0
+        self.won = 0
+
+    def observe(self, latency, items=1):
+        """Record the latency (in seconds) of a completed task with `items` pages."""
+        self.latency.observe(latency / items)
+
+    def threshold(self, items=1):
+        """Return the age (in seconds) after which a task with `items` pages is hedged, None if not (yet)."""
+        if not self.quantile or self.latency.count < self.min_samples:
+            return None
+        return self.latency.quantile(self.quantile) * items
+
+    def budget(self, max_in_flight):
+        """Return the number of duplicates that may be in flight at the same time."""
+        return max(1, int(max_in_flight * MAX_HEDGE_SHARE))
@@ -0,0 +1,60 @@
+import math
+
+from celery.signals import worker_init
+
+from crawler import celery_config
+
+# The queues every task is routed to (crawler/celery_config.py declares them):
+# count and first-page probes, crawls of small listings, and the pages of large listings (bulk backfill).
+PROBE_QUEUE = 'probe'
+INTERACTIVE_QUEUE = 'interactive'
+BULK_QUEUE = 'bulk'
+
+
+def route_for(remaining_tasks):
+    """
+    Return the apply_async options (queue and priority) of a page task of a crawl.
+
+    A crawl whose size is not known yet is probing, its task goes to the probe queue with the highest priority: the
+    count it returns decides how much work follows. Otherwise crawls with at most crawler_small_job_pages tasks left go
+    to the interactive queue and all others to the bulk queue. Within a queue, the fewer tasks a crawl has left the
+    higher the priority (one step per doubling), so the broker hands out the tasks that complete a crawl first and
+    the mean time to complete a listing drops.
+
+    Args:
+        remaining_tasks (int): The number of tasks the crawl still has to run, None if it is not known yet.
+
+    Returns:
+        dict: {'queue': <queue name>, 'priority': <0 to crawler_max_priority>}.
+    """
+    if remaining_tasks is None:
+        return {'queue': PROBE_QUEUE, 'priority': celery_config.crawler_max_priority}
+    queue = INTERACTIVE_QUEUE if remaining_tasks <= celery_config.crawler_small_job_pages else BULK_QUEUE
+    priority = celery_config.crawler_max_priority - 1 - int(math.log2(max(1, remaining_tasks)))
+    return {'queue': queue, 'priority': max(0, priority)}
+
+
+def route_jobs(jobs):
+    """
+    Return the apply_async options of a message carrying tasks of `jobs`, the most urgent job decides.
+
+    Args:
+        jobs (list): The FairShareScheduler jobs of the tasks in the message, see Job.remaining_tasks.
+
+    Returns:
+        dict: {'queue': ..., 'priority': ...}, see route_for.
+    """
+    remaining = [job.remaining_tasks() for job in jobs]
+    return route_for(None if None in remaining else min(remaining))
+
+
+@worker_init.connect
+def _apply_queue_prefetch(sender, **kwargs):
+    # A worker prefetches for all the queues it consumes from, so the queue that needs the smallest prefetch decides.
+    # A --prefetch-multiplier given on the command line wins.
+    if sender.prefetch_multiplier != sender.app.conf.worker_prefetch_multiplier:
+        return
+    values = [celery_config.crawler_queue_prefetch[name] for name in sender.app.amqp.queues.consume_from
+              if name in celery_config.crawler_queue_prefetch]
+    if values:
+        sender.prefetch_multiplier = min(values)
@@ -0,0 +1,370 @@
+import abc
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+
+from celery.exceptions import TimeoutError
+
+from crawler import celery_config
+from crawler.utils.engine import get_engine
+from crawler.utils.metrics import Histogram, get_metrics, job_summary
+from crawler.utils.retry import HedgePolicy, backoff_delay
+from crawler.utils.routing import route_jobs
+
+
+class Job(abc.ABC):
+    """
+    A unit of work for the FairShareScheduler, e.g. the crawl of one listing.
+
+    A job hands out task signatures one at a time and receives their results. It may create new tasks from
+    results (the first page of a listing decides how many pages follow). The scheduler calls finish() once the job
+    is done and none of its tasks is in flight any more. An exception raised by on_result is handed to on_error for
+    the same task, so a result the job cannot handle fails that job only.
+    """
+
+    name = None
+    batchable = False  # Whether the scheduler's batcher can combine the tasks of this job
+    hedgeable = True  # Whether a slow task of this job may be sent a second time
+
+    @abc.abstractmethod
+    def has_task(self):
+        """Return True if the job has a task ready to be sent."""
+
+    @abc.abstractmethod
+    def next_task(self):
+        """Return the next (tag, signature) to send."""
+
+    @abc.abstractmethod
+    def on_result(self, tag, result):
+        """Receive the result of the task sent with `tag`."""
+
+    @abc.abstractmethod
+    def on_error(self, tag, exc):
+        """
+        Receive the exception of the task sent with `tag` once its last attempt failed (task failure or timeout), or
+        the one its on_result raised.
+        """
+
+    @abc.abstractmethod
+    def is_done(self):
+        """
+        Return True once the job will not create any more tasks and expects no more results, e.g. once it failed.
+        A task of a done job that fails is not retried.
+        """
+
+    def remaining_tasks(self):
+        """Return the number of tasks the job still has to run, in flight included, None while it is not known."""
+        return None
+
+    def finish(self):
+        """Called once when the job is done and has no task in flight."""
+
+    def discard(self, tag, result):
+        """
+        Receive the result of a task copy that was given up (timed out or lost the race against its duplicate) and
+        finished anyway. The result has already been delivered or the task sent again, so it must not be used.
+        """
+
+
+class TaskItemError(Exception):
+    """The error of one item of a batched task, reported by the worker as a message."""
+
+
+class _Message:
+    """One message in flight: the tasks it carries and its Celery result."""
+
+    def __init__(self, entries, result, sent_at, deadline, batched, duplicate=False):
+        self.entries = entries  # [(job, tag, signature, attempt)]
+        self.result = result
+        self.sent_at = sent_at
+        self.deadline = deadline
+        self.batched = batched
+        self.duplicate = duplicate  # Whether this is the hedged copy of another message
+        self.twin = None  # The task ID of the other copy while both are in flight
+
+
+class FairShareScheduler:
+    """
+    Run the tasks of many jobs from one process through a single fair-share queue.
+
+    Jobs are pulled lazily from an iterable, at most `max_active_jobs` at a time, so any number of jobs (even an
+    endless stream) can be scheduled with flat client resource use. Tasks are sent round-robin over the active jobs,
+    with at most `max_in_flight` messages in flight overall and `per_job_limit` tasks per job, so a huge job cannot
+    starve the small ones and the workers always have work queued.
+
+    With a `batcher`, several tasks (possibly of different batchable jobs) are sent as one batched message when there
+    are more tasks ready than free slots. The chunk size follows the backlog: the ready tasks are spread evenly over the
+    free slots, up to `max_chunk_size` per message, so a large backlog pays the broker round trip once per chunk while
+    a small one still runs every task in parallel. The batched task must return one dict per item, holding either
+    'result' or 'error'.
+
+    Every message is routed by `router`, by default to the queue and priority that match the remaining tasks of its
+    jobs (crawler/utils/routing.py), so probes and jobs close to completion overtake the bulk of large jobs.
+
+    Every message has a deadline of `timeout` seconds per task it carries. A task that fails or misses its deadline
+    is sent again on its own after a capped exponential backoff with jitter, up to `max_attempts` attempts, before its
+    job gets the error. With hedging, a message running longer than a quantile of the observed latencies is sent a
+    second time and the first copy to finish is used. Every task is delivered to its job exactly once, the results of
+    copies that were given up go to Job.discard.
+
+    Args:
+        max_in_flight (int): The maximum number of messages in flight over all jobs.
+        per_job_limit (int): The maximum number of tasks in flight for one job.
+        max_active_jobs (int): The maximum number of jobs being worked on at the same time.
+        timeout (float): The maximum time (in seconds) a single task may take before it is retried.
+        poll_interval (float): The time (in seconds) to wait between two polls when no task has finished.
+        max_chunk_size (int): The maximum number of tasks in one batched message, 1 disables batching.
+        batcher (callable): Turns a list of task signatures into the signature of one batched task.
+        max_attempts (int): The number of attempts per task, crawler_page_attempts by default.
+        hedge (HedgePolicy): When to send duplicates, by default crawler_hedge_quantile (off unless configured).
+        router (callable): Turns the jobs of a message into apply_async options (queue, priority), None sends
+            everything to the default queue.
+        engine (CeleryEngine or LocalEngine): Where the tasks run, the Celery workers or a thread pool in this
+            process (crawler/utils/engine.py). Defaults to get_engine(), i.e. crawler_engine.
+        resend (callable): Turns the signature of a task into the one sent for its retries and hedged duplicates,
+            e.g. crawler.utils.retry.refreshed. By default the same signature is sent again.
+    """
+
+    def __init__(self, max_in_flight, per_job_limit, max_active_jobs, timeout, poll_interval=0.05,
+                 max_chunk_size=1, batcher=None, max_attempts=None, hedge=None, router=route_jobs, engine=None,
+                 resend=None):
+        if max_in_flight < 1 or per_job_limit < 1 or max_active_jobs < 1 or max_chunk_size < 1:
+            raise ValueError("max_in_flight, per_job_limit, max_active_jobs and max_chunk_size must be >= 1")
+        self.max_in_flight = max_in_flight
+        self.per_job_limit = per_job_limit
+        self.max_active_jobs = max_active_jobs
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_chunk_size = max_chunk_size if batcher is not None else 1
+        self.batcher = batcher
+        self.max_attempts = max_attempts if max_attempts is not None else celery_config.crawler_page_attempts
+        self.hedge = hedge if hedge is not None else HedgePolicy()
+        self.router = router
+        self.engine = engine if engine is not None else get_engine()
+        self.resend = resend
+        self.tasks_completed = 0
+        self.messages_sent = 0
+        self.jobs_completed = 0
+        self.retries = 0
+        self._sequence = itertools.count()  # Orders retries that are due at the same time
+
+    def _collect(self, active, job_in_flight, free_slots):
+        # Take ready tasks round-robin, one per job and turn, until the free slots are used up or nobody has work.
+        # A batchable task takes 1/max_chunk_size of a slot, any other task a whole one.
+        budget = free_slots * self.max_chunk_size
+        batchable, single = [], []
+        taken = True
+        while taken and budget > 0:
+            taken = False
+            for _ in range(len(active)):
+                job = active[0]
+                active.rotate(-1)
+                cost = 1 if job.batchable else self.max_chunk_size
+                if cost <= budget and job_in_flight[job] < self.per_job_limit and job.has_task():
+                    tag, signature = job.next_task()
+                    (batchable if job.batchable else single).append((job, tag, signature, 0))
+                    job_in_flight[job] += 1
+                    budget -= cost
+                    taken = True
+                    if budget <= 0:
+                        break
+        return batchable, single
+
+    def _send(self, chunk, in_flight, duplicate=False):
+        options = self.router([job for job, _, _, _ in chunk]) if self.router is not None else {}
+        if len(chunk) == 1:
+            result = self.engine.apply_async(chunk[0][2], **options)
+        else:
+            result = self.engine.apply_async(self.batcher([signature for _, _, signature, _ in chunk]), **options)
+        # A batched task runs its items one after another
+        sent_at = time.monotonic()
+        message = _Message(chunk, result, sent_at, sent_at + self.timeout * len(chunk), len(chunk) > 1, duplicate)
+        in_flight[result.id] = message
+        self.messages_sent += 1
+        return message
+
+    def _send_hedges(self, in_flight, now):
+        # Duplicate the messages that run past the latency quantile, within the hedge budget and the free slots
+        hedges = sum(message.duplicate for message in in_flight.values())
+        budget = min(self.hedge.budget(self.max_in_flight) - hedges, self.max_in_flight - len(in_flight))
+        if budget <= 0:
+            return
+        for message in list(in_flight.values()):
+            threshold = self.hedge.threshold(len(message.entries))
+            if threshold is None:
+                return
+            if (message.twin is None and not message.duplicate and now - message.sent_at > threshold
+                    and all(job.hedgeable for job, _, _, _ in message.entries)):
+                entries = [(job, tag, self._resent(signature), attempt)
+                           for job, tag, signature, attempt in message.entries]
+                duplicate = self._send(entries, in_flight, duplicate=True)
+                message.twin, duplicate.twin = duplicate.result.id, message.result.id
+                self.hedge.sent += 1
+                budget -= 1
+                if budget <= 0:
+                    return
+
+    def _give_up(self, message, in_flight, abandoned):
+        # Stop waiting for a copy, a result it still produces goes to Job.discard
+        abandoned[message.result.id] = message
+        if message.twin in in_flight:
+            in_flight[message.twin].twin = None
+            return True  # The other copy carries on
+        return False
+
+    def _retry_or_fail(self, entry, exc, job_in_flight, delayed):
+        job, tag, signature, attempt = entry
+        if attempt + 1 < self.max_attempts and not job.is_done():
+            # The task stays counted as in flight for its job until it succeeds or runs out of attempts
+            self.retries += 1
+            get_metrics().inc('crawler_page_retries_total')
+            retry_at = time.monotonic() + backoff_delay(attempt)
+            heapq.heappush(delayed, (retry_at, next(self._sequence), (job, tag, self._resent(signature), attempt + 1)))
+        else:
+            job_in_flight[job] -= 1
+            job.on_error(tag, exc)
+
+    def _resent(self, signature):
+        return self.resend(signature) if self.resend is not None else signature
+
+    def _discard(self, abandoned, now):
+        # Hand the late results of given up copies to their jobs, forget the ones that will not come any more
+        for task_id, message in list(abandoned.items()):
+            if message.result.ready():
+                del abandoned[task_id]
+                if message.result.successful():
+                    value = message.result.get()
+                    items = value if message.batched else [{'result': value}]
+                    for (job, tag, _, _), item in zip(message.entries, items):
+                        if 'result' in item:
+                            job.discard(tag, item['result'])
+            elif now > message.deadline + self.timeout * len(message.entries):
+                del abandoned[task_id]
+
+    @staticmethod
+    def _report(job, admitted_at, latency):
+        # End-of-job summary, the per-job histogram is dropped afterwards so any number of jobs can run
+        print(job_summary(job.name, latency, time.monotonic() - admitted_at))
+
+    def run(self, jobs):
+        """
+        Run jobs until all of them are done.
+
+        Args:
+            jobs (iterable): The jobs, pulled one by one when there is room for another active job.
+        """
+        jobs = iter(jobs)
+        jobs_exhausted = False
+        active = deque()
+        in_flight = {}  # task id -> _Message
+        abandoned = {}  # task id -> _Message of the copies given up
+        delayed = []  # Heap of (time the retry is due, sequence number, (job, tag, signature, attempt))
+        job_in_flight = {}  # job -> number of its tasks in flight or waiting for a retry
+        job_latency = {}  # job -> (admission time, Histogram of the round trip time of its tasks)
+        metrics = get_metrics()
+
+        while True:
+            # Admit new jobs while there is room
+            while not jobs_exhausted and len(active) < self.max_active_jobs:
+                job = next(jobs, None)
+                if job is None:
+                    jobs_exhausted = True
+                else:
+                    active.append(job)
+                    job_in_flight[job] = 0
+                    job_latency[job] = (time.monotonic(), Histogram())
+
+            # Retries that are due and duplicates of slow messages go first, each in a message of its own
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now and len(in_flight) < self.max_in_flight:
+                self._send([heapq.heappop(delayed)[2]], in_flight)
+            self._send_hedges(in_flight, now)
+
+            # Spread the ready tasks evenly over the free slots, at most max_chunk_size per message
+            free_slots = self.max_in_flight - len(in_flight)
+            if free_slots > 0:
+                batchable, single = self._collect(active, job_in_flight, free_slots)
+                for task in single:
+                    self._send([task], in_flight)
+                if batchable:
+                    chunk_size = math.ceil(len(batchable) / (free_slots - len(single)))
+                    for i in range(0, len(batchable), chunk_size):
+                        self._send(batchable[i:i + chunk_size], in_flight)
+
+            # Retire the jobs that are done
+            for job in [job for job in active if job_in_flight[job] == 0 and job.is_done()]:
+                active.remove(job)
+                del job_in_flight[job]
+                job.finish()
+                self._report(job, *job_latency.pop(job))
+                self.jobs_completed += 1
+
+            self._discard(abandoned, now)
+            if not in_flight:
+                if delayed:
+                    time.sleep(min(self.poll_interval, max(0.0, delayed[0][0] - time.monotonic())))
+                    continue
+                if not active:
+                    if jobs_exhausted:
+                        return
+                    continue  # Room for the next jobs
+                if not any(job.has_task() for job in active):
+                    raise RuntimeError("Scheduler stalled: active jobs have neither tasks nor results pending")
+                continue
+
+            finished = [task_id for task_id, message in in_flight.items() if message.result.ready()]
+            if not finished:
+                now = time.monotonic()
+                expired = [task_id for task_id, message in in_flight.items() if now > message.deadline]
+                for task_id in expired:
+                    message = in_flight.pop(task_id)
+                    if self._give_up(message, in_flight, abandoned):
+                        continue
+                    for entry in message.entries:
+                        job, tag = entry[0], entry[1]
+                        self._retry_or_fail(entry, TimeoutError(f"Task {tag!r} of {job.name} did not finish in time"),
+                                            job_in_flight, delayed)
+                if not expired:
+                    self.engine.wait(self.poll_interval)
+                continue
+
+            now = time.monotonic()
+            for task_id in finished:
+                if task_id not in in_flight:
+                    continue  # A duplicate given up because its twin finished in the same poll
+                message = in_flight.pop(task_id)
+                try:
+                    value = message.result.get(timeout=self.timeout)
+                except Exception as exc:
+                    if message.twin in in_flight:
+                        in_flight[message.twin].twin = None  # The other copy may still succeed
+                        continue
+                    for entry in message.entries:
+                        self._retry_or_fail(entry, exc, job_in_flight, delayed)
+                    continue
+                if message.twin in in_flight:
+                    self._give_up(in_flight.pop(message.twin), in_flight, abandoned)
+                if message.duplicate:
+                    self.hedge.won += 1
+                    metrics.inc('crawler_hedges_won_total')
+                # Send to result, as seen by the orchestrator: queue wait, task time and result delivery
+                metrics.observe('crawler_task_roundtrip_seconds', now - message.sent_at, batched=message.batched)
+                self.hedge.observe(now - message.sent_at, len(message.entries))
+                # Every item of a batched message succeeds or fails on its own
+                items = value if message.batched else [{'result': value}]
+                for entry, item in zip(message.entries, items):
+                    job, tag = entry[0], entry[1]
+                    if 'error' in item:
+                        self._retry_or_fail(entry, TaskItemError(item['error']), job_in_flight, delayed)
+                        continue
+                    job_in_flight[job] -= 1
+                    job_latency[job][1].observe(now - message.sent_at)
+                    try:
+                        job.on_result(tag, item['result'])
+                    except Exception as exc:
+                        # A result the job cannot handle (e.g. a malformed page) fails that job, not the run
+                        job.on_error(tag, exc)
+                        continue
+                    self.tasks_completed += 1
@@ -0,0 +1,91 @@
+import datetime
+import decimal
+import uuid
+import zlib
+
+from kombu.serialization import register
+
+from crawler import celery_config
+
+# Name of the compact serializer, usable wherever Celery takes a serializer name (task_serializer,
+# result_serializer, task_annotations, apply_async(serializer=...)).
+COMPACT_SERIALIZER = 'msgpack-zlib'
+COMPACT_CONTENT_TYPE = 'application/x-msgpack-zlib'
+
+# First byte of every encoded message: how the rest of it is stored
+_RAW = b'\x00'
+_ZLIB = b'\x01'
+
+_registered = False
+
+
+def _encode_default(value):
+    # The types Celery puts into messages that msgpack does not know, encoded as the json serializer does
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Cannot serialize object of type {type(value).__name__}")
+
+
+def dumps(value, threshold=None, level=None):
+    """
+    Encode a message body as msgpack, compressed with zlib if it is larger than the threshold.
+
+    Small messages (task arguments, manifest entries) are not worth the compression time, GraphQL pages are: their
+    keys and typenames repeat for every review.
+
+    Args:
+        value: Any value the json serializer accepts.
+        threshold (int): Minimum size (in bytes) of the msgpack encoding to compress, crawler_compress_threshold by
+            default.
+        level (int): zlib compression level, crawler_compress_level by default.
+
+    Returns:
+        bytes: A one byte header (raw or zlib) followed by the encoding.
+    """
+    import msgpack
+
+    threshold = celery_config.crawler_compress_threshold if threshold is None else threshold
+    level = celery_config.crawler_compress_level if level is None else level
+    packed = msgpack.packb(value, use_bin_type=True, default=_encode_default)
+    if len(packed) >= threshold:
+        return _ZLIB + zlib.compress(packed, level)
+    return _RAW + packed
+
+
+def loads(data):
+    """
+    Decode a message body encoded by dumps.
+
+    Args:
+        data (bytes): The message body.
+
+    Returns:
+        The decoded value, tuples come back as lists like with the json serializer.
+    """
+    import msgpack
+
+    data = bytes(data)
+    header, body = data[:1], data[1:]
+    if header == _ZLIB:
+        body = zlib.decompress(body)
+    elif header != _RAW:
+        raise ValueError(f"Unknown {COMPACT_SERIALIZER} header {header!r}")
+    return msgpack.unpackb(body, raw=False, strict_map_key=False)
+
+
+def register_compact_serializer():
+    """
+    Register the msgpack-zlib serializer with kombu, once per process.
+
+    It has to be registered in the workers and in the orchestrator before any message is sent or received.
+    Registering it does not make Celery accept it, accept_content in crawler/celery_config.py decides that
+    (and never lists pickle).
+    """
+    global _registered
+    if not _registered:
+        register(COMPACT_SERIALIZER, dumps, loads, content_type=COMPACT_CONTENT_TYPE, content_encoding='binary')
+        _registered = True
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+
+class MemoryShardStore:
+    """
+    Process-local shard store, for runs where the workers share the process with the orchestrator (eager mode, tests).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}
+
+    def put(self, key, data):
+        with self._lock:
+            self._objects[key] = bytes(data)
+
+    def get(self, key):
+        with self._lock:
+            return self._objects[key]
+
+    def delete(self, key):
+        with self._lock:
+            self._objects.pop(key, None)
+
+
+class FileShardStore:
+    """
+    Shard store on a directory, e.g. a volume under shared_data/ mounted by every pod.
+
+    It has the put/get/delete interface of an object store, so a bucket can take its place. Every object is written
+    to a temporary name and renamed into place, so a reader never sees a half written shard.
+
+    Args:
+        directory (str): The root directory of the shards.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as file:
+            return file.read()
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))  # Only succeeds once the listing has no shards left
+        except OSError:
+            pass
+
+
+_shard_stores = {}
+_shard_stores_pid = None
+
+
+def get_shard_store(url):
+    """
+    Return the shard store of a URL, one instance per URL and process.
+
+    Args:
+        url (str): 'memory://' for a process-local store or 'file://<directory>' for a shared directory.
+
+    Returns:
+        MemoryShardStore or FileShardStore: The store.
+    """
+    global _shard_stores_pid
+    if _shard_stores_pid != os.getpid():
+        _shard_stores.clear()
+        _shard_stores_pid = os.getpid()
+    if url not in _shard_stores:
+        if url == 'memory://':
+            _shard_stores[url] = MemoryShardStore()
+        elif url.startswith('file://'):
+            _shard_stores[url] = FileShardStore(url[len('file://'):])
+        else:
+            raise ValueError(f"Unsupported shard store: {url!r}")
+    return _shard_stores[url]
+
+
+def put_page_shard(url, page):
+    """
+    Write an extracted page to the shard store and describe it with a small manifest entry.
+
+    Args:
+        url (str): The shard store URL, see get_shard_store.
+        page (dict): A page of extracted records with 'str_id', 'offset', 'reviews_count' and 'reviews'.
+
+    Returns:
+        dict: The manifest entry: 'str_id', 'offset', 'reviews_count', the shard 'path' (its key in the store), the
+            number of 'records', the size in 'bytes' and the hex 'sha256' of the shard.
+    """
+    data = json.dumps(page, ensure_ascii=False).encode('utf-8')
+    # A page fetched again to fill a gap gets a shard of its own
+    path = f"airbnb/{page['str_id']}/{page['offset']:08d}-{uuid.uuid4().hex}.json"
+    get_shard_store(url).put(path, data)
+    return {
+        'str_id': page['str_id'],
+        'offset': page['offset'],
+        'reviews_count': page['reviews_count'],
+        'path': path,
+        'records': len(page['reviews']),
+        'bytes': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
@@ -0,0 +1,171 @@
+import heapq
+import itertools
+import time
+from collections import deque
+
+from celery.exceptions import TimeoutError
+
+from crawler import celery_config
+from crawler.utils.engine import get_engine
+from crawler.utils.metrics import Histogram
+from crawler.utils.retry import HedgePolicy, backoff_delay
+
+
+class SlidingWindowExecutor:
+    """
+    Keep a fixed number of Celery tasks in flight and hand their results back in completion order.
+
+    Unlike sending a whole `group` and blocking on it, a new task is sent as soon as any running task
+    finishes, so one slow page only occupies one slot of the window instead of stalling everything.
+
+    Every task has its own deadline. A task that fails or runs past it is sent again after a capped exponential
+    backoff with jitter, up to `max_attempts` attempts. With hedging, a task running longer than a latency quantile
+    gets one duplicate and the first result is used, the other copy is ignored, so every tag is yielded exactly once.
+
+    Args:
+        window_size (int): The maximum number of tasks that may be in flight at the same time.
+        timeout (float): The maximum time (in seconds) a single attempt may run.
+        poll_interval (float): The time (in seconds) to wait between two polls when no task has finished.
+        max_attempts (int): The number of attempts per task, crawler_page_attempts by default.
+        hedge (HedgePolicy): When to send duplicates, by default crawler_hedge_quantile (off unless configured).
+        engine (CeleryEngine or LocalEngine): Where the tasks run, see crawler/utils/engine.py. Defaults to
+            get_engine(), i.e. crawler_engine.
+        latency (Histogram): Records the round trip time of every task, from sending the copy that won to its
+            result. A new one by default, pass the same one to several executors to summarize them together.
+        resend (callable): Turns the signature of a task into the one sent for its retries and hedged duplicates,
+            e.g. crawler.utils.retry.refreshed. By default the same signature is sent again.
+    """
+
+    def __init__(self, window_size, timeout, poll_interval=0.05, max_attempts=None, hedge=None, engine=None,
+                 latency=None, resend=None):
+        if window_size < 1:
+            raise ValueError("window_size must be >= 1")
+        self.window_size = window_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts if max_attempts is not None else celery_config.crawler_page_attempts
+        self.hedge = hedge if hedge is not None else HedgePolicy()
+        self.engine = engine if engine is not None else get_engine()
+        self.latency = latency if latency is not None else Histogram()
+        self.resend = resend
+        self.retries = 0
+        self._pending = deque()  # (tag, signature, attempt) of the tasks that have not been sent yet
+        self._delayed = []  # Heap of (time the retry is due, sequence number, tag, signature, attempt)
+        self._sequence = itertools.count()
+        self._in_flight = {}  # tag -> (signature, attempt, [(AsyncResult, send time, whether it is a duplicate)])
+
+    def submit(self, tag, signature):
+        """
+        Queue a task signature. It is sent as soon as a slot in the window is free.
+
+        Args:
+            tag: Any hashable value that identifies the task, returned together with its result.
+            signature (celery.canvas.Signature): The task signature to execute.
+        """
+        self._pending.append((tag, signature, 0))
+
+    def __len__(self):
+        return len(self._pending) + len(self._delayed) + len(self._in_flight)
+
+    def _fill(self):
+        # Retries that are due go first, then queued tasks until the window is full
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, tag, signature, attempt = heapq.heappop(self._delayed)
+            self._pending.appendleft((tag, signature, attempt))
+        while self._pending and len(self._in_flight) < self.window_size:
+            tag, signature, attempt = self._pending.popleft()
+            self._in_flight[tag] = (signature, attempt, [(self.engine.apply_async(signature), time.monotonic(), False)])
+
+    def _send_hedges(self, now):
+        running = sum(len(copies) - 1 for _, _, copies in self._in_flight.values())
+        threshold = self.hedge.threshold()
+        if threshold is None:
+            return
+        for tag, (signature, _, copies) in self._in_flight.items():
+            if running >= self.hedge.budget(self.window_size):
+                break
+            if len(copies) == 1 and now - copies[0][1] > threshold:
+                copies.append((self.engine.apply_async(self._resent(signature)), now, True))
+                self.hedge.sent += 1
+                running += 1
+
+    def _failed(self, tag, exc):
+        # The last copy of a task failed or expired: try again later, or give up
+        signature, attempt, _ = self._in_flight.pop(tag)
+        if attempt + 1 >= self.max_attempts:
+            raise exc
+        self.retries += 1
+        retry_at = time.monotonic() + backoff_delay(attempt)
+        heapq.heappush(self._delayed, (retry_at, next(self._sequence), tag, self._resent(signature), attempt + 1))
+
+    def _resent(self, signature):
+        return self.resend(signature) if self.resend is not None else signature
+
+    def as_completed(self):
+        """
+        Run all submitted tasks and yield their results as they finish.
+
+        Tasks may also be submitted while iterating, they are picked up by the same loop.
+
+        Yields:
+            tuple: (tag, result) for every finished task, in completion order.
+
+        Raises:
+            TimeoutError: If the last attempt of a task ran for longer than `timeout` seconds.
+            Exception: The error of the last attempt of a task that failed `max_attempts` times.
+        """
+        self._fill()
+        while self._in_flight or self._delayed or self._pending:
+            now = time.monotonic()
+            progress = False
+            for tag in list(self._in_flight):
+                signature, attempt, copies = self._in_flight[tag]
+                for copy in list(copies):
+                    result, sent_at, duplicate = copy
+                    if result.ready():
+                        progress = True
+                        copies.remove(copy)
+                        try:
+                            value = result.get(timeout=self.timeout)  # Re-raises the exception if the task failed
+                        except Exception as exc:
+                            if not copies:
+                                self._failed(tag, exc)
+                            continue
+                        # The first copy to succeed is the result, a duplicate still running is ignored
+                        del self._in_flight[tag]
+                        self.hedge.observe(now - sent_at)
+                        self.latency.observe(now - sent_at)
+                        self.hedge.won += duplicate
+                        self._fill()  # Refill the freed slot before handing the result to the caller
+                        yield tag, value
+                        break
+                    if now - sent_at > self.timeout:
+                        progress = True
+                        copies.remove(copy)
+                        if not copies:
+                            self._failed(tag, TimeoutError(f"Task {tag!r} did not finish within {self.timeout} "
+                                                           f"seconds"))
+            self._fill()
+            self._send_hedges(time.monotonic())
+            if not progress:
+                self.engine.wait(self.poll_interval)
+
+
+def run_task(signature, timeout, engine=None, resend=None):
+    """
+    Run a single task with the deadline and retries of SlidingWindowExecutor and return its result.
+
+    Args:
+        signature (celery.canvas.Signature): The task signature to execute.
+        timeout (float): The maximum time (in seconds) a single attempt may run.
+        engine (CeleryEngine or LocalEngine): Where the task runs, get_engine() by default.
+        resend (callable): Turns the signature into the one sent for retries, see SlidingWindowExecutor.
+
+    Returns:
+        The task result.
+    """
+    executor = SlidingWindowExecutor(1, timeout, engine=engine, resend=resend)
+    executor.submit(None, signature)
+    for _, value in executor.as_completed():
+        return value
@@ -1,4 +1,13 @@
+import argparse
+import os
+import socket
+import sys
+import time
+
 from airbnb import airbnb_run
+from crawler.utils.engine import ENGINES
+from utils.checkpoint import CheckpointStore
+from utils.sharding import FileMembership, ShardedIds, StaticMembership
 
 
 def startup_airbnb():
@@ -16,7 +25,120 @@ def startup_airbnb():
     return str_ids  # Return the list of processed Airbnb IDs
 
 
+def input_opener(path):
+    """
+    Return a function that opens the ID input for one pass, None as the opener of stdin ('-') after its first pass.
+
+    Args:
+        path (str): Path of a file with one listing ID per line, '-' for stdin.
 
-if __name__ == '__main__':
-    airbnb_task_ids = startup_airbnb()
+    Returns:
+        callable: Returns an iterable of lines, or None if the input cannot be read again.
+    """
+    if path == '-':
+        passes = []
+
+        def open_stdin():
+            if passes:
+                return None
+            passes.append(True)
+            return sys.stdin
+        return open_stdin
 
+    def open_file():
+        def lines():
+            with open(path, encoding='utf-8') as file:
+                yield from file
+        return lines()
+    return open_file
+
+
+def make_is_done(store, fresh_for):
+    """
+    Return a function that tells whether any instance has completed a listing in the last `fresh_for` seconds.
+
+    Args:
+        store (CheckpointStore): The checkpoint database shared by the instances.
+        fresh_for (float): The time (in seconds) a completed crawl stays fresh, 0 crawls every listing again.
+
+    Returns:
+        callable: Takes a listing ID and returns a bool, None if `fresh_for` is 0.
+    """
+    if fresh_for <= 0:
+        return None
+    fresh_since = time.time() - fresh_for
+
+    def is_done(str_id):
+        return store.completed_since(str_id, fresh_since)
+    return is_done
+
+
+def sharded_airbnb(args):
+    """
+    Crawl this instance's share of a stream of listing IDs with the fair-share scheduler (mode='scheduled').
+
+    Args:
+        args (argparse.Namespace): The parsed command line, see main.
+    """
+    node = args.node or f'{socket.gethostname()}-{os.getpid()}'
+    if args.nodes:
+        membership = StaticMembership(args.nodes.split(','))
+        if node not in membership.nodes():
+            raise SystemExit(f"--node {node!r} is not one of --nodes {args.nodes!r}")
+    else:
+        membership = FileMembership(args.members_dir, node, args.member_ttl)
+
+    store = CheckpointStore(args.checkpoint) if args.checkpoint else None
+    # Listings crawled by any instance in the last fresh_for seconds are not crawled again after a re-balance
+    is_done = make_is_done(store, args.fresh_for) if store else None
+    ids = ShardedIds(input_opener(args.ids), membership, node, is_done)
+    print(f"Orchestrator {node}: instances {membership.nodes()}")
+    done = False
+    try:
+        airbnb_run(ids, args.batch_size, args.timeout, mode='scheduled', extract=True, output='ndjson',
+                   checkpoint=args.checkpoint, incremental=args.incremental,
+                   per_listing_limit=args.per_listing_limit, max_active_listings=args.max_active_listings,
+                   shards=args.shards, topics=args.topics, engine=args.engine)
+        done = True
+    finally:
+        # A finished instance keeps its share, an interrupted one hands it to the others
+        membership.leave(done)
+        if store is not None:
+            store.close()
+    print(f"Orchestrator {node}: {ids.ids_owned} of {ids.ids_read} listing IDs crawled in {ids.passes} passes")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crawl the Airbnb listings of a file or stdin, split over any number of orchestrator instances "
+                    "that feed the same Celery cluster. Without --ids, crawl the listings of startup_airbnb.")
+    parser.add_argument('--ids', help="file with one listing ID per line, '-' for stdin")
+    parser.add_argument('--node', help='name of this instance, unique in the cluster (default: <host>-<pid>)')
+    parser.add_argument('--nodes', help='comma-separated names of all instances, for a fixed split')
+    parser.add_argument('--members-dir', default='shared_data/members',
+                        help='directory shared by the instances to find each other (when --nodes is not given)')
+    parser.add_argument('--member-ttl', type=float, default=30.0,
+                        help='seconds after which a silent instance counts as gone')
+    parser.add_argument('--batch-size', type=int, default=16, help='page tasks in flight from this instance')
+    parser.add_argument('--timeout', type=int, default=60, help='seconds a page task may take before it is resent')
+    parser.add_argument('--per-listing-limit', type=int)
+    parser.add_argument('--max-active-listings', type=int)
+    parser.add_argument('--checkpoint', help='checkpoint database shared by the instances, to resume and re-balance')
+    parser.add_argument('--fresh-for', type=float, default=3600.0,
+                        help='with --checkpoint, skip listings completed within this many seconds')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--shards', action='store_true')
+    parser.add_argument('--topics', type=int, help='fit a topic model with this many topics on the reviews')
+    parser.add_argument('--engine', choices=ENGINES,
+                        help="'local' runs the page tasks in this process, without broker or workers "
+                             "(default: CRAWLER_ENGINE, else 'celery')")
+    args = parser.parse_args()
+
+    if args.ids is None:
+        startup_airbnb()
+    else:
+        sharded_airbnb(args)
+
+
+if __name__ == '__main__':
+    main()
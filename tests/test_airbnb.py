@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+import airbnb
+from crawler import celery_config
+
+REVIEWS_COUNT = 120
+
+
+def extracted_page(str_id, offset):
+    """The page a worker returns with extract=True for a listing with REVIEWS_COUNT reviews."""
+    reviews = [{'id': f'{str_id}-{index}', 'language': 'en', 'text': f'Review {index} of {str_id}',
+                'created_at': None, 'localized_text': None}
+               for index in range(offset, min(offset + 50, REVIEWS_COUNT))]
+    return {'str_id': str_id, 'offset': offset, 'reviews_count': REVIEWS_COUNT, 'reviews': reviews}
+
+
+class ReadyResult:
+    def __init__(self, task_id, value):
+        self.id = task_id
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return True
+
+    def get(self, timeout=None):
+        return self.value
+
+
+class PagesEngine:
+    """Answers fetch_comments and fetch_comments_batch signatures right away, without Celery."""
+
+    def __init__(self):
+        self.pages = []
+        self.refreshed = []
+
+    def apply_async(self, signature, **options):
+        kwargs = signature.kwargs
+        if 'items' in kwargs:
+            items = [(item[0], item[1], len(item) > 2 and item[2]) for item in kwargs['items']]
+        else:
+            items = [(kwargs['str_id'], kwargs['offset'], kwargs.get('refresh', False))]
+        self.pages.extend((str_id, offset) for str_id, offset, _ in items)
+        self.refreshed.extend((str_id, offset) for str_id, offset, refresh in items if refresh)
+        results = [{'result': extracted_page(str_id, offset)} for str_id, offset, _ in items]
+        return ReadyResult(f'task-{len(self.pages)}', results if 'items' in kwargs else results[0]['result'])
+
+    def wait(self, timeout):
+        pass
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'shared_data' / 'airbnb').mkdir(parents=True)
+    monkeypatch.setattr(celery_config, 'crawler_metrics_dir', '')
+    engine = PagesEngine()
+    monkeypatch.setattr(airbnb, 'get_engine', lambda name=None: engine)
+    return engine
+
+
+def test_scheduled_crawl_crawls_a_repeated_listing_once(engine, tmp_path):
+    ids = iter(['A', 'B', 'A', 'B', 'A'])  # A stream, like the lines of an ID file
+    result = airbnb.scheduled_airbnb_comments(ids, 8, 10, max_active_listings=5, extract=True)
+
+    assert result['listings'] == 2
+    assert sorted(engine.pages) == sorted((str_id, offset) for str_id in 'AB' for offset in (0, 50, 100))
+    for str_id in 'AB':
+        with open(tmp_path / 'shared_data' / 'airbnb' / f'airbnb_{str_id}.ndjson', encoding='utf-8') as file:
+            review_ids = [json.loads(line)['id'] for line in file]
+        assert review_ids == [f'{str_id}-{index}' for index in range(REVIEWS_COUNT)]
+    assert not list((tmp_path / 'shared_data' / 'airbnb').glob('*.part*'))
+    # A full crawl may be answered from the response cache
+    assert not engine.refreshed
+
+
+def test_incremental_crawl_bypasses_the_response_cache(engine, tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.sqlite3')
+    airbnb.scheduled_airbnb_comments(['A'], 8, 10, extract=True, checkpoint=checkpoint)
+    engine.pages.clear()
+    airbnb.scheduled_airbnb_comments(['A'], 8, 10, extract=True, checkpoint=checkpoint, incremental=True)
+
+    # A cached first page would not show the reviews written since the last crawl
+    assert engine.pages and engine.refreshed == engine.pages
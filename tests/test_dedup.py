@@ -0,0 +1,117 @@
+from utils.dedup import FIBONACCI_MULTIPLIER, UINT64_MASK, PaginationTracker, ReviewIdSet
+
+PAGE_SIZE = 50
+
+
+def serve(ordering, offset):
+    """The page of extracted records a fetch at `offset` returns while the listing's reviews are `ordering`."""
+    return {'reviews_count': len(ordering),
+            'reviews': [{'id': review_id} for review_id in ordering[offset:offset + PAGE_SIZE]]}
+
+
+def reviews(prefix, count):
+    return [f'{prefix}{index}' for index in range(count)]
+
+
+def test_id_set_membership():
+    seen = ReviewIdSet()
+    assert seen.add('123')
+    assert seen.add('abc')
+    assert not seen.add('123')
+    assert '123' in seen and 'abc' in seen
+    assert '124' not in seen and 'abd' not in seen
+    assert len(seen) == 2
+
+
+def test_id_set_keeps_the_key_zero_apart_from_empty_slots():
+    seen = ReviewIdSet()
+    assert '0' not in seen
+    assert seen.add('0')
+    assert not seen.add('0')
+    assert '0' in seen
+    assert len(seen) == 1
+
+
+def test_id_set_colliding_keys_share_a_probe_sequence():
+    seen = ReviewIdSet(capacity=16)
+    bits = 4
+
+    def slot(key):
+        return ((key * FIBONACCI_MULTIPLIER) & UINT64_MASK) >> (64 - bits)
+
+    colliding = [key for key in range(1, 2000) if slot(key) == slot(1)][:3]
+    assert len(colliding) == 3
+    assert seen.add(str(colliding[0]))
+    assert seen.add(str(colliding[1]))
+    assert str(colliding[1]) in seen
+    assert str(colliding[2]) not in seen
+    assert not seen.add(str(colliding[0]))
+    assert len(seen) == 2
+
+
+def test_id_set_grows_and_keeps_every_id():
+    seen = ReviewIdSet(capacity=16)
+    ids = [str(number * 7919) for number in range(1, 3000)] + reviews('review-', 3000)
+    assert all(seen.add(review_id) for review_id in ids)
+    assert len(seen) == len(ids)
+    assert all(review_id in seen for review_id in ids)
+    assert not any(seen.add(review_id) for review_id in ids)
+    assert '1' not in seen and 'review-3000' not in seen
+
+
+def test_stable_listing_with_a_short_last_page_has_no_gaps():
+    ordering = reviews('r', 120)
+    tracker = PaginationTracker(PAGE_SIZE)
+    for offset in (0, 50, 100):
+        page = tracker.add_page(offset, serve(ordering, offset))
+        assert page['offset'] == offset
+    assert len(page['reviews']) == 20
+    assert tracker.missing() == 0
+    assert tracker.duplicates == 0
+    assert tracker.gap_offsets() == []
+
+
+def test_reviews_shifted_past_a_boundary_are_found_and_refetched():
+    old = reviews('r', 100)
+    new = reviews('n', 5) + old
+    tracker = PaginationTracker(PAGE_SIZE)
+    # Page 50 is served before 5 reviews are posted, page 0 after: r45..r49 moved across the boundary unseen
+    tracker.add_page(50, serve(old, 50))
+    tracker.add_page(0, serve(new, 0))
+    assert tracker.missing() == 5
+    assert tracker.gap_offsets() == [50]
+
+    refetched = tracker.add_page(50, serve(new, 50), refetch=True)
+    assert [record['id'] for record in refetched['reviews']] == ['r45', 'r46', 'r47', 'r48', 'r49']
+    assert tracker.duplicates == 45
+    assert tracker.missing() == 0
+    assert tracker.gap_offsets() == []
+
+
+def test_duplicates_across_pages_are_dropped_and_the_ends_refetched():
+    old = reviews('r', 100)
+    new = reviews('n', 5) + old
+    tracker = PaginationTracker(PAGE_SIZE)
+    # Page 0 is served before 5 reviews are posted, page 50 after: r45..r49 come twice, r95..r99 not at all
+    tracker.add_page(0, serve(old, 0))
+    page = tracker.add_page(50, serve(new, 50))
+    assert [record['id'] for record in page['reviews']][:1] == ['r50']
+    assert tracker.duplicates == 5
+    assert tracker.missing() == 10
+    # The new reviews in front and the reviews pushed beyond the last planned page
+    assert tracker.gap_offsets() == [0, 100]
+
+
+def test_refetched_offsets_are_not_fetched_again_until_the_count_changes():
+    old = reviews('r', 100)
+    new = reviews('n', 5) + old
+    tracker = PaginationTracker(PAGE_SIZE)
+    tracker.add_page(0, serve(old, 0))
+    tracker.add_page(50, serve(new, 50))
+    tracker.add_page(0, serve(new, 0), refetch=True)
+    assert tracker.gap_offsets() == [100]
+
+    newer = reviews('m', 3) + new
+    tracker.add_page(100, serve(newer, 100), refetch=True)
+    # The count moved on, the offset refetched at the old count is due again
+    assert 0 in tracker.gap_offsets()
@@ -0,0 +1,129 @@
+import email.utils
+import time
+
+import pytest
+import requests
+
+from crawler import celery_config
+from crawler.fetch_comments_from_airbnb.tasks import fetch_comments
+from crawler.utils import http_client, response_cache
+from crawler.utils.retry import HedgePolicy, RetryableHTTPError, backoff_delay, check_response, refreshed
+
+
+def response(status_code, retry_after=None):
+    result = requests.Response()
+    result.status_code = status_code
+    result.url = 'https://example.com/api'
+    if retry_after is not None:
+        result.headers['Retry-After'] = retry_after
+    return result
+
+
+@pytest.fixture
+def backoff(monkeypatch):
+    monkeypatch.setattr(celery_config, 'crawler_retry_backoff', 0.5)
+    monkeypatch.setattr(celery_config, 'crawler_retry_backoff_max', 3.0)
+
+
+def test_backoff_delay_grows_exponentially_up_to_the_cap(backoff):
+    for attempt, cap in [(0, 0.5), (1, 1.0), (2, 2.0), (3, 3.0), (10, 3.0)]:
+        delays = [backoff_delay(attempt) for _ in range(500)]
+        assert all(0 <= delay <= cap for delay in delays)
+        # Full jitter: the delays spread over the whole range instead of bunching at the cap
+        assert min(delays) < cap * 0.1 and max(delays) > cap * 0.9
+
+
+def test_backoff_delay_is_never_shorter_than_retry_after(backoff):
+    assert all(backoff_delay(0, retry_after=5.0) == 5.0 for _ in range(100))
+    assert all(0.2 <= backoff_delay(3, retry_after=0.2) <= 3.0 for _ in range(100))
+
+
+def test_check_response_accepts_a_successful_response():
+    check_response(response(200))
+
+
+@pytest.mark.parametrize('status_code', [429, 500, 502, 503, 504])
+def test_check_response_raises_retryable_errors_for_throttling_and_server_errors(status_code):
+    with pytest.raises(RetryableHTTPError) as error:
+        check_response(response(status_code, retry_after='7'))
+    assert error.value.retry_after == 7.0
+    assert error.value.response.status_code == status_code
+
+
+def test_check_response_reads_retry_after_as_an_http_date():
+    retry_at = email.utils.formatdate(time.time() + 30, usegmt=True)
+    with pytest.raises(RetryableHTTPError) as error:
+        check_response(response(503, retry_after=retry_at))
+    assert 25 <= error.value.retry_after <= 30
+
+
+def test_check_response_without_or_with_a_broken_retry_after():
+    for retry_after in (None, 'soon'):
+        with pytest.raises(RetryableHTTPError) as error:
+            check_response(response(429, retry_after=retry_after))
+        assert error.value.retry_after is None
+
+
+@pytest.mark.parametrize('status_code', [400, 403, 404])
+def test_check_response_raises_other_client_errors_as_final(status_code):
+    with pytest.raises(requests.HTTPError) as error:
+        check_response(response(status_code))
+    assert not isinstance(error.value, RetryableHTTPError)
+
+
+def test_hedge_budget_is_a_tenth_of_the_window_and_at_least_one():
+    hedge = HedgePolicy(quantile=0.95, min_samples=1)
+    assert hedge.budget(1) == 1
+    assert hedge.budget(9) == 1
+    assert hedge.budget(10) == 1
+    assert hedge.budget(64) == 6
+    assert hedge.budget(200) == 20
+
+
+def test_hedge_threshold_needs_enough_samples_and_scales_with_the_items():
+    hedge = HedgePolicy(quantile=0.5, min_samples=10)
+    for _ in range(9):
+        hedge.observe(0.1)
+    assert hedge.threshold() is None
+    hedge.observe(0.4, items=4)
+    assert hedge.threshold() == pytest.approx(0.1, rel=0.2)
+    assert hedge.threshold(items=8) == pytest.approx(0.8, rel=0.2)
+    assert HedgePolicy(quantile=0, min_samples=0).threshold() is None
+
+
+class FakeSession:
+    def __init__(self):
+        self.bodies = iter([b'{"page": 1}', b'{"page": 2}'])
+
+    def get(self, url, headers, params, timeout):
+        result = response(200)
+        result._content = next(self.bodies)
+        return result
+
+
+class FakeRateLimiter:
+    def acquire(self, host):
+        pass
+
+    def report(self, host, status_code, retry_after):
+        pass
+
+
+def test_send_request_without_the_cache_goes_to_the_network_and_refreshes_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(celery_config, 'crawler_response_cache_path', str(tmp_path / 'cache.sqlite3'))
+    monkeypatch.setattr(response_cache, '_response_cache', None)
+    monkeypatch.setattr(http_client, 'get_session', lambda: session)
+    monkeypatch.setattr(http_client, 'get_rate_limiter', FakeRateLimiter)
+    session = FakeSession()
+    request_config = ['https://example.com/api', {}, {'offset': 0}]
+
+    assert http_client.send_request(request_config).content == b'{"page": 1}'
+    assert http_client.send_request(request_config).headers['X-Crawler-Cache'] == 'hit'
+    assert http_client.send_request(request_config, use_cache=False).content == b'{"page": 2}'
+    assert http_client.send_request(request_config).content == b'{"page": 2}'
+
+
+def test_refreshed_signature_bypasses_the_cache_and_keeps_the_rest():
+    signature = refreshed(fetch_comments.s(str_id='1', offset=50, extract=True).set(queue='pages'))
+    assert signature.kwargs == {'str_id': '1', 'offset': 50, 'extract': True, 'refresh': True}
+    assert signature.options['queue'] == 'pages'
@@ -0,0 +1,81 @@
+import csv
+import json
+import os
+
+from utils.review_sink import ReviewSink
+
+
+def review(review_id):
+    return {'id': review_id, 'language': 'en', 'text': f'Review {review_id}', 'created_at': None,
+            'localized_text': None}
+
+
+def page(offset, *review_ids):
+    return {'offset': offset, 'reviews_count': 100, 'reviews': [review(review_id) for review_id in review_ids],
+            'raw': {'offset': offset}}
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        return [row[0] for row in csv.reader(file)]
+
+
+def make_sink(tmp_path, resume=False):
+    return ReviewSink(str(tmp_path / 'l.ndjson'), str(tmp_path / 'l.csv'), str(tmp_path / 'l.raw.ndjson'),
+                      resume=resume)
+
+
+def test_finalize_publishes_all_files_and_drops_the_journal(tmp_path):
+    with make_sink(tmp_path) as sink:
+        sink.write_page(page(0, '1', '2'))
+        sink.write_page(page(50, '3'))
+
+    assert [json.loads(line)['id'] for line in read_lines(tmp_path / 'l.ndjson')] == ['1', '2', '3']
+    assert read_csv(tmp_path / 'l.csv')[1:] == ['Review 1', 'Review 2', 'Review 3']
+    assert len(read_lines(tmp_path / 'l.raw.ndjson')) == 2
+    assert sorted(os.listdir(tmp_path)) == ['l.csv', 'l.ndjson', 'l.raw.ndjson']
+
+
+def test_resume_cuts_off_a_page_written_to_some_files_only(tmp_path):
+    sink = make_sink(tmp_path)
+    sink.write_page(page(0, '1', '2'))
+    # The run dies after the records of the next page reached the NDJSON file, before its CSV rows
+    sink._ndjson_file.write(json.dumps(review('3')) + '\n')
+    sink._ndjson_file.flush()
+    sink.close()
+
+    with make_sink(tmp_path, resume=True) as sink:
+        assert [json.loads(line)['id'] for line in read_lines(tmp_path / 'l.ndjson.part')] == ['1', '2']
+        sink.write_page(page(50, '3'))
+
+    assert [json.loads(line)['id'] for line in read_lines(tmp_path / 'l.ndjson')] == ['1', '2', '3']
+    assert read_csv(tmp_path / 'l.csv')[1:] == ['Review 1', 'Review 2', 'Review 3']
+
+
+def test_resume_without_a_complete_page_starts_over(tmp_path):
+    sink = make_sink(tmp_path)
+    sink._ndjson_file.write('{"id": "1", "lang')
+    sink.close()
+
+    with make_sink(tmp_path, resume=True) as sink:
+        sink.write_page(page(0, '1'))
+
+    assert [json.loads(line)['id'] for line in read_lines(tmp_path / 'l.ndjson')] == ['1']
+    assert read_csv(tmp_path / 'l.csv') == ['sentence', 'Review 1']
+
+
+def test_raw_response_of_a_page_already_written_is_skipped(tmp_path):
+    sink = make_sink(tmp_path)
+    sink.write_page(page(0, '1'))
+    sink.close()
+
+    with make_sink(tmp_path, resume=True) as sink:
+        sink.write_page(page(0), write_raw=False)
+        sink.write_page(page(50, '2'))
+
+    assert [json.loads(line)['offset'] for line in read_lines(tmp_path / 'l.raw.ndjson')] == [0, 50]
@@ -0,0 +1,314 @@
+import itertools
+import time
+from collections import Counter, deque
+
+import pytest
+
+from crawler import celery_config
+from crawler.utils.metrics import Histogram, job_summary
+from crawler.utils.scheduler import FairShareScheduler, Job
+from crawler.utils.streaming import SlidingWindowExecutor
+
+
+class FakeResult:
+    """An AsyncResult stand-in that becomes ready `delay` seconds after it was sent."""
+
+    def __init__(self, engine, signature, delay, outcome):
+        self.id = next(engine.ids)
+        self.engine = engine
+        self.signature = signature
+        self.ready_at = time.monotonic() + delay
+        self.outcome = outcome
+        self.collected = False
+
+    def ready(self):
+        return time.monotonic() >= self.ready_at
+
+    def successful(self):
+        return self.ready() and not isinstance(self.outcome, Exception)
+
+    def get(self, timeout=None):
+        if not self.collected:
+            self.collected = True
+            self.engine.collected(self)
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+class FakeEngine:
+    """
+    Runs page signatures (job name, page) and batches ('batch', [signatures]) without Celery.
+
+    `behaviour(signature, attempt)` returns (delay, value or exception) for a page, by default it answers
+    '<job>:<page>' after 2 ms. The most pages of one job and the most messages that were sent and not collected yet
+    are recorded.
+    """
+
+    def __init__(self, behaviour=None):
+        self.behaviour = behaviour or (lambda signature, attempt: (0.002, f'{signature[0]}:{signature[1]}'))
+        self.ids = (f'task-{number}' for number in itertools.count())
+        self.attempts = Counter()
+        self.messages = 0
+        self.outstanding = Counter()
+        self.max_outstanding = Counter()
+        self.max_messages = 0
+        self._open_messages = 0
+
+    @staticmethod
+    def pages(signature):
+        return signature[1] if signature[0] == 'batch' else [signature]
+
+    def apply_async(self, signature, **options):
+        self.messages += 1
+        items = []
+        for page in self.pages(signature):
+            self.attempts[page] += 1
+            items.append(self.behaviour(page, self.attempts[page]))
+            self.outstanding[page[0]] += 1
+            self.max_outstanding[page[0]] = max(self.max_outstanding[page[0]], self.outstanding[page[0]])
+        self._open_messages += 1
+        self.max_messages = max(self.max_messages, self._open_messages)
+        delay = sum(delay for delay, _ in items)
+        if signature[0] != 'batch':
+            return FakeResult(self, signature, delay, items[0][1])
+        outcome = [{'error': f'{type(value).__name__}: {value}'} if isinstance(value, Exception)
+                   else {'result': value} for _, value in items]
+        return FakeResult(self, signature, delay, outcome)
+
+    def collected(self, result):
+        self._open_messages -= 1
+        for page in self.pages(result.signature):
+            self.outstanding[page[0]] -= 1
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, 0.001))
+
+
+def batch(signatures):
+    return ('batch', list(signatures))
+
+
+class PagesJob(Job):
+    """A job with a fixed number of pages, every result must arrive exactly once."""
+
+    def __init__(self, name, pages, batchable=False):
+        self.name = name
+        self.batchable = batchable
+        self.pages = pages
+        self.results = {}
+        self.errors = {}
+        self.discarded = []
+        self.finished = False
+        self._pending = deque(range(pages))
+        self._in_flight = 0
+
+    def has_task(self):
+        return bool(self._pending)
+
+    def next_task(self):
+        page = self._pending.popleft()
+        self._in_flight += 1
+        return page, (self.name, page)
+
+    def on_result(self, tag, result):
+        assert tag not in self.results, f"page {tag} of {self.name} delivered twice"
+        self._in_flight -= 1
+        self.results[tag] = result
+
+    def on_error(self, tag, exc):
+        assert tag not in self.errors
+        self._in_flight -= 1
+        self.errors[tag] = exc
+
+    def is_done(self):
+        return not self._pending and not self._in_flight
+
+    def discard(self, tag, result):
+        self.discarded.append((tag, result))
+
+    def finish(self):
+        assert not self.finished
+        self.finished = True
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(celery_config, 'crawler_retry_backoff', 0.001)
+    monkeypatch.setattr(celery_config, 'crawler_hedge_quantile', 0)
+
+
+def expected_results(job):
+    return {page: f'{job.name}:{page}' for page in range(job.pages)}
+
+
+def test_every_page_of_every_job_is_delivered_once_within_the_limits():
+    engine = FakeEngine()
+    jobs = [PagesJob(f'job{index}', pages) for index, pages in enumerate([30, 1, 7, 0, 12])]
+    scheduler = FairShareScheduler(max_in_flight=6, per_job_limit=2, max_active_jobs=3, timeout=5, router=None,
+                                   engine=engine)
+    scheduler.run(iter(jobs))
+
+    for job in jobs:
+        assert job.results == expected_results(job)
+        assert job.finished
+    assert scheduler.jobs_completed == len(jobs)
+    assert scheduler.tasks_completed == sum(job.pages for job in jobs)
+    assert engine.max_messages <= 6
+    assert max(engine.max_outstanding.values()) <= 2
+
+
+def test_active_jobs_are_admitted_lazily():
+    engine = FakeEngine()
+    admitted = []
+
+    def jobs():
+        for index in range(5):
+            admitted.append(index)
+            yield PagesJob(f'job{index}', 3)
+
+    scheduler = FairShareScheduler(max_in_flight=4, per_job_limit=4, max_active_jobs=1, timeout=5, router=None,
+                                   engine=engine)
+    scheduler.run(jobs())
+    assert admitted == list(range(5))
+    # One job at a time, so no job shares the window with another
+    assert engine.max_messages <= 3
+
+
+def test_batched_messages_carry_several_pages_and_deliver_each_once():
+    engine = FakeEngine()
+    jobs = [PagesJob(f'job{index}', 40, batchable=True) for index in range(3)]
+    scheduler = FairShareScheduler(max_in_flight=2, per_job_limit=40, max_active_jobs=3, timeout=5,
+                                   max_chunk_size=8, batcher=batch, router=None, engine=engine)
+    scheduler.run(jobs)
+
+    for job in jobs:
+        assert job.results == expected_results(job)
+    assert scheduler.tasks_completed == 120
+    assert scheduler.messages_sent < 120
+    assert engine.max_messages <= 2
+
+
+def test_failed_item_of_a_batch_is_retried_on_its_own():
+    def behaviour(page, attempt):
+        if page == ('job0', 3) and attempt == 1:
+            return 0.002, RuntimeError('HTTP 503')
+        return 0.002, f'{page[0]}:{page[1]}'
+
+    engine = FakeEngine(behaviour)
+    job = PagesJob('job0', 10, batchable=True)
+    scheduler = FairShareScheduler(max_in_flight=2, per_job_limit=10, max_active_jobs=1, timeout=5,
+                                   max_chunk_size=5, batcher=batch, router=None, engine=engine)
+    scheduler.run([job])
+
+    assert job.results == expected_results(job)
+    assert scheduler.retries == 1
+    assert engine.attempts[('job0', 3)] == 2
+    assert engine.attempts[('job0', 4)] == 1
+
+
+def test_late_copy_is_given_up_retried_and_its_result_discarded():
+    def behaviour(page, attempt):
+        if page == ('slow', 0) and attempt == 1:
+            return 0.3, 'late'  # Past the deadline of 0.2 s, but before the copy is forgotten
+        return 0.01, f'{page[0]}:{page[1]}'
+
+    engine = FakeEngine(behaviour)
+    # The pages of the other job, one at a time, keep the scheduler running until the late copy is in
+    slow, other = PagesJob('slow', 2), PagesJob('other', 60)
+    scheduler = FairShareScheduler(max_in_flight=4, per_job_limit=1, max_active_jobs=2, timeout=0.2, router=None,
+                                   engine=engine)
+    scheduler.run([slow, other])
+
+    assert slow.results == expected_results(slow)
+    assert other.results == expected_results(other)
+    assert slow.discarded == [(0, 'late')]
+    assert scheduler.retries == 1
+    assert not slow.errors
+
+
+def test_job_gets_the_error_after_the_last_attempt():
+    def behaviour(page, attempt):
+        if page == ('job0', 1):
+            return 0.002, RuntimeError('HTTP 500')
+        return 0.002, f'{page[0]}:{page[1]}'
+
+    engine = FakeEngine(behaviour)
+    job = PagesJob('job0', 3)
+    scheduler = FairShareScheduler(max_in_flight=2, per_job_limit=2, max_active_jobs=1, timeout=5, max_attempts=3,
+                                   router=None, engine=engine)
+    scheduler.run([job])
+
+    assert set(job.results) == {0, 2}
+    assert list(job.errors) == [1]
+    assert str(job.errors[1]) == 'HTTP 500'
+    assert engine.attempts[('job0', 1)] == 3
+    assert scheduler.retries == 2
+    assert job.finished
+
+
+def test_a_job_whose_result_handling_raises_fails_alone():
+    class MalformedPageJob(PagesJob):
+        def on_result(self, tag, result):
+            if tag == 1:
+                raise ValueError('malformed page')
+            super().on_result(tag, result)
+
+    engine = FakeEngine()
+    broken = MalformedPageJob('broken', 3)
+    jobs = [PagesJob(f'job{index}', 5) for index in range(3)]
+    scheduler = FairShareScheduler(max_in_flight=4, per_job_limit=2, max_active_jobs=2, timeout=5, router=None,
+                                   engine=engine)
+    scheduler.run([broken] + jobs)
+
+    assert set(broken.results) == {0, 2}
+    assert list(broken.errors) == [1] and str(broken.errors[1]) == 'malformed page'
+    assert broken.finished
+    assert all(job.results == expected_results(job) and job.finished for job in jobs)
+    assert scheduler.tasks_completed == 17
+    assert engine.attempts[('broken', 1)] == 1  # The page was fetched, sending it again would not help
+
+
+def test_job_must_implement_the_scheduler_interface():
+    class Incomplete(Job):
+        def has_task(self):
+            return False
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_retries_send_the_resent_signature():
+    def behaviour(page, attempt):
+        if page == ('job0', 1):
+            return 0.002, RuntimeError('HTTP 503')
+        return 0.002, f'{page[0]}:{page[1]}'
+
+    def resend(signature):
+        return signature + ('refresh',)
+
+    engine = FakeEngine(behaviour)
+    job = PagesJob('job0', 3)
+    scheduler = FairShareScheduler(max_in_flight=2, per_job_limit=2, max_active_jobs=1, timeout=5, router=None,
+                                   engine=engine, resend=resend)
+    scheduler.run([job])
+    assert job.results == expected_results(job)
+    assert engine.attempts[('job0', 1)] == 1 and engine.attempts[('job0', 1, 'refresh')] == 1
+
+    executor = SlidingWindowExecutor(2, timeout=5, poll_interval=0.001, engine=engine, resend=resend)
+    executor.submit(1, ('job0', 1))
+    assert list(executor.as_completed()) == [(1, 'job0:1')]
+    assert engine.attempts[('job0', 1, 'refresh')] == 2
+
+
+def test_sliding_window_records_the_latency_of_every_page():
+    engine = FakeEngine()
+    latency = Histogram()
+    for start in (0, 4):
+        executor = SlidingWindowExecutor(2, timeout=5, poll_interval=0.001, engine=engine, latency=latency)
+        for page in range(start, start + 4):
+            executor.submit(page, ('job0', page))
+        assert sorted(tag for tag, _ in executor.as_completed()) == list(range(start, start + 4))
+    assert latency.count == 8
+    assert 0.002 <= latency.quantile(0.5) < 1
+    assert job_summary('job0', latency, 0.5).startswith('Summary for job0: 8 pages, 16.00 pages/s, latency p50 ')
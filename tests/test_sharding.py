@@ -0,0 +1,157 @@
+import os
+import time
+from collections import Counter
+
+import pytest
+
+from main import make_is_done
+from utils.checkpoint import CheckpointStore
+from utils.sharding import FileMembership, ShardedIds, StaticMembership, owner, read_ids
+
+IDS = [f'listing-{index}' for index in range(2000)]
+
+
+class ChangingMembership:
+    """A membership whose nodes change to `after` from the ID at index `ids_before_change` of the first pass on."""
+
+    def __init__(self, before, after, ids_before_change):
+        self.before = before
+        self.after = after
+        self.ids_before_change = ids_before_change
+        self.sharded = None
+
+    def nodes(self):
+        if self.sharded is not None and self.sharded.ids_read > self.ids_before_change:
+            return self.after
+        return self.before
+
+    def leave(self, done=False):
+        pass
+
+
+def crawl(node, membership, is_done=None):
+    sharded = ShardedIds(lambda: iter(IDS), membership, node, is_done, refresh_interval=0)
+    if isinstance(membership, ChangingMembership):
+        membership.sharded = sharded
+    return list(sharded), sharded
+
+
+@pytest.fixture
+def members(tmp_path):
+    memberships = []
+
+    def join(node, ttl=30.0):
+        membership = FileMembership(str(tmp_path), node, ttl)
+        memberships.append(membership)
+        return membership
+
+    yield join
+    for membership in memberships:
+        if not membership._stopped.is_set():
+            membership.leave()
+
+
+def test_read_ids_skips_blank_lines_and_comments():
+    assert list(read_ids([' a\n', '\n', '# b\n', 'c'])) == ['a', 'c']
+
+
+def test_owner_is_deterministic_and_independent_of_the_node_order():
+    nodes = ['a', 'b', 'c']
+    owners = [owner(str_id, nodes) for str_id in IDS]
+    assert owners == [owner(str_id, list(reversed(nodes))) for str_id in IDS]
+    assert owners == [owner(str_id, nodes) for str_id in IDS]
+    assert owner('listing-1', []) is None
+    # Every node gets about a third of the keys
+    assert all(550 < count < 780 for count in Counter(owners).values())
+
+
+def test_a_joining_node_only_takes_keys_and_a_leaving_one_only_gives_its_own():
+    before = {str_id: owner(str_id, ['a', 'b', 'c']) for str_id in IDS}
+
+    joined = {str_id: owner(str_id, ['a', 'b', 'c', 'd']) for str_id in IDS}
+    moved = [str_id for str_id in IDS if joined[str_id] != before[str_id]]
+    assert moved and all(joined[str_id] == 'd' for str_id in moved)
+
+    left = {str_id: owner(str_id, ['a', 'c']) for str_id in IDS}
+    moved = [str_id for str_id in IDS if left[str_id] != before[str_id]]
+    assert sorted(moved) == sorted(str_id for str_id in IDS if before[str_id] == 'b')
+
+
+def test_static_shards_split_the_input_without_overlap():
+    membership = StaticMembership(['b', 'a', 'c'])
+    shares = [crawl(node, membership) for node in ('a', 'b', 'c')]
+    assert sorted(sum((ids for ids, _ in shares), [])) == sorted(IDS)
+    assert all(sharded.passes == 1 and sharded.ids_read == len(IDS) for _, sharded in shares)
+
+
+def test_ids_of_a_node_that_left_are_taken_over_in_another_pass():
+    # b is interrupted after half the input, a owns the rest and picks up b's share of the first half afterwards
+    a_ids, sharded = crawl('a', ChangingMembership(['a', 'b'], ['a'], 1000))
+    first_pass = len(IDS) - sum(1 for str_id in IDS[:1000] if owner(str_id, ['a', 'b']) == 'b')
+
+    assert len(a_ids) == len(set(a_ids))
+    assert sorted(a_ids) == sorted(IDS)
+    assert all(owner(str_id, ['a', 'b']) == 'b' for str_id in a_ids[first_pass:])
+    assert sharded.passes == 2
+    assert sharded.ids_read == len(IDS)
+
+
+def test_ids_a_joining_node_takes_are_not_crawled_by_the_others():
+    a_ids, sharded = crawl('a', ChangingMembership(['a'], ['a', 'd'], 1000))
+    assert all(owner(str_id, ['a', 'd']) == 'a' for str_id in a_ids[-100:])
+    # The first half was handed out before d joined, no second pass takes anything back
+    assert sum(1 for str_id in a_ids if IDS.index(str_id) < 1000) == 1000
+    assert sharded.passes == 2
+    assert len(a_ids) == len(set(a_ids))
+
+
+def test_file_membership_sees_the_live_nodes_and_drops_a_stale_one(members):
+    a, b = members('a'), members('b')
+    assert a.nodes() == b.nodes() == ['a', 'b']
+
+    # b's heartbeat is older than the ttl: it crashed
+    b._stopped.set()
+    b._thread.join()
+    stale = time.time() - 60
+    os.utime(b._path, (stale, stale))
+    assert a.nodes() == ['a']
+
+
+def test_an_interrupted_node_leaves_and_a_finished_one_keeps_its_share(members):
+    a, b, c = members('a'), members('b'), members('c')
+    b.leave()
+    assert a.nodes() == ['a', 'c']
+    c.leave(done=True)
+    assert a.nodes() == ['a', 'c']
+    assert not os.path.exists(c._path)
+
+
+def test_a_new_crawl_forgets_the_finished_nodes_of_the_last_one(members):
+    a, b = members('a'), members('b')
+    b.leave(done=True)
+    # An instance joining the running crawl still counts b
+    c = members('c')
+    assert c.nodes() == ['a', 'b', 'c']
+    c.leave()
+    a.leave(done=True)
+    assert members('d').nodes() == ['d']
+
+
+def test_completed_since_and_make_is_done(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoint.sqlite3'))
+    store.start_listing('1', 10)
+    assert not store.completed_since('1', 0)
+    store.complete_listing('1', None)
+    assert store.completed_since('1', time.time() - 60)
+    assert not store.completed_since('1', time.time() + 60)
+    assert not store.completed_since('2', 0)
+
+    assert make_is_done(store, 0) is None
+    is_done = make_is_done(store, 3600)
+    assert is_done('1') and not is_done('2')
+    store.close()
+
+
+def test_recently_completed_ids_are_skipped(tmp_path):
+    a_ids, _ = crawl('a', StaticMembership(['a']), is_done=lambda str_id: str_id.endswith('7'))
+    assert len(a_ids) == len(IDS) * 9 // 10
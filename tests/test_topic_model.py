@@ -0,0 +1,119 @@
+import itertools
+import os
+import time
+
+import pytest
+
+from utils.review_sink import ReviewSink, add_record_listener, remove_record_listener
+from utils.topic_model import follow_review_texts, topic_model_alongside
+
+
+def review(review_id, text=None):
+    return {'id': review_id, 'language': 'en', 'text': text or f'Review {review_id}', 'created_at': None,
+            'localized_text': None}
+
+
+def page(offset, *review_ids):
+    return {'offset': offset, 'reviews_count': 100, 'reviews': [review(review_id) for review_id in review_ids]}
+
+
+def make_sink(directory, name='l', resume=False, append=False):
+    return ReviewSink(str(directory / f'{name}.ndjson'), str(directory / f'{name}.csv'), resume=resume,
+                      append=append)
+
+
+def open_files():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def test_follower_reads_every_review_once_across_rename_and_append(tmp_path):
+    stopped = []
+    texts = follow_review_texts(str(tmp_path), lambda: bool(stopped), poll_interval=0.001)
+
+    sink = make_sink(tmp_path)
+    sink.write_page(page(0, '1', '2'))
+    assert list(itertools.islice(texts, 2)) == ['Review 1', 'Review 2']
+    sink.write_page(page(50, '3'))
+    sink.finalize()
+    assert next(texts) == 'Review 3'
+
+    # An incremental run copies the finalized file and appends to the copy
+    with make_sink(tmp_path, append=True) as sink:
+        sink.write_page(page(0, '4'))
+    stopped.append(True)
+    assert list(texts) == ['Review 4']
+
+
+def test_follower_keeps_no_file_open(tmp_path):
+    for index in range(50):
+        with make_sink(tmp_path, name=f'l{index}') as sink:
+            sink.write_page(page(0, str(index)))
+    before = open_files()
+    stopped = []
+    texts = follow_review_texts(str(tmp_path), lambda: bool(stopped), poll_interval=0.001)
+    assert len(list(itertools.islice(texts, 50))) == 50
+    assert open_files() <= before + 1  # The file of the last text, until the generator goes on
+    stopped.append(True)
+    assert list(texts) == []
+    assert open_files() == before
+
+
+def test_follower_skips_the_reviews_of_earlier_runs(tmp_path):
+    with make_sink(tmp_path) as sink:
+        sink.write_page(page(0, '1'))
+    earlier = time.time() - 60
+    os.utime(tmp_path / 'l.ndjson', (earlier, earlier))
+    stopped = []
+    texts = follow_review_texts(str(tmp_path), lambda: bool(stopped), poll_interval=0.001, since=time.time())
+
+    # The incremental run starts from a copy of the earlier output, only its own reviews are new
+    sink = make_sink(tmp_path, append=True)
+    sink.write_page(page(0, '2'))
+    assert next(texts) == 'Review 2'
+    sink.write_page(page(50, '3'))
+    sink.finalize()
+    stopped.append(True)
+    assert list(texts) == ['Review 3']
+
+
+def test_listeners_get_only_the_pages_written_by_this_run(tmp_path):
+    with make_sink(tmp_path) as sink:
+        sink.write_page(page(0, '1'))
+    received = []
+    add_record_listener(received.append)
+    try:
+        with make_sink(tmp_path, append=True) as sink:
+            sink.write_page(page(0, '2', '3'))
+    finally:
+        remove_record_listener(received.append)
+    with make_sink(tmp_path, append=True) as sink:
+        sink.write_page(page(0, '4'))
+    assert [[record['id'] for record in records] for records in received] == [['2', '3']]
+
+
+def test_topic_model_alongside_is_fed_by_the_sinks(tmp_path, capsys):
+    pytest.importorskip('sklearn')
+    words = ['beach sea sand sun waves', 'kitchen oven fridge dishes cooking', 'subway train station metro bus']
+    with topic_model_alongside(3, str(tmp_path / 'topics.json'), chunk_size=20, workers=0) as stage:
+        for index in range(3):
+            with make_sink(tmp_path, name=f'l{index}') as sink:
+                sink.write_page({'offset': 0, 'reviews_count': 40,
+                                 'reviews': [review(f'{index}-{number}', words[index]) for number in range(40)]})
+    assert stage.documents == 120
+    assert os.path.exists(tmp_path / 'topics.json')
+    assert 'Topic model: 120 documents' in capsys.readouterr().out
+
+
+def test_topic_model_alongside_raises_the_error_that_stopped_the_model(tmp_path, monkeypatch):
+    pytest.importorskip('sklearn')
+
+    def fail(self, matrix, terms):
+        raise MemoryError('model')
+
+    monkeypatch.setattr('utils.topic_model.TopicModelStage._update', fail)
+    with pytest.raises(MemoryError):
+        with topic_model_alongside(2, chunk_size=5, workers=0):
+            # The crawl is not held up by the failed model
+            for index in range(20):
+                with make_sink(tmp_path, name=f'l{index}') as sink:
+                    sink.write_page(page(0, *[f'{index}-{number}' for number in range(10)]))
@@ -0,0 +1,128 @@
+import sqlite3
+import time
+
+
+class CheckpointStore:
+    """
+    Durable per-listing crawl progress, kept in a local SQLite database.
+
+    While a listing is crawled, every page whose output has been written is recorded, so an interrupted run can
+    resume with only the missing offsets. When a listing completes, its page records are dropped and the newest
+    review (reviews are fetched MOST_RECENT first) is kept, so a later incremental crawl knows where to stop.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30)
+        with self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS listings (
+                    str_id TEXT PRIMARY KEY,
+                    reviews_count INTEGER,
+                    newest_review_id TEXT,
+                    newest_created_at TEXT,
+                    started_at REAL,
+                    completed_at REAL
+                )""")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    str_id TEXT NOT NULL,
+                    page_offset INTEGER NOT NULL,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (str_id, page_offset)
+                )""")
+
+    def close(self):
+        self._connection.close()
+
+    def completed_offsets(self, str_id):
+        """
+        Return the offsets of the pages already written for the unfinished crawl of a listing.
+
+        Args:
+            str_id (str): The listing ID.
+
+        Returns:
+            set: The completed offsets, empty if there is no unfinished crawl.
+        """
+        rows = self._connection.execute("SELECT page_offset FROM pages WHERE str_id = ?", (str_id,))
+        return {row[0] for row in rows}
+
+    def start_listing(self, str_id, reviews_count):
+        """
+        Record that a crawl of a listing has started (or resumed).
+
+        Args:
+            str_id (str): The listing ID.
+            reviews_count (int): The total number of reviews reported by the first page.
+        """
+        with self._connection:
+            self._connection.execute("""
+                INSERT INTO listings (str_id, reviews_count, started_at) VALUES (?, ?, ?)
+                ON CONFLICT (str_id) DO UPDATE SET reviews_count = excluded.reviews_count,
+                                                   started_at = excluded.started_at,
+                                                   completed_at = NULL""",
+                                     (str_id, reviews_count, time.time()))
+
+    def mark_page(self, str_id, offset):
+        """
+        Record that the page at `offset` has been written to the output.
+
+        Args:
+            str_id (str): The listing ID.
+            offset (int): The offset of the page.
+        """
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO pages (str_id, page_offset, completed_at) VALUES (?, ?, ?)",
+                                     (str_id, offset, time.time()))
+
+    def complete_listing(self, str_id, newest_review):
+        """
+        Record that a crawl of a listing has completed and remember its newest review.
+
+        Args:
+            str_id (str): The listing ID.
+            newest_review (dict): The newest review record ('id' and 'created_at'), None to keep the known one.
+        """
+        with self._connection:
+            if newest_review is not None:
+                self._connection.execute("""
+                    UPDATE listings SET newest_review_id = ?, newest_created_at = ? WHERE str_id = ?""",
+                                         (newest_review['id'], newest_review['created_at'], str_id))
+            self._connection.execute("UPDATE listings SET completed_at = ? WHERE str_id = ?", (time.time(), str_id))
+            self._connection.execute("DELETE FROM pages WHERE str_id = ?", (str_id,))
+
+    def completed_since(self, str_id, since):
+        """
+        Return True if the last crawl of a listing completed at or after `since`.
+
+        Args:
+            str_id (str): The listing ID.
+            since (float): A time.time() value.
+
+        Returns:
+            bool: Whether the listing has been crawled completely since then.
+        """
+        row = self._connection.execute("SELECT 1 FROM listings WHERE str_id = ? AND completed_at >= ?",
+                                       (str_id, since)).fetchone()
+        return row is not None
+
+    def newest_review(self, str_id):
+        """
+        Return the newest review seen by the last completed crawl of a listing.
+
+        Args:
+            str_id (str): The listing ID.
+
+        Returns:
+            dict or None: {'id', 'created_at'}, None if the listing has never been crawled completely.
+        """
+        row = self._connection.execute("""
+            SELECT newest_review_id, newest_created_at FROM listings
+            WHERE str_id = ? AND newest_review_id IS NOT NULL""", (str_id,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'created_at': row[1]}
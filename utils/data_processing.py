@@ -1,8 +1,128 @@
 import json
-import re
 
-import pandas as pd
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from crawler.utils.fetch_data import HTML_TAG_PATTERN, get_review_nodes_from_airbnb, remove_html_tags
+
+# Separator used to clean many texts with a single regex call. '.' never matches a newline,
+# so no tag match can reach across it and the separator survives the substitution unchanged.
+BATCH_SEPARATOR = '\n\x00\n'
+
+# Header row of the review CSV files
+CSV_HEADER = '"sentence"\n'
+
+
+def recursive_extract(data, reviews):
+    """
+    Extract English reviews from any nested JSON structure by walking every node.
+
+    Args:
+        data: The decoded JSON (dict, list or scalar).
+        reviews (list): The list the extracted review texts are appended to.
+    """
+    if isinstance(data, dict):
+        # Check if the dictionary has a type identifier
+        if "__typename" in data:
+            typename = data["__typename"]
+            # If the type is 'PdpReviewForP3' and the review is in English, extract the comments
+            if typename == "PdpReviewForP3":
+                if "comments" in data and "language" in data and data["language"] == "en":
+                    reviews.append(data["comments"])
+            # If the type is 'LocalizedReview', extract the comments
+            elif typename == "LocalizedReview":
+                if "comments" in data:
+                    reviews.append(data["comments"])
+        # Recursively call this function for all dictionary values
+        for key, value in data.items():
+            recursive_extract(value, reviews)
+    elif isinstance(data, list):
+        # If the data is a list, recursively process each item in the list
+        for item in data:
+            recursive_extract(item, reviews)
+
+
+def extract_reviews(data, deduplicate=True):
+    """
+    Extract English reviews from one or more Airbnb review pages.
+
+    Pages with the known StaysPdpReviewsQuery shape are read straight from their 'PdpReviewForP3' nodes and
+    the nested 'LocalizedReview' translations. Only pages with an unknown shape are walked node by node
+    with recursive_extract. Both give the texts in the same order.
+
+    Args:
+        data (dict or list): One decoded response page, or a list of them.
+        deduplicate (bool): Skip reviews whose ID was already seen on an earlier page. Reviews shift between pages
+            while a listing is crawled, so the same review can be fetched twice.
+
+    Returns:
+        list: The raw (not yet cleaned) review texts.
+    """
+    pages = data if isinstance(data, list) else [data]
+    reviews = []
+    seen = set()
+    for page in pages:
+        nodes = get_review_nodes_from_airbnb(page)
+        if nodes is None:
+            recursive_extract(page, reviews)
+            continue
+        for node in nodes:
+            if deduplicate and node.get("id") is not None:
+                if node["id"] in seen:
+                    continue
+                seen.add(node["id"])
+            if "comments" in node and node.get("language") == "en":
+                reviews.append(node["comments"])
+            localized = node.get("localizedReview")
+            if isinstance(localized, dict) and localized.get("__typename") == "LocalizedReview" \
+                    and "comments" in localized:
+                reviews.append(localized["comments"])
+    return reviews
+
+
+def clean_reviews(reviews):
+    """
+    Remove HTML tags from many review texts with a single regex pass.
+
+    Args:
+        reviews (list): The review texts.
+
+    Returns:
+        list: The cleaned texts, in the same order.
+    """
+    if not reviews:
+        return []
+    cleaned = HTML_TAG_PATTERN.sub('', BATCH_SEPARATOR.join(reviews)).split(BATCH_SEPARATOR)
+    if len(cleaned) != len(reviews):
+        # A text contained the separator itself, clean them one by one
+        return [remove_html_tags(review) for review in reviews]
+    return cleaned
+
+
+def format_csv_rows(sentences):
+    """
+    Format sentences as rows of a single-column CSV, every field quoted (csv.QUOTE_ALL) and rows ending in '\\n'.
+
+    Building the text in one join is several times faster than csv.writer or pandas for large listings,
+    and gives byte-identical output.
+
+    Args:
+        sentences (iterable): The sentences to format.
+
+    Returns:
+        str: The CSV rows, without a header.
+    """
+    return ''.join(['"%s"\n' % sentence.replace('"', '""') for sentence in sentences])
+
+
+def write_sentences_csv(sentences, output_path):
+    """
+    Write sentences to a CSV file with a single quoted 'sentence' column.
+
+    Args:
+        sentences (iterable): The sentences to write.
+        output_path (str): Path of the CSV file.
+    """
+    with open(output_path, 'w', encoding='utf-8', newline='') as file:
+        file.write(CSV_HEADER)
+        file.write(format_csv_rows(sentences))
 
 
 def airbnb_csv(input_path, output_path):
@@ -18,43 +138,41 @@ def airbnb_csv(input_path, output_path):
     with open(input_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    # Recursive function to extract English reviews from the nested JSON structure
-    def recursive_extract(data, reviews):
-        if isinstance(data, dict):
-            # Check if the dictionary has a type identifier
-            if "__typename" in data:
-                typename = data["__typename"]
-                # If the type is 'PdpReviewForP3' and the review is in English, extract the comments
-                if typename == "PdpReviewForP3":
-                    if "comments" in data and "language" in data and data["language"] == "en":
-                        reviews.append(data["comments"])
-                # If the type is 'LocalizedReview', extract the comments
-                elif typename == "LocalizedReview":
-                    if "comments" in data:
-                        reviews.append(data["comments"])
-            # Recursively call this function for all dictionary values
-            for key, value in data.items():
-                recursive_extract(value, reviews)
-        elif isinstance(data, list):
-            # If the data is a list, recursively process each item in the list
-            for item in data:
-                recursive_extract(item, reviews)
-
-    # Function to remove HTML tags from the extracted comments
-    def remove_html_tags(text):
-        clean = re.compile('<.*?>')
-        return re.sub(clean, '', text)
-
-    reviews = []  # Initialize an empty list to store the extracted reviews
-    recursive_extract(data, reviews)  # Start the extraction process
-
-    # Clean the reviews by removing any HTML tags
-    cleaned_reviews = [remove_html_tags(review) for review in reviews]
+    reviews = extract_reviews(data)  # Extract the English reviews
+    cleaned_reviews = clean_reviews(reviews)  # Clean the reviews by removing any HTML tags
 
     # Save the cleaned reviews to a CSV file
-    df = pd.DataFrame({
-        "sentence": cleaned_reviews  # Create a DataFrame with a single column 'sentence'
-    })
-    df.to_csv(output_path, index=False, quoting=1)  # Save the DataFrame to a CSV file
+    write_sentences_csv(cleaned_reviews, output_path)
     print(f"English reviews have been extracted and saved to {output_path}")
 
+
+def english_sentences(records):
+    """
+    Select the English texts of compact review records, in the same order airbnb_csv extracts them.
+
+    Args:
+        records (list): Review records, see crawler.utils.fetch_data.get_reviews_from_airbnb.
+
+    Returns:
+        list: English originals and the English translations of the other reviews.
+    """
+    sentences = []
+    for record in records:
+        if record["language"] == "en" and record["text"] is not None:
+            sentences.append(record["text"])
+        if record["localized_text"] is not None:
+            sentences.append(record["localized_text"])
+    return sentences
+
+
+def airbnb_records_csv(records, output_path):
+    """
+    Save the English sentences of compact review records (see crawler.utils.fetch_data.get_reviews_from_airbnb)
+    to a CSV file, in the same format as airbnb_csv.
+
+    Args:
+        records (list): Review records extracted by the workers, texts are already free of HTML tags.
+        output_path (str): Path where the output CSV file with cleaned reviews will be saved.
+    """
+    write_sentences_csv(english_sentences(records), output_path)
+    print(f"English reviews have been extracted and saved to {output_path}")
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import math
+from array import array
+
+from crawler.utils.fetch_data import get_page_reviews, get_page_reviews_count
+
+# Multiplier of the Fibonacci hashing used to spread the keys over the slots
+FIBONACCI_MULTIPLIER = 11400714819323198485
+UINT64_MASK = (1 << 64) - 1
+
+
+class ReviewIdSet:
+    """
+    Memory-efficient set of review IDs.
+
+    Every ID is reduced to a 64-bit key (numeric Airbnb IDs are used as they are, other IDs are hashed) and kept in
+    an open-addressing table backed by array('Q'). That costs 16-32 bytes per review, against well over 100 bytes for
+    a Python set of ID strings, which matters for listings with very many reviews.
+
+    Args:
+        capacity (int): The initial number of slots, a power of two.
+    """
+
+    def __init__(self, capacity=1024):
+        self._bits = max(4, (capacity - 1).bit_length())
+        self._slots = array('Q', bytes(8 << self._bits))
+        self._size = 0
+        self._has_zero = False  # 0 marks an empty slot, so the key 0 is tracked separately
+
+    @staticmethod
+    def _key(review_id):
+        if isinstance(review_id, str) and review_id.isdigit():
+            key = int(review_id)
+            if key <= UINT64_MASK:
+                return key
+        return int.from_bytes(hashlib.blake2b(str(review_id).encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def _find(self, key):
+        # Index of the slot holding `key`, or of the empty slot where it belongs
+        mask = (1 << self._bits) - 1
+        index = ((key * FIBONACCI_MULTIPLIER) & UINT64_MASK) >> (64 - self._bits)
+        slots = self._slots
+        while slots[index] != 0 and slots[index] != key:
+            index = (index + 1) & mask
+        return index
+
+    def _grow(self):
+        old_slots = self._slots
+        self._bits += 1
+        self._slots = array('Q', bytes(8 << self._bits))
+        for key in old_slots:
+            if key != 0:
+                self._slots[self._find(key)] = key
+
+    def add(self, review_id):
+        """
+        Add a review ID.
+
+        Args:
+            review_id (str): The review ID.
+
+        Returns:
+            bool: True if the ID was not in the set yet.
+        """
+        key = self._key(review_id)
+        if key == 0:
+            added = not self._has_zero
+            self._has_zero = True
+            self._size += added
+            return added
+        index = self._find(key)
+        if self._slots[index] == key:
+            return False
+        self._slots[index] = key
+        self._size += 1
+        if self._size * 2 > len(self._slots):
+            self._grow()
+        return True
+
+    def __contains__(self, review_id):
+        key = self._key(review_id)
+        if key == 0:
+            return self._has_zero
+        return self._slots[self._find(key)] == key
+
+    def __len__(self):
+        return self._size
+
+
+class PaginationTracker:
+    """
+    De-duplicate the reviews of one listing across pages and find the offset ranges a crawl has missed.
+
+    Pages are fetched concurrently by offset while new reviews keep arriving in MOST_RECENT order, so reviews shift
+    between pages during a crawl. Every page reports the total review count at the time it was served. When the page
+    below a boundary saw more reviews than the page above it, the reviews that shifted across that boundary in
+    between were fetched by neither page. gap_offsets() turns those boundaries (and reviews posted in front after the
+    first page, or beyond the last planned page) into the offsets where the missing reviews are now.
+
+    Args:
+        page_size (int): The number of reviews per page.
+        seen (ReviewIdSet): IDs already written, e.g. by the interrupted run that is resumed.
+    """
+
+    def __init__(self, page_size=50, seen=None):
+        self.page_size = page_size
+        self.seen = seen if seen is not None else ReviewIdSet()
+        self.duplicates = 0
+        self.latest_count = None  # Review count reported by the most recently received page
+        self._page_counts = {}  # Offset of a planned page -> review count it reported
+        self._refetched = {}  # Offset fetched again to fill a gap -> review count it reported
+
+    def add_page(self, offset, page, refetch=False):
+        """
+        Register a fetched page and drop the reviews that were already seen.
+
+        Args:
+            offset (int): The offset the page was fetched at.
+            page (dict): The fetch_comments result.
+            refetch (bool): Whether the page was fetched to fill a gap rather than as part of the plan.
+
+        Returns:
+            dict: A page of extracted records holding only the new reviews, with the raw response under 'raw'
+                if the worker returned it. It can be passed to ReviewSink.write_page.
+        """
+        records, raw = get_page_reviews(page)
+        reviews_count = get_page_reviews_count(page)
+        self.add_count(offset, reviews_count, refetch)
+
+        # Reviews without an ID cannot be recognised again, they are always kept
+        new_records = [record for record in records if record['id'] is None or self.seen.add(record['id'])]
+        self.duplicates += len(records) - len(new_records)
+        new_page = {'offset': offset, 'reviews_count': reviews_count, 'reviews': new_records}
+        if raw is not None:
+            new_page['raw'] = raw
+        return new_page
+
+    def add_count(self, offset, reviews_count, refetch=False):
+        """
+        Register only the review count a page reported, for pages whose records are written elsewhere (shards).
+
+        Args:
+            offset (int): The offset the page was fetched at.
+            reviews_count (int): The total review count reported by the page.
+            refetch (bool): Whether the page was fetched to fill a gap rather than as part of the plan.
+        """
+        self.latest_count = reviews_count
+        if refetch:
+            self._refetched[offset] = reviews_count
+        else:
+            self._page_counts[offset] = reviews_count
+
+    def missing(self):
+        """
+        Return how many reviews are missing compared to the latest reported review count.
+        """
+        if self.latest_count is None:
+            return 0
+        return max(0, self.latest_count - len(self.seen))
+
+    def gap_offsets(self):
+        """
+        Return the offsets where the reviews missed by the crawl are expected now.
+
+        Returns:
+            list: Sorted offsets, without those already re-fetched since the review count last changed.
+        """
+        if not self._page_counts:
+            return []
+        latest = self.latest_count
+        windows = []  # [start, end) ranges of positions in the current ordering
+
+        first_count = self._page_counts.get(0)
+        if first_count is not None and latest > first_count:
+            # Reviews posted after the first page was served are now in front
+            windows.append((0, latest - first_count))
+
+        last_offset = max(self._page_counts)
+        for offset, lower_count in self._page_counts.items():
+            boundary = offset + self.page_size
+            upper_count = self._page_counts.get(boundary)
+            if upper_count is not None and lower_count > upper_count:
+                # Reviews shifted across the boundary between the two fetches
+                shift = latest - upper_count
+                windows.append((boundary - (lower_count - upper_count) + shift, boundary + shift))
+            elif offset == last_offset and lower_count > boundary:
+                # The listing grew beyond the last planned page
+                windows.append((boundary + latest - lower_count, latest))
+
+        # Reviews keep arriving while the gaps are fetched, widen every window by the drift expected meanwhile
+        pages_to_fetch = sum(max(0, end - max(0, start)) for start, end in windows) / self.page_size
+        drift_per_page = (latest - min(self._page_counts.values())) / len(self._page_counts)
+        margin = math.ceil(drift_per_page * pages_to_fetch)
+
+        offsets = set()
+        for start, end in windows:
+            for window_offset in range(max(0, start), end + margin, self.page_size):
+                if self._refetched.get(window_offset) != latest:
+                    offsets.add(window_offset)
+        return sorted(offsets)
+
+
+def load_seen_ids(ndjson_path):
+    """
+    Read the review IDs of an NDJSON review file into a ReviewIdSet, line by line.
+
+    Args:
+        ndjson_path (str): The review records file.
+
+    Returns:
+        ReviewIdSet: The IDs found in the file.
+    """
+    seen = ReviewIdSet()
+    with open(ndjson_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                review_id = json.loads(line).get('id')
+            except ValueError:
+                continue  # A line half written by an interrupted run
+            if review_id is not None:
+                seen.add(review_id)
+    return seen
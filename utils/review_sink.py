@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+
+from crawler.utils.fetch_data import get_page_reviews
+from utils.data_processing import CSV_HEADER, english_sentences, format_csv_rows
+
+# Called with the records of every page any ReviewSink of this process writes, see add_record_listener
+_record_listeners = []
+
+
+def add_record_listener(listener):
+    """
+    Hand the records of every page written from now on to `listener`, e.g. to analyse them while the crawl runs.
+
+    The listener is called on the thread that writes the page, once the page is in all files. Records copied from
+    earlier runs (resume, append) are not passed on, only the records of the pages written by this process.
+
+    Args:
+        listener (callable): Called with the list of records of one page.
+    """
+    _record_listeners.append(listener)
+
+
+def remove_record_listener(listener):
+    """
+    Stop handing records to a listener added with add_record_listener.
+    """
+    _record_listeners.remove(listener)
+
+
+class ReviewSink:
+    """
+    Write review pages to newline-delimited JSON and CSV files as they arrive.
+
+    Every page is appended and flushed right away, so memory use does not grow with the size of the listing
+    and the pages fetched so far are on disk if the run dies. The files are written under a '.part' suffix
+    and only renamed to their final names by finalize(), so a complete output file is never half written.
+
+    After every page the sizes of the files are appended to a journal (<ndjson_path>.part.pages). A resumed run cuts
+    the '.part' files back to the last sizes in the journal, so a page the interrupted run wrote to some of the files
+    only (the records but not yet the CSV rows) is dropped everywhere and fetched again as a whole.
+
+    Args:
+        ndjson_path (str): Final path of the review records, one JSON object per line.
+        csv_path (str): Final path of the CSV with one English sentence per row, like airbnb_csv.
+            No CSV is written when None (records without Airbnb texts, e.g. Booking.com reviews).
+        raw_path (str): Final path of the raw responses, one per line. Raw responses are not kept when None.
+        resume (bool): Continue the '.part' files left by an interrupted run instead of starting over, from the
+            last page written to all of them. If the run was interrupted right after finalizing, the finalized
+            files are continued instead. Read the IDs already written (load_seen_ids) only once the sink is open.
+        append (bool): Start from the finalized files of an earlier run and append to them.
+    """
+
+    def __init__(self, ndjson_path, csv_path, raw_path=None, resume=False, append=False):
+        self.paths = [path for path in (ndjson_path, csv_path, raw_path) if path is not None]
+        self.records_written = 0
+        self.sentences_written = 0
+        self.pages_written = 0
+        self._journal_path = ndjson_path + '.part.pages'
+
+        # A journal without '.part' files belongs to files that were finalized meanwhile
+        continued = resume and os.path.exists(ndjson_path + '.part') and os.path.exists(self._journal_path)
+        if continued:
+            self._roll_back()
+        self._ndjson_file = self._open(ndjson_path, resume, append)
+        self._csv_file = self._open(csv_path, resume, append) if csv_path is not None else None
+        self._raw_file = self._open(raw_path, resume, append) if raw_path is not None else None
+        if self._csv_file is not None and self._csv_file.tell() == 0:
+            self._csv_file.write(CSV_HEADER)
+        self._journal = open(self._journal_path, 'a' if continued else 'w', encoding='utf-8')
+        if not continued:
+            self._commit()  # The starting point: empty files, or the copies of the finalized ones
+
+    def _roll_back(self):
+        # Cut the '.part' files back to the end of the last page that was written to all of them
+        sizes = {}
+        with open(self._journal_path, encoding='utf-8') as file:
+            for line in file:
+                if line.endswith('\n'):  # The last line may be half written
+                    sizes = json.loads(line)
+        for path in self.paths:
+            part_path = path + '.part'
+            if os.path.exists(part_path) and os.path.getsize(part_path) > sizes.get(path, 0):
+                os.truncate(part_path, sizes.get(path, 0))
+
+    def _commit(self):
+        # Flush the files, then record where the last complete page ends
+        for file in self._files():
+            file.flush()
+        sizes = {path: os.fstat(file.fileno()).st_size for path, file in zip(self.paths, self._files())}
+        self._journal.write(json.dumps(sizes) + '\n')
+        self._journal.flush()
+
+    @staticmethod
+    def _open(path, resume, append):
+        part_path = path + '.part'
+        if resume and os.path.exists(part_path):
+            return open(part_path, 'a', encoding='utf-8', newline='')
+        if (resume or append) and os.path.exists(path):
+            shutil.copyfile(path, part_path)
+            return open(part_path, 'a', encoding='utf-8', newline='')
+        return open(part_path, 'w', encoding='utf-8', newline='')
+
+    def write_page(self, page, write_raw=True):
+        """
+        Append one fetch_comments result.
+
+        Args:
+            page (dict): A raw response, or a page of extracted records when the task ran with `extract`.
+                The records of raw responses are extracted here.
+            write_raw (bool): Whether to append the raw response. False for a page whose raw response is already in
+                the file, e.g. the first page of a resumed crawl, which is fetched again for its review count.
+        """
+        records, raw = get_page_reviews(page)
+
+        # One write per file and page keeps a crash from leaving more than the last page half written
+        self._ndjson_file.write(''.join([json.dumps(record, ensure_ascii=False) + '\n' for record in records]))
+        sentences = english_sentences(records) if self._csv_file is not None else []
+        if self._csv_file is not None:
+            self._csv_file.write(format_csv_rows(sentences))
+        if self._raw_file is not None and raw is not None and write_raw:
+            self._raw_file.write(json.dumps(raw, ensure_ascii=False) + '\n')
+
+        self._commit()
+        for listener in list(_record_listeners):
+            listener(records)
+        self.records_written += len(records)
+        self.sentences_written += len(sentences)
+        self.pages_written += 1
+
+    def _files(self):
+        return [file for file in (self._ndjson_file, self._csv_file, self._raw_file) if file is not None]
+
+    def close(self):
+        """
+        Close the '.part' files without renaming them, they stay on disk for inspection.
+        """
+        for file in self._files() + [self._journal]:
+            if not file.closed:
+                file.close()
+
+    def finalize(self):
+        """
+        Close the files and atomically rename them to their final names.
+        """
+        for file in self._files():
+            if not file.closed:
+                file.flush()
+                os.fsync(file.fileno())
+        self.close()
+        for path in self.paths:
+            os.replace(path + '.part', path)
+        os.remove(self._journal_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only a complete listing is published under the final names
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.close()
+        return False
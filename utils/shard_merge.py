@@ -0,0 +1,40 @@
+import hashlib
+import json
+
+from crawler.utils.shard_store import get_shard_store
+from utils.dedup import PaginationTracker
+from utils.review_sink import ReviewSink
+
+
+def merge_listing_shards(shard_store, manifest, ndjson_path, csv_path, raw_path=None):
+    """
+    Assemble the output files of one listing from the page shards written by the workers.
+
+    The shards are read one at a time in offset order, checked against their manifest entries, de-duplicated by
+    review ID and written through a ReviewSink, so the result is the same as with output='ndjson' and memory use
+    does not depend on the size of the listing. The shards are deleted once the files are in place.
+
+    Args:
+        shard_store (str): The shard store URL, see crawler.utils.shard_store.get_shard_store.
+        manifest (list): The manifest entries returned by the fetch tasks, in any order.
+        ndjson_path (str): Final path of the review records.
+        csv_path (str): Final path of the CSV with the English sentences.
+        raw_path (str): Final path of the raw responses, None to leave them out.
+
+    Returns:
+        tuple: (ReviewSink, PaginationTracker) with the counters of the merge.
+    """
+    store = get_shard_store(shard_store)
+    tracker = PaginationTracker()
+    # Planned pages first, pages re-fetched for gaps after them, like they arrive in the streaming path
+    entries = sorted(manifest, key=lambda entry: (entry.get('refetch', False), entry['offset']))
+    with ReviewSink(ndjson_path, csv_path, raw_path) as sink:
+        for entry in entries:
+            data = store.get(entry['path'])
+            if len(data) != entry['bytes'] or hashlib.sha256(data).hexdigest() != entry['sha256']:
+                raise ValueError(f"Shard {entry['path']} does not match its manifest entry")
+            sink.write_page(tracker.add_page(entry['offset'], json.loads(data),
+                                             refetch=entry.get('refetch', False)))
+    for entry in entries:
+        store.delete(entry['path'])
+    return sink, tracker
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def read_ids(lines):
+    """
+    Yield the listing IDs of a file or stream, one per line, without holding more than one line in memory.
+
+    Blank lines and lines starting with '#' are skipped.
+
+    Args:
+        lines (iterable): The lines, e.g. an open file or sys.stdin.
+
+    Yields:
+        str: One listing ID.
+    """
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def owner(key, nodes):
+    """
+    Return the node that owns a key: rendezvous (highest random weight) hashing.
+
+    Every node scores the key with a hash of (node, key) and the highest score wins, so all instances agree without
+    talking to each other, and when a node joins or leaves only the keys it wins or owned change hands.
+
+    Args:
+        key (str): The listing ID.
+        nodes (list): The names of the live nodes.
+
+    Returns:
+        str: The owning node, None if there are no nodes.
+    """
+    best, best_score = None, -1
+    for node in nodes:
+        digest = hashlib.blake2b(f'{node}\0{key}'.encode('utf-8'), digest_size=8).digest()
+        score = int.from_bytes(digest, 'big')
+        if score > best_score:
+            best, best_score = node, score
+    return best
+
+
+class StaticMembership:
+    """
+    A fixed list of orchestrator instances, e.g. from the command line.
+
+    Args:
+        nodes (list): The names of all instances.
+    """
+
+    def __init__(self, nodes):
+        self._nodes = sorted(set(nodes))
+
+    def nodes(self):
+        """Return the sorted names of the live instances."""
+        return self._nodes
+
+    def leave(self, done=False):
+        """Nothing to do, the list does not change."""
+
+
+class FileMembership:
+    """
+    The live orchestrator instances, kept as heartbeat files in a directory shared by all of them.
+
+    Every instance touches <directory>/<node>.json every `ttl` / 3 seconds from a background thread, so a busy
+    scheduler does not look dead. An instance whose file has not been touched for `ttl` seconds (it crashed or lost
+    the volume) is no longer live, one that is interrupted removes its file right away. Either way its keys move to
+    the others.
+
+    An instance that has crawled its whole share replaces its file by <directory>/<node>.done instead, and still
+    counts as an instance, so its keys stay with it and the others do not crawl them again. The markers belong to
+    the instances of one crawl: an instance that starts while no other one is live begins a new crawl and removes
+    them.
+
+    Args:
+        directory (str): The shared directory, e.g. shared_data/members on the volume shared by the pods.
+        node (str): The name of this instance, unique in the cluster.
+        ttl (float): The time (in seconds) after which a silent instance counts as gone.
+    """
+
+    def __init__(self, directory, node, ttl=30.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.node = node
+        self.ttl = ttl
+        self._path = os.path.join(directory, f'{node}.json')
+        self._done_path = os.path.join(directory, f'{node}.done')
+        self._stopped = threading.Event()
+        if not self._live_nodes(time.time()):
+            self._clear_done()
+        self._remove(self._done_path)
+        self._beat()
+        self._thread = threading.Thread(target=self._run, name='membership-heartbeat', daemon=True)
+        self._thread.start()
+
+    def _beat(self):
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump({'node': self.node, 'pid': os.getpid(), 'heartbeat': time.time()}, file)
+        os.replace(temporary_path, self._path)
+
+    def _run(self):
+        while not self._stopped.wait(self.ttl / 3):
+            self._beat()
+
+    def _live_nodes(self, now):
+        # The instances whose heartbeat is recent
+        nodes = set()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self.directory, name)) <= self.ttl:
+                    nodes.add(name[:-len('.json')])
+            except FileNotFoundError:
+                continue  # Removed while listing, the instance has left
+        return nodes
+
+    def _clear_done(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.done'):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def nodes(self):
+        """Return the sorted names of the live and the finished instances, this one included."""
+        nodes = self._live_nodes(time.time()) | {self.node}
+        nodes.update(name[:-len('.done')] for name in os.listdir(self.directory) if name.endswith('.done'))
+        return sorted(nodes)
+
+    def leave(self, done=False):
+        """
+        Stop the heartbeat and remove this instance.
+
+        Args:
+            done (bool): Whether this instance has crawled its whole share. It then stays an instance (a '.done'
+                marker) and keeps its keys, otherwise they move to the others.
+        """
+        self._stopped.set()
+        self._thread.join()
+        if done:
+            # The marker is in place before the heartbeat goes, so the instance never looks gone
+            with open(self._done_path, 'w', encoding='utf-8') as file:
+                json.dump({'node': self.node, 'pid': os.getpid(), 'done': time.time()}, file)
+        self._remove(self._path)
+
+
+class ShardedIds:
+    """
+    The listing IDs of an input that belong to this orchestrator instance, re-balanced as instances come and go.
+
+    Every instance reads the same input and keeps the IDs it owns (see owner) under the membership of the moment.
+    When the membership changes, the IDs read from then on are split over the new set of instances. If the input can
+    be read again (a file, not stdin), every pass is followed by another one over the whole input for the IDs that
+    this instance owns now but did not own when they were read, e.g. those of an instance that left, until a pass
+    ends without a change. Only the membership changes are remembered, not the IDs, so memory stays flat.
+
+    Args:
+        open_input (callable): Returns a fresh iterable of lines of the input, or None if it cannot be read again.
+        membership (StaticMembership or FileMembership): The live instances.
+        node (str): The name of this instance.
+        is_done (callable): Returns True for an ID that has been crawled recently, e.g. by the instance that owned it
+            before a re-balance, so it is not crawled twice. None crawls every owned ID.
+        refresh_interval (float): The minimum time (in seconds) between two reads of the membership.
+    """
+
+    def __init__(self, open_input, membership, node, is_done=None, refresh_interval=1.0):
+        self.open_input = open_input
+        self.membership = membership
+        self.node = node
+        self.is_done = is_done
+        self.refresh_interval = refresh_interval
+        self.ids_read = 0
+        self.ids_owned = 0
+        self.passes = 0
+        self._nodes = membership.nodes()
+        self._refreshed_at = time.monotonic()
+
+    def _current_nodes(self, refresh=False):
+        now = time.monotonic()
+        if refresh or now - self._refreshed_at >= self.refresh_interval:
+            nodes = self.membership.nodes()
+            if nodes != self._nodes:
+                print(f"Orchestrator instances changed: {self._nodes} -> {nodes}")
+                self._nodes = nodes
+            self._refreshed_at = now
+        return self._nodes
+
+    def __iter__(self):
+        lines = self.open_input()
+        history = []  # Per earlier pass: [(index of the first ID, nodes from there on)]
+        while True:
+            changes = [(0, self._current_nodes())]
+            self.passes += 1
+            for index, str_id in enumerate(read_ids(lines)):
+                if not history:
+                    self.ids_read += 1
+                nodes = self._current_nodes()
+                if nodes != changes[-1][1]:
+                    changes.append((index, nodes))
+                if owner(str_id, nodes) != self.node:
+                    continue
+                if history and self._owned_before(str_id, index, history):
+                    continue  # Handed out by an earlier pass
+                if self.is_done is not None and self.is_done(str_id):
+                    continue  # Crawled recently, e.g. by the instance that owned it before
+                self.ids_owned += 1
+                yield str_id
+            history.append(changes)
+            # Another pass is only needed if the instances changed since this one started
+            if len(changes) == 1 and self._current_nodes(refresh=True) == changes[0][1]:
+                return
+            lines = self.open_input()
+            if lines is None:
+                print("Orchestrator instances changed but the input cannot be read again, "
+                      "IDs read before the change are not re-assigned")
+                return
+
+    def _owned_before(self, str_id, index, history):
+        for changes in history:
+            nodes = changes[0][1]
+            for start, changed_nodes in changes:
+                if start > index:
+                    break
+                nodes = changed_nodes
+            if owner(str_id, nodes) == self.node:
+                return True
+        return False
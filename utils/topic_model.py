@@ -0,0 +1,450 @@
+"""
+Online topic model over the review texts the crawl writes.
+
+Texts are cleaned, tokenized and stop-word filtered in batches on a pool of processes, each batch becomes a sparse
+term-count matrix through a HashingVectorizer (no vocabulary to build or share, so the batches are independent), and
+an online LDA model is updated with every chunk through partial_fit. Memory stays bounded by the chunk size, the
+number of chunks being vectorized and the model itself (n_topics x n_features), however large the corpus is.
+
+scikit-learn and numpy are only imported here, the crawl path never loads them.
+
+Usage: python -m utils.topic_model shared_data/airbnb --topics 10 [--follow]
+"""
+import argparse
+import contextlib
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.data_processing import clean_reviews, english_sentences
+from utils.review_sink import add_record_listener, remove_record_listener
+
+# Buckets of the hashing vectorizer. More buckets mean fewer terms sharing a column, but a larger model:
+# 2^16 buckets x 10 topics is 5 MB.
+DEFAULT_FEATURES = 2 ** 16
+
+# Words of at least two letters, apostrophes allowed inside ("wasn't"). Numbers carry no topic.
+TOKEN_PATTERN = r"(?u)\b[^\W\d_]{2,}(?:'[^\W\d_]+)?\b"
+
+# Texts per batch whose terms are remembered to name the hashed columns. Frequent terms show up in any sample,
+# tokenizing every text a second time would double the cost of vectorizing.
+TERM_SAMPLE = 200
+
+# Bytes read from a record file at a time when following a crawl
+READ_SIZE = 2 ** 20
+
+# Pages of texts handed over by the sinks and not taken by the model yet, see topic_model_alongside
+QUEUED_PAGES = 100
+
+# Per process, built on first use in every vectorizing process
+_vectorizers = {}
+
+
+def _get_vectorizer(n_features):
+    vectorizer = _vectorizers.get(n_features)
+    if vectorizer is None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        # Term counts (no sign flipping, no normalization) as LDA expects
+        vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, lowercase=True,
+                                       stop_words='english', token_pattern=TOKEN_PATTERN)
+        _vectorizers[n_features] = vectorizer
+    return vectorizer
+
+
+def vectorize_batch(texts, n_features=DEFAULT_FEATURES):
+    """
+    Clean, tokenize and stop-word filter a batch of texts into a sparse term-count matrix.
+
+    Args:
+        texts (list): The review texts.
+        n_features (int): The number of hashing buckets (columns).
+
+    Returns:
+        tuple: (scipy.sparse.csr_matrix with one row per text that kept at least one term,
+            dict of column -> a term hashed to it, used to name the topics).
+    """
+    from sklearn.utils import murmurhash3_32
+
+    vectorizer = _get_vectorizer(n_features)
+    texts = clean_reviews(texts)
+    matrix = vectorizer.transform(texts)
+    analyzer = vectorizer.build_analyzer()
+    terms = {}
+    for term in set(itertools.chain.from_iterable(analyzer(text) for text in texts[:TERM_SAMPLE])):
+        terms.setdefault(abs(murmurhash3_32(term, seed=0)) % n_features, term)
+    return matrix[matrix.getnnz(axis=1) > 0], terms
+
+
+def record_texts(record):
+    """
+    Return the English texts of one review record written by ReviewSink, Airbnb or Booking.com.
+
+    Args:
+        record (dict): An Airbnb record (see crawler.utils.fetch_data.get_reviews_from_airbnb) or a Booking.com
+            review card.
+
+    Returns:
+        list: The texts, possibly empty.
+    """
+    if 'textDetails' in record:
+        details = record['textDetails'] or {}
+        if details.get('lang', 'en') != 'en':
+            return []
+        return [text for text in (details.get('positiveText'), details.get('negativeText')) if text]
+    return english_sentences([record])
+
+
+def record_files(directory, include_part=False):
+    """
+    Return the review record files in a crawl output directory, without the raw response files.
+
+    Args:
+        directory (str): The output directory, e.g. 'shared_data/airbnb'.
+        include_part (bool): Also return the '.part' files of listings still being crawled.
+
+    Returns:
+        list: The paths, sorted.
+    """
+    patterns = ['*.ndjson', '*.ndjson.part'] if include_part else ['*.ndjson']
+    paths = itertools.chain.from_iterable(glob.glob(os.path.join(directory, pattern)) for pattern in patterns)
+    return sorted(path for path in paths if not path.endswith(('.raw.ndjson', '.raw.ndjson.part')))
+
+
+def iter_review_texts(paths):
+    """
+    Yield the English review texts of NDJSON record files, line by line.
+
+    Args:
+        paths (iterable): Paths of *.ndjson files written by ReviewSink.
+
+    Yields:
+        str: One review text.
+    """
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                yield from record_texts(json.loads(line))
+
+
+def _copied_size(part_path):
+    """
+    Return the size a '.part' record file had when its ReviewSink opened it, from the first entry of its journal.
+
+    It is the size of the finalized file it was copied from (append, resume after finalizing), 0 for a new file.
+    None while the journal is not written yet, the file may still be being copied.
+    """
+    try:
+        with open(part_path + '.pages', encoding='utf-8') as file:
+            first = file.readline()
+    except FileNotFoundError:
+        return None
+    if not first.endswith('\n'):
+        return None
+    return json.loads(first).get(part_path[:-len('.part')], 0)
+
+
+def follow_review_texts(directory, stop, poll_interval=0.5, since=None):
+    """
+    Yield the English review texts of the NDJSON record files in a directory as the crawl appends to them.
+
+    Used to analyse a crawl running in other processes (the --follow option). A crawl in this process hands its
+    records over directly instead, see topic_model_alongside.
+
+    Files are read up to their last complete line and read again when they grow, so a listing being crawled is
+    analysed page by page. Only the offset of every file is kept between polls, no file stays open. A '.part' file
+    is read from the end of the finalized file it was copied from (append, resume), so earlier runs are not read
+    twice, and the offset carries over when it is renamed to its final name. A final file read to its end is
+    skipped from then on, until a '.part' file replaces it. Raw response files are skipped.
+
+    Args:
+        directory (str): The output directory of the crawl, e.g. 'shared_data/airbnb'.
+        stop (callable): Returns True once no more records will be written, the generator then reads what is left
+            and ends.
+        poll_interval (float): The time (in seconds) to wait when there is nothing new.
+        since (float): Ignore finalized files last modified before this time.time() value, e.g. the output of
+            earlier crawls.
+
+    Yields:
+        str: One review text.
+    """
+    offsets = {}  # Path of a file being read -> (offset of the next byte, unfinished line)
+    finished = set()  # Paths of final files read to their end
+    while True:
+        stopping = stop()  # Read before the last scan, so records written before stopping are not missed
+        progress = False
+        paths = record_files(directory, include_part=True)
+        listed = set(paths)
+        for part_path in [path for path in offsets if path.endswith('.part') and path not in listed]:
+            # Finalized, or deleted: the final file is the same file, continue at the same offset
+            state = offsets.pop(part_path)
+            if part_path[:-len('.part')] in listed:
+                offsets[part_path[:-len('.part')]] = state
+                finished.discard(part_path[:-len('.part')])
+        for path in paths:
+            if path in finished:
+                continue
+            final = not path.endswith('.part')
+            if path not in offsets:
+                if final:
+                    try:
+                        if since is not None and os.path.getmtime(path) < since:
+                            finished.add(path)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    offsets[path] = (0, b'')
+                else:
+                    copied = _copied_size(path)
+                    if copied is None:
+                        continue  # Picked up once its sink has written the journal
+                    offsets[path] = (copied, b'')
+            offset, unfinished = offsets[path]
+            try:
+                file = open(path, 'rb')
+            except FileNotFoundError:
+                continue  # Renamed between the scan and the open, continued under its new name
+            with file:
+                size = os.fstat(file.fileno()).st_size
+                if size < offset:
+                    # Cut back to its last complete page by a resumed sink, the page is written again
+                    offset, unfinished = size, b''
+                file.seek(offset)
+                for data in iter(lambda: file.read(READ_SIZE), b''):
+                    progress = True
+                    offset += len(data)
+                    lines = (unfinished + data).split(b'\n')
+                    unfinished = lines.pop()
+                    for line in lines:
+                        if line:
+                            yield from record_texts(json.loads(line))
+            if final:
+                del offsets[path]
+                finished.add(path)
+            else:
+                offsets[path] = (offset, unfinished)
+        if stopping and not progress:
+            break
+        if not progress:
+            time.sleep(poll_interval)
+
+
+class TopicModelStage:
+    """
+    Fit an online LDA topic model chunk by chunk on a stream of texts.
+
+    The texts are cut into chunks of `chunk_size`, every chunk is vectorized on one of `workers` processes, and the
+    model is updated with the chunks in order while the next ones are being vectorized. At most `max_pending` chunks
+    are waiting at any time, so memory stays flat whether the stream holds a thousand reviews or a billion.
+
+    Args:
+        n_topics (int): The number of topics.
+        n_features (int): The number of hashing buckets, see DEFAULT_FEATURES.
+        chunk_size (int): The number of texts per partial_fit update.
+        workers (int): The number of vectorizing processes, 0 vectorizes in this process.
+        max_pending (int): The maximum number of chunks being vectorized or waiting, 2 per worker by default.
+        total_samples (int): The expected corpus size, it weighs every update (LatentDirichletAllocation).
+        seed (int): The random state of the model.
+    """
+
+    def __init__(self, n_topics=10, n_features=DEFAULT_FEATURES, chunk_size=2000, workers=None, max_pending=None,
+                 total_samples=1e6, seed=0):
+        from sklearn.decomposition import LatentDirichletAllocation
+
+        self.n_features = n_features
+        self.chunk_size = chunk_size
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.max_pending = max_pending if max_pending is not None else max(1, 2 * self.workers)
+        self.model = LatentDirichletAllocation(n_components=n_topics, learning_method='online',
+                                               total_samples=total_samples, random_state=seed)
+        self.documents = 0
+        self.chunks = 0
+        self.seconds = 0.0
+        self._terms = {}  # Column -> a term hashed to it, at most n_features entries
+
+    def _update(self, matrix, terms):
+        for column, term in terms.items():
+            self._terms.setdefault(column, term)
+        if matrix.shape[0]:
+            self.model.partial_fit(matrix)
+            self.documents += matrix.shape[0]
+            self.chunks += 1
+
+    def run(self, texts):
+        """
+        Update the model with every text of an iterable, e.g. follow_review_texts while a crawl is running.
+
+        Args:
+            texts (iterable): The texts.
+
+        Returns:
+            TopicModelStage: self.
+        """
+        start = time.perf_counter()
+        texts = iter(texts)
+        chunks = iter(lambda: list(itertools.islice(texts, self.chunk_size)), [])
+        if not self.workers:
+            for chunk in chunks:
+                self._update(*vectorize_batch(chunk, self.n_features))
+        else:
+            # 'spawn' keeps the pool independent of the crawl's threads and connections in this process
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(vectorize_batch, chunk, self.n_features))
+                    if len(pending) >= self.max_pending:
+                        self._update(*pending.popleft().result())
+                while pending:
+                    self._update(*pending.popleft().result())
+        self.seconds += time.perf_counter() - start
+        return self
+
+    def top_terms(self, n=10):
+        """
+        Return the `n` most likely terms of every topic.
+
+        Returns:
+            list: One list of terms per topic.
+        """
+        topics = []
+        for weights in self.model.components_:
+            columns = [column for column in weights.argsort()[::-1] if column in self._terms][:n]
+            topics.append([self._terms[column] for column in columns])
+        return topics
+
+    def transform(self, texts):
+        """
+        Return the topic distribution of every text.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            numpy.ndarray: One row of topic weights per text (texts without any term get the prior).
+        """
+        vectorizer = _get_vectorizer(self.n_features)
+        return self.model.transform(vectorizer.transform(clean_reviews(list(texts))))
+
+    def save(self, path):
+        """
+        Write the topics and the corpus statistics to a JSON file.
+
+        Args:
+            path (str): Path of the JSON file.
+        """
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'documents': self.documents, 'chunks': self.chunks, 'topics': self.top_terms()}, file,
+                      ensure_ascii=False, indent=2)
+
+
+def _queued_texts(pages):
+    # The texts of the pages put on the queue, until None
+    for texts in iter(pages.get, None):
+        yield from texts
+
+
+@contextlib.contextmanager
+def topic_model_alongside(n_topics, output_path=None, **options):
+    """
+    Fit a topic model on the reviews the crawl in the `with` block writes, while it runs.
+
+    Every ReviewSink of this process hands the records of the pages it writes to the model (add_record_listener),
+    through a queue of at most QUEUED_PAGES pages, so nothing is polled and a crawl that outruns the model waits for
+    it instead of piling up texts. The model runs on a background thread, its vectorizing processes do the
+    tokenizing. When the block ends, the queued reviews are consumed, the topics are printed and, with
+    `output_path`, saved.
+
+    Args:
+        n_topics (int): The number of topics.
+        output_path (str): Path of the JSON file the topics are saved to, see TopicModelStage.save.
+        **options: Further TopicModelStage arguments.
+
+    Yields:
+        TopicModelStage: The stage, complete once the block has ended.
+
+    Raises:
+        Exception: The error that stopped the model, once the block has ended.
+    """
+    stage = TopicModelStage(n_topics, **options)
+    pages = queue.Queue(QUEUED_PAGES)
+    errors = []
+
+    def run():
+        try:
+            stage.run(_queued_texts(pages))
+        except Exception as exc:
+            errors.append(exc)
+
+    def on_records(records):
+        texts = [text for record in records for text in record_texts(record)]
+        while texts and thread.is_alive():  # A model that failed takes no more texts, the crawl goes on
+            try:
+                pages.put(texts, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    thread = threading.Thread(target=run, name='topic-model', daemon=True)
+    thread.start()
+    add_record_listener(on_records)
+    try:
+        yield stage
+    finally:
+        remove_record_listener(on_records)
+        while thread.is_alive():
+            try:
+                pages.put(None, timeout=1.0)
+                break
+            except queue.Full:
+                continue
+        thread.join()
+    if errors:
+        raise errors[0]
+    rate = stage.documents / stage.seconds if stage.seconds > 0 else 0.0
+    print(f"Topic model: {stage.documents} documents in {stage.chunks} chunks, {rate:.0f} documents/s")
+    for index, terms in enumerate(stage.top_terms()):
+        print(f"Topic {index}: {' '.join(terms)}")
+    if output_path is not None:
+        stage.save(output_path)
+        print(f"Topics have saved to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='crawl output directory with *.ndjson record files')
+    parser.add_argument('--topics', type=int, default=10)
+    parser.add_argument('--features', type=int, default=DEFAULT_FEATURES)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--workers', type=int, help='vectorizing processes, by default one per CPU but one')
+    parser.add_argument('--follow', action='store_true', help='keep reading the files as they grow, until Ctrl-C')
+    parser.add_argument('--output', help='write the topics to this JSON file')
+    args = parser.parse_args()
+
+    stage = TopicModelStage(args.topics, args.features, args.chunk_size, args.workers)
+    if args.follow:
+        texts = follow_review_texts(args.directory, stop=lambda: False)
+    else:
+        texts = iter_review_texts(record_files(args.directory))
+    try:
+        stage.run(texts)
+    except KeyboardInterrupt:
+        pass
+    rate = stage.documents / stage.seconds if stage.seconds > 0 else 0.0
+    print(f"Topic model: {stage.documents} documents in {stage.chunks} chunks, {stage.seconds:.2f} seconds, "
+          f"{rate:.0f} documents/s")
+    for index, terms in enumerate(stage.top_terms()):
+        print(f"Topic {index}: {' '.join(terms)}")
+    if args.output:
+        stage.save(args.output)
+
+
+if __name__ == '__main__':
+    main()